@@ -1,10 +1,193 @@
 import argparse
+import csv
+import json
+import os
+import re
+import time
+from functools import lru_cache
 from pathlib import Path
 
 import pandas as pd
 
+from results import METRIC_COLUMNS, write_results
 
-def save_sorted_results(output_file, results):
+hILS_list = [False, True]
+dup_rate_list = ["1e-9", "1e-10", "5e-10", "1e-11", "1e-12", "1e-13"]
+loss_rate_indicator_list = [1, 0]
+num_species_list = [20, 50, 100]
+run_id_list = range(1, 11)
+n_genes_list = [50, 100, 500, 1000]
+g_type_list = ["true", 50, 100, 500]
+mult_list = [1, 5, 10, 50]
+
+METHODS = {"qr": "DISCO+QR", "qrstar": "DISCO+QR-STAR"}
+
+SCORE_PATTERN = re.compile(
+    r"(?P<num_species>\d+)_gdl_(?P<dup_rate>[^_/]+)_(?P<loss_rate_indicator>\d+)"
+    r"(?P<hILS>_hILS)?/(?P<run_id>\d+)/(?P<g_type>[^/]+)g/(?P<n_genes>\d+)/"
+    r"(?:stride/(?P<stride_s_tree>[^/]+)"
+    r"|disco/(?P<unrooted_s_tree>[^/]+)/(?P<rs_est_method>qr|qrstar)"
+    r"/(?P<sampling_method>[^/]+)/(?P<sampling_mult>\d+))"
+    r"/s_rooted_est\.score"
+)
+
+
+# /usr/bin/time -v fields recorded for every stage
+TIME_FIELDS = {
+    "Elapsed (wall clock) time (h:mm:ss or m:ss)": "wall_time",
+    "User time (seconds)": "user_time",
+    "System time (seconds)": "sys_time",
+    "Maximum resident set size (kbytes)": "max_rss",
+}
+
+# lines of the reports of quintets.Sweep naming the report of the sweep a
+# run was part of, and listing the runs of a sweep
+SWEEP_FIELD = "Quintet sweep report"
+RUNS_FIELD = "Quintet sweep runs"
+
+
+@lru_cache(maxsize=4096)
+def parse_time_log(path):
+    """
+    Wall, user and system time in seconds and maximum resident set size in
+    kbytes from the /usr/bin/time -v report in a run.err file, as a tuple
+    of (column, value) pairs. Values are None if the file or field is
+    missing.
+    """
+    values = dict.fromkeys(TIME_FIELDS.values())
+    try:
+        f = open(path)
+    except OSError:
+        return tuple(values.items())
+
+    with f:
+        for line in f:
+            field, _, value = line.strip().rpartition(": ")
+            if field not in TIME_FIELDS:
+                continue
+            if field.startswith("Elapsed"):
+                seconds = 0.0
+                for part in value.split(":"):
+                    seconds = seconds * 60 + float(part)
+                values["wall_time"] = seconds
+            elif field.startswith("Maximum"):
+                values["max_rss"] = int(value)
+            else:
+                values[TIME_FIELDS[field]] = float(value)
+    return tuple(values.items())
+
+
+@lru_cache(maxsize=4096)
+def sweep_report(path):
+    """
+    Path of the report of the quintets.Sweep the run with the report in
+    path was part of, or None for a run of its own. The time of a run in a
+    sweep depends on the runs before it, so only that of the sweep counts.
+    """
+    field = f"{SWEEP_FIELD}: "
+    try:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith(field):
+                    return os.path.join(os.path.dirname(path), line[len(field) :])
+    except OSError:
+        pass
+    return None
+
+
+def sweep_runs(path):
+    """Stage directories (relative to the species tree) of a sweep report."""
+    field = f"{RUNS_FIELD}: "
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(field):
+                return line[len(field) :].split()
+    return []
+
+
+@lru_cache(maxsize=4096)
+def disco_time_log(cell_dir):
+    """
+    parse_time_log of the DISCO run of a cell. For a cell whose g_single.trees
+    pipeline.py concatenated from DISCO blocks (listed in disco/blocks), the
+    times of the blocks are summed and the memory is their maximum.
+    """
+    disco_dir = cell_dir / "disco"
+    try:
+        blocks = (disco_dir / "blocks").read_text().split()
+    except OSError:
+        return parse_time_log(str(disco_dir / "run.err"))
+
+    values = dict.fromkeys(TIME_FIELDS.values(), 0)
+    for block in blocks:
+        for column, value in parse_time_log(str(disco_dir / block / "run.err")):
+            if value is None or values[column] is None:
+                values[column] = None
+            elif column == "max_rss":
+                values[column] = max(values[column], value)
+            else:
+                values[column] += value
+    return tuple(values.items())
+
+
+@lru_cache(maxsize=1024)
+def replicate_metrics(replicate_dir):
+    """
+    METRIC_COLUMNS of the rooted trees of a replicate from the metrics.tsv
+    that ncd.py writes there, by tree path relative to replicate_dir.
+    """
+    metrics = {}
+    try:
+        f = open(replicate_dir / "metrics.tsv", newline="")
+    except OSError:
+        return metrics
+
+    with f:
+        for row in csv.DictReader(f, delimiter="\t"):
+            metrics[row["tree"]] = {
+                column: float(row[column]) if row.get(column) else None
+                for column in METRIC_COLUMNS
+            }
+    return metrics
+
+
+def tree_metrics(replicate_dir, score_fp):
+    """METRIC_COLUMNS of the tree scored in score_fp, None where missing."""
+    tree = os.path.relpath(score_fp.with_suffix(".tree"), replicate_dir)
+    metrics = replicate_metrics(replicate_dir).get(tree, {})
+    return {column: metrics.get(column) for column in METRIC_COLUMNS}
+
+
+def stage_resources(cell_dir, unrooted_s_tree, stage_dir):
+    """
+    Resource columns of one result: the time and memory of the stage that
+    rooted the tree, of DISCO (disco_*) and of the unrooted species tree
+    estimation (s_tree_*) in the same (g_type, n_genes) cell. A QR or
+    QR-STAR run of a pipeline.py sweep has no time of its own: it gets
+    that of the whole sweep (sweep_*) instead.
+    """
+    s_tree_log = cell_dir / "disco" / unrooted_s_tree / "run.err"
+    stage_log = parse_time_log(str(stage_dir / "run.err"))
+    sweep_log = tuple(dict.fromkeys(TIME_FIELDS.values()).items())
+    sweep_fp = sweep_report(str(stage_dir / "run.err"))
+    if sweep_fp is not None:
+        stage_log, sweep_log = sweep_log, parse_time_log(sweep_fp)
+    logs = [
+        ("", stage_log),
+        ("disco_", disco_time_log(cell_dir)),
+        ("s_tree_", parse_time_log(str(s_tree_log))),
+        ("sweep_", sweep_log),
+    ]
+    row = {}
+    for prefix, log in logs:
+        for column, value in log:
+            row[f"{prefix}{column}"] = value
+    return row
+
+
+def save_sorted_results(output_file, results, partitions=None):
     df = pd.DataFrame(results)
     df.sort_values(
         by=[
@@ -23,7 +206,7 @@ def save_sorted_results(output_file, results):
         inplace=True,
     )
     df.reset_index(drop=True, inplace=True)
-    df.to_csv(output_file, index=False)
+    write_results(df, output_file, partitions=partitions)
 
 
 def parse_args():
@@ -43,117 +226,86 @@ def parse_args():
         default=None,
     )
     parser.add_argument(
-        "--output", type=str, required=True, help="Output CSV file path."
+        "--output",
+        type=str,
+        required=True,
+        help="Output CSV file path, or .parquet results store path.",
+    )
+    parser.add_argument(
+        "--scan",
+        action="store_true",
+        help="Walk the input directory once instead of probing the parameter grid.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=10000,
+        help="Number of rows appended between checkpoints.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only reread score files that changed since the last run, "
+        "tracked in a manifest next to the output.",
     )
     return parser.parse_args()
 
 
-args = parse_args()
-input_dir = Path(args.input)
-output_file = Path(args.output)
-if args.reference:
-    reference_dir = Path(args.reference)
-    assert (
-        reference_dir.is_dir()
-    ), f"Reference directory {reference_dir} does not exist."
-else:
-    reference_dir = None
-
-assert input_dir.is_dir(), f"Input directory {input_dir} does not exist."
+def grid_results(input_dir, reference_dir, done=()):
+    """
+    Probe every combination of the hard-coded parameter lists for score
+    files, yielding (replicate, rows) for each replicate not in done.
+    """
+    for loss_rate_indicator in loss_rate_indicator_list:
+        for hILS in hILS_list:
+            for dup_rate in dup_rate_list:
+                for num_species in num_species_list:
+                    for run_id in run_id_list:
+                        id = f"{num_species}_gdl_{dup_rate}_{loss_rate_indicator}"
+                        if hILS:
+                            id = f"{id}_hILS"
 
-assert (
-    output_file.parent.is_dir()
-), f"Output directory {output_file.parent} does not exist."
-
-hILS_list = [False, True]
-dup_rate_list = ["1e-9", "1e-10", "5e-10", "1e-11", "1e-12", "1e-13"]
-loss_rate_indicator_list = [1, 0]
-num_species_list = [20, 50, 100]
-run_id_list = range(1, 11)
-n_genes_list = [50, 100, 500, 1000]
-g_type_list = ["true", 50, 100, 500]
-mult_list = [1, 5, 10, 50]
-
-results = []
-
-for loss_rate_indicator in loss_rate_indicator_list:
-    for hILS in hILS_list:
-        for dup_rate in dup_rate_list:
-            for num_species in num_species_list:
-                for run_id in run_id_list:
-                    id = f"{num_species}_gdl_{dup_rate}_{loss_rate_indicator}"
-                    if hILS:
-                        id = f"{id}_hILS"
-
-                    if reference_dir:
-                        subref_dir = Path(f"{reference_dir}/{id}/{run_id:02d}")
-                        if not subref_dir.exists():
+                        replicate = f"{id}/{run_id:02d}"
+                        if replicate in done:
                             continue
 
-                    print(f"Running id {id} {run_id}")
-
-                    subroot_dir = Path(f"{input_dir}/{id}/{run_id:02d}")
-
-                    if not subroot_dir.is_dir():
-                        # print(
-                        #     f"Output directory {subroot_dir} does not exist. Skipping {id} {run_id}."
-                        # )
-                        continue
-
-                    for g_type in g_type_list:
                         if reference_dir:
-                            g_fp = subref_dir / f"g_{g_type}.trees"
-                            if not g_fp.is_file():
+                            subref_dir = Path(f"{reference_dir}/{id}/{run_id:02d}")
+                            if not subref_dir.exists():
                                 continue
 
-                        for n_genes in n_genes_list:
-                            for unrooted_s_tree in ["trues", "astrid", "astral"]:
-                                ncd_stride_fp = (
-                                    subroot_dir
-                                    / f"{g_type}g"
-                                    / f"{n_genes}"
-                                    / "stride"
-                                    / f"{unrooted_s_tree}"
-                                    / "s_rooted_est.score"
-                                )
-
-                                if ncd_stride_fp.is_file():
-                                    ncd_stride = float(
-                                        ncd_stride_fp.read_text().strip()
-                                    )
+                        print(f"Running id {id} {run_id}")
 
-                                    results.append(
-                                        {
-                                            "num_species": num_species,
-                                            "unrooted_s_tree": unrooted_s_tree,
-                                            "n_genes": n_genes,
-                                            "dup_rate": dup_rate,
-                                            "loss_rate_indicator": loss_rate_indicator,
-                                            "hILS": hILS,
-                                            "g_type": g_type,
-                                            "run_id": run_id,
-                                            "method": "STRIDE",
-                                            "sampling_method": None,
-                                            "sampling_mult": None,
-                                            "ncd": ncd_stride,
-                                        }
-                                    )
+                        subroot_dir = Path(f"{input_dir}/{id}/{run_id:02d}")
 
-                                for mult in mult_list:
-                                    ncd_qr_fp = (
+                        if not subroot_dir.is_dir():
+                            # print(
+                            #     f"Output directory {subroot_dir} does not exist. Skipping {id} {run_id}."
+                            # )
+                            continue
+
+                        results = []
+                        for g_type in g_type_list:
+                            if reference_dir:
+                                g_fp = subref_dir / f"g_{g_type}.trees"
+                                if not g_fp.is_file():
+                                    continue
+
+                            for n_genes in n_genes_list:
+                                for unrooted_s_tree in ["trues", "astrid", "astral"]:
+                                    ncd_stride_fp = (
                                         subroot_dir
                                         / f"{g_type}g"
                                         / f"{n_genes}"
-                                        / "disco"
+                                        / "stride"
                                         / f"{unrooted_s_tree}"
-                                        / "qr"
-                                        / "le"
-                                        / f"{mult}"
-                                        / f"s_rooted_est.score"
+                                        / "s_rooted_est.score"
                                     )
 
-                                    if ncd_qr_fp.is_file():
-                                        ncd_qr = float(ncd_qr_fp.read_text().strip())
+                                    if ncd_stride_fp.is_file():
+                                        ncd_stride = float(
+                                            ncd_stride_fp.read_text().strip()
+                                        )
 
                                         results.append(
                                             {
@@ -165,46 +317,490 @@ for loss_rate_indicator in loss_rate_indicator_list:
                                                 "hILS": hILS,
                                                 "g_type": g_type,
                                                 "run_id": run_id,
-                                                "method": f"DISCO+QR",
-                                                "sampling_method": "le",
-                                                "sampling_mult": mult,
-                                                "ncd": ncd_qr,
+                                                "method": "STRIDE",
+                                                "sampling_method": None,
+                                                "sampling_mult": None,
+                                                "ncd": ncd_stride,
+                                                **tree_metrics(
+                                                    subroot_dir, ncd_stride_fp
+                                                ),
+                                                **stage_resources(
+                                                    ncd_stride_fp.parents[2],
+                                                    unrooted_s_tree,
+                                                    ncd_stride_fp.parent,
+                                                ),
                                             }
                                         )
 
-                                    ncd_qrstar_fp = (
-                                        subroot_dir
-                                        / f"{g_type}g"
-                                        / f"{n_genes}"
-                                        / "disco"
-                                        / f"{unrooted_s_tree}"
-                                        / "qrstar"
-                                        / "le"
-                                        / f"{mult}"
-                                        / f"s_rooted_est.score"
-                                    )
-
-                                    if ncd_qrstar_fp.is_file():
-                                        ncd_qrstar = float(
-                                            ncd_qrstar_fp.read_text().strip()
+                                    for mult in mult_list:
+                                        ncd_qr_fp = (
+                                            subroot_dir
+                                            / f"{g_type}g"
+                                            / f"{n_genes}"
+                                            / "disco"
+                                            / f"{unrooted_s_tree}"
+                                            / "qr"
+                                            / "le"
+                                            / f"{mult}"
+                                            / f"s_rooted_est.score"
                                         )
 
-                                        results.append(
-                                            {
-                                                "num_species": num_species,
-                                                "unrooted_s_tree": unrooted_s_tree,
-                                                "n_genes": n_genes,
-                                                "dup_rate": dup_rate,
-                                                "loss_rate_indicator": loss_rate_indicator,
-                                                "hILS": hILS,
-                                                "g_type": g_type,
-                                                "run_id": run_id,
-                                                "method": f"DISCO+QR-STAR",
-                                                "sampling_method": "le",
-                                                "sampling_mult": mult,
-                                                "ncd": ncd_qrstar,
-                                            }
+                                        if ncd_qr_fp.is_file():
+                                            ncd_qr = float(
+                                                ncd_qr_fp.read_text().strip()
+                                            )
+
+                                            results.append(
+                                                {
+                                                    "num_species": num_species,
+                                                    "unrooted_s_tree": unrooted_s_tree,
+                                                    "n_genes": n_genes,
+                                                    "dup_rate": dup_rate,
+                                                    "loss_rate_indicator": loss_rate_indicator,
+                                                    "hILS": hILS,
+                                                    "g_type": g_type,
+                                                    "run_id": run_id,
+                                                    "method": f"DISCO+QR",
+                                                    "sampling_method": "le",
+                                                    "sampling_mult": mult,
+                                                    "ncd": ncd_qr,
+                                                    **tree_metrics(
+                                                        subroot_dir, ncd_qr_fp
+                                                    ),
+                                                    **stage_resources(
+                                                        ncd_qr_fp.parents[5],
+                                                        unrooted_s_tree,
+                                                        ncd_qr_fp.parent,
+                                                    ),
+                                                }
+                                            )
+
+                                        ncd_qrstar_fp = (
+                                            subroot_dir
+                                            / f"{g_type}g"
+                                            / f"{n_genes}"
+                                            / "disco"
+                                            / f"{unrooted_s_tree}"
+                                            / "qrstar"
+                                            / "le"
+                                            / f"{mult}"
+                                            / f"s_rooted_est.score"
                                         )
 
-                save_sorted_results(output_file, results)
-save_sorted_results(output_file, results)
+                                        if ncd_qrstar_fp.is_file():
+                                            ncd_qrstar = float(
+                                                ncd_qrstar_fp.read_text().strip()
+                                            )
+
+                                            results.append(
+                                                {
+                                                    "num_species": num_species,
+                                                    "unrooted_s_tree": unrooted_s_tree,
+                                                    "n_genes": n_genes,
+                                                    "dup_rate": dup_rate,
+                                                    "loss_rate_indicator": loss_rate_indicator,
+                                                    "hILS": hILS,
+                                                    "g_type": g_type,
+                                                    "run_id": run_id,
+                                                    "method": f"DISCO+QR-STAR",
+                                                    "sampling_method": "le",
+                                                    "sampling_mult": mult,
+                                                    "ncd": ncd_qrstar,
+                                                    **tree_metrics(
+                                                        subroot_dir, ncd_qrstar_fp
+                                                    ),
+                                                    **stage_resources(
+                                                        ncd_qrstar_fp.parents[5],
+                                                        unrooted_s_tree,
+                                                        ncd_qrstar_fp.parent,
+                                                    ),
+                                                }
+                                            )
+
+                        yield replicate, results
+
+
+def iter_score_files(root):
+    """
+    Paths (relative to root) of all s_rooted_est.score files below root,
+    reading each directory once and never descending into split/.
+    """
+    stack = [""]
+    while stack:
+        rel = stack.pop()
+        with os.scandir(os.path.join(root, rel)) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != "split":
+                        stack.append(f"{rel}{entry.name}/")
+                elif entry.name == "s_rooted_est.score":
+                    yield f"{rel}{entry.name}"
+
+
+def score_row(input_dir, path, reference_dir=None, in_reference=None):
+    """
+    Result row of the score file at path (relative to input_dir), with the
+    parameters parsed from the path, or None if path is not the score of a
+    result or, with a reference_dir, its gene trees are missing from the
+    reference. in_reference memoizes the reference lookups.
+    """
+    m = SCORE_PATTERN.fullmatch(path)
+    if m is None:
+        return None
+    f = m.groupdict()
+
+    g_type = int(f["g_type"]) if f["g_type"].isdigit() else f["g_type"]
+    replicate = "/".join(path.split("/")[:2])
+    if reference_dir:
+        g_fp = reference_dir / replicate / f"g_{g_type}.trees"
+        if in_reference is None:
+            in_reference = {}
+        if g_fp not in in_reference:
+            in_reference[g_fp] = g_fp.is_file()
+        if not in_reference[g_fp]:
+            return None
+
+    row = {
+        "num_species": int(f["num_species"]),
+        "unrooted_s_tree": f["stride_s_tree"] or f["unrooted_s_tree"],
+        "n_genes": int(f["n_genes"]),
+        "dup_rate": f["dup_rate"],
+        "loss_rate_indicator": int(f["loss_rate_indicator"]),
+        "hILS": f["hILS"] is not None,
+        "g_type": g_type,
+        "run_id": int(f["run_id"]),
+    }
+    if f["stride_s_tree"] is not None:
+        row["method"] = "STRIDE"
+        row["sampling_method"] = None
+        row["sampling_mult"] = None
+    else:
+        row["method"] = METHODS[f["rs_est_method"]]
+        row["sampling_method"] = f["sampling_method"]
+        row["sampling_mult"] = int(f["sampling_mult"])
+    score_fp = Path(input_dir, path)
+    row["ncd"] = float(score_fp.read_text().strip())
+    row.update(tree_metrics(Path(input_dir, replicate), score_fp))
+    row.update(
+        stage_resources(
+            Path(input_dir, *path.split("/")[:4]),
+            row["unrooted_s_tree"],
+            score_fp.parent,
+        )
+    )
+    return row
+
+
+def score_sources(input_dir, path, blocks=None):
+    """
+    Paths (relative to input_dir) of the files besides the score file at
+    path that its row is read from: the metrics.tsv of the replicate and
+    the time reports of the stages of the result. blocks memoizes the DISCO
+    blocks of every cell.
+    """
+    m = SCORE_PATTERN.fullmatch(path)
+    if m is None:
+        return []
+    parts = path.split("/")
+    replicate, cell = "/".join(parts[:2]), "/".join(parts[:4])
+    s_tree = m["stride_s_tree"] or m["unrooted_s_tree"]
+    sources = [
+        f"{replicate}/metrics.tsv",
+        f"{os.path.dirname(path)}/run.err",
+        f"{cell}/disco/run.err",
+        f"{cell}/disco/blocks",
+        f"{cell}/disco/{s_tree}/run.err",
+    ]
+    if m["rs_est_method"] is not None:
+        sources.append(f"{cell}/disco/{s_tree}/quintets/run.err")
+
+    if blocks is None:
+        blocks = {}
+    if cell not in blocks:
+        try:
+            names = Path(input_dir, cell, "disco", "blocks").read_text().split()
+        except OSError:
+            names = []
+        blocks[cell] = [
+            os.path.normpath(f"{cell}/disco/{name}/run.err") for name in names
+        ]
+    return sources + blocks[cell]
+
+
+def scan_results(input_dir, reference_dir, done=()):
+    """
+    Yield (replicate, rows) for every replicate directory under input_dir
+    that is not in done, with one row per score file found in it and the
+    parameters parsed from its path. With a reference_dir, replicates and
+    gene tree types missing from it are skipped as in grid_results.
+    """
+    for id_entry in sorted(os.scandir(input_dir), key=lambda e: e.name):
+        if not id_entry.is_dir():
+            continue
+        for run_entry in sorted(os.scandir(id_entry.path), key=lambda e: e.name):
+            replicate = f"{id_entry.name}/{run_entry.name}"
+            if replicate in done or not run_entry.is_dir():
+                continue
+            if reference_dir and not (reference_dir / replicate).is_dir():
+                continue
+
+            print(f"Running id {id_entry.name} {run_entry.name}")
+
+            results = []
+            in_reference = {}
+            for rel in iter_score_files(run_entry.path):
+                row = score_row(
+                    input_dir, f"{replicate}/{rel}", reference_dir, in_reference
+                )
+                if row is not None:
+                    results.append(row)
+
+            yield replicate, results
+
+
+class ResultSink(object):
+    """
+    Append-only store of result rows next to the output file. Rows are
+    appended in batches as JSON lines, and after each batch a checkpoint
+    records the replicates they cover and the length of the rows file, so
+    an interrupted aggregation resumes from the last checkpoint. The rows
+    depend on the input and reference directories and on how replicates are
+    found (scan or grid), recorded in the checkpoint as params: a checkpoint
+    of other params, or whose rows file is missing or shorter than recorded,
+    is started over. The sorted output is written once, by close().
+    """
+
+    def __init__(self, output_file, params, batch_size=10000):
+        self.output_file = output_file
+        self.rows_file = output_file.with_name(output_file.name + ".rows")
+        self.ckpt_file = output_file.with_name(output_file.name + ".ckpt")
+        self.params = params
+        self.batch_size = batch_size
+        self.buffer = []
+        self.pending = []
+        self.done = set()
+
+        ckpt = None
+        if self.ckpt_file.is_file():
+            ckpt = json.loads(self.ckpt_file.read_text())
+            try:
+                size = self.rows_file.stat().st_size
+            except FileNotFoundError:
+                size = -1
+            if ckpt.get("params") != params or size < ckpt["offset"]:
+                print(f"Ignoring {self.ckpt_file} of another aggregation")
+                ckpt = None
+
+        if ckpt is not None:
+            self.done = set(ckpt["done"])
+            with open(self.rows_file, "a") as f:
+                f.truncate(ckpt["offset"])
+            print(f"Resuming after {len(self.done)} replicates")
+        else:
+            self.rows_file.write_text("")
+            self.ckpt_file.unlink(missing_ok=True)
+
+    def add(self, replicate, rows):
+        self.buffer.extend(rows)
+        self.pending.append(replicate)
+        if len(self.buffer) >= self.batch_size:
+            self.checkpoint()
+
+    def checkpoint(self):
+        with open(self.rows_file, "a") as f:
+            for row in self.buffer:
+                f.write(json.dumps(row) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            offset = f.tell()
+        self.done.update(self.pending)
+        self.buffer = []
+        self.pending = []
+
+        tmp = self.ckpt_file.with_name(self.ckpt_file.name + ".tmp")
+        tmp.write_text(
+            json.dumps(
+                {"params": self.params, "offset": offset, "done": sorted(self.done)}
+            )
+        )
+        os.replace(tmp, self.ckpt_file)
+
+    def close(self):
+        self.checkpoint()
+        with open(self.rows_file) as f:
+            results = [json.loads(line) for line in f]
+        save_sorted_results(self.output_file, results)
+        self.rows_file.unlink()
+        self.ckpt_file.unlink()
+
+
+class ScanManifest(object):
+    """
+    Record of the last scan next to the output file, for --incremental.
+    For every directory under the input it keeps its mtime and the
+    subdirectories and score files it held, and for every score file its
+    (mtime, size), parsed row and the (mtime, size) of the other files the
+    row is read from (score_sources). A rescan lists only directories whose
+    mtime changed and reads only the rows of new or modified score files or
+    sources; everything else is served from the manifest.
+    """
+
+    # mtimes closer than this to the scan may still change within the same
+    # timestamp on coarse file systems, so they are not trusted next time
+    RACY_NS = 2 * 10**9
+
+    def __init__(self, output_file, reference_dir=None):
+        self.path = output_file.with_name(output_file.name + ".manifest")
+        self.reference = str(reference_dir) if reference_dir else None
+        self.dirs = {}
+        self.files = {}
+        if self.path.is_file():
+            manifest = json.loads(self.path.read_text())
+            # rows depend on the reference directory
+            if manifest["reference"] == self.reference:
+                self.dirs = manifest["dirs"]
+                self.files = manifest["files"]
+
+    def _mtime(self, st, now):
+        return st.st_mtime_ns if now - st.st_mtime_ns > self.RACY_NS else None
+
+    def walk(self, input_dir):
+        """Paths (relative to input_dir) of all score files below input_dir."""
+        now = time.time_ns()
+        dirs = {}
+        paths = []
+        stack = [""]
+        while stack:
+            rel = stack.pop()
+            try:
+                st = os.stat(os.path.join(input_dir, rel))
+            except FileNotFoundError:
+                continue
+            cached = self.dirs.get(rel)
+            if cached is not None and cached[0] == st.st_mtime_ns:
+                subdirs, scores = cached[1], cached[2]
+            else:
+                subdirs, scores = [], []
+                with os.scandir(os.path.join(input_dir, rel)) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name != "split":
+                                subdirs.append(entry.name)
+                        elif entry.name == "s_rooted_est.score":
+                            scores.append(entry.name)
+            dirs[rel] = [self._mtime(st, now), subdirs, scores]
+            stack.extend(f"{rel}{name}/" for name in subdirs)
+            paths.extend(f"{rel}{name}" for name in scores)
+        self.dirs = dirs
+        return paths
+
+    def update(self, input_dir, reference_dir=None):
+        """
+        Bring the manifest up to date with input_dir. Returns the rows of
+        all results and the set of (num_species, hILS) partitions with new,
+        modified or removed rows.
+        """
+        now = time.time_ns()
+        files = {}
+        changed = set()
+        in_reference = {}
+        blocks = {}
+        stats = {}
+
+        def stat(path):
+            if path not in stats:
+                try:
+                    stats[path] = os.stat(os.path.join(input_dir, path))
+                except FileNotFoundError:
+                    stats[path] = None
+            return stats[path]
+
+        n_read = 0
+        for path in self.walk(input_dir):
+            # a score file is rewritten in place, which leaves the mtime of
+            # its directory alone, so known files are still stat'ed
+            st = stat(path)
+            if st is None:
+                continue
+            # metrics.tsv and the time reports are written after the score
+            sources = [stat(fp) for fp in score_sources(input_dir, path, blocks)]
+            signature = [
+                None if s is None else [s.st_mtime_ns, s.st_size] for s in sources
+            ]
+            cached = self.files.get(path)
+            if (
+                cached is not None
+                and cached[:2] == [st.st_mtime_ns, st.st_size]
+                and cached[3:] == [signature]
+            ):
+                row = cached[2]
+            else:
+                row = score_row(input_dir, path, reference_dir, in_reference)
+                n_read += 1
+                if row is not None:
+                    changed.add((row["num_species"], row["hILS"]))
+            signature = [
+                None if s is None else [self._mtime(s, now), s.st_size] for s in sources
+            ]
+            files[path] = [self._mtime(st, now), st.st_size, row, signature]
+
+        for path, cached in self.files.items():
+            if path not in files and cached[2] is not None:
+                changed.add((cached[2]["num_species"], cached[2]["hILS"]))
+        print(f"Read {n_read} new or modified of {len(files)} score files")
+        self.files = files
+        rows = [cached[2] for cached in files.values() if cached[2] is not None]
+        return rows, changed
+
+    def save(self):
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(
+            json.dumps(
+                {"reference": self.reference, "dirs": self.dirs, "files": self.files}
+            )
+        )
+        os.replace(tmp, self.path)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    input_dir = Path(args.input)
+    output_file = Path(args.output)
+    if args.reference:
+        reference_dir = Path(args.reference)
+        assert (
+            reference_dir.is_dir()
+        ), f"Reference directory {reference_dir} does not exist."
+    else:
+        reference_dir = None
+
+    assert input_dir.is_dir(), f"Input directory {input_dir} does not exist."
+
+    assert (
+        output_file.parent.is_dir()
+    ), f"Output directory {output_file.parent} does not exist."
+
+    if args.incremental:
+        manifest = ScanManifest(output_file, reference_dir)
+        # without a previous scan every partition is rewritten
+        first_scan = not manifest.files
+        rows, changed = manifest.update(input_dir, reference_dir)
+        if first_scan or not output_file.exists():
+            save_sorted_results(output_file, rows)
+        elif changed:
+            save_sorted_results(output_file, rows, partitions=changed)
+        manifest.save()
+    else:
+        params = {
+            "input": str(input_dir.resolve()),
+            "reference": str(reference_dir.resolve()) if reference_dir else None,
+            "mode": "scan" if args.scan else "grid",
+        }
+        sink = ResultSink(output_file, params, batch_size=args.batch_size)
+        if args.scan:
+            replicates = scan_results(input_dir, reference_dir, sink.done)
+        else:
+            replicates = grid_results(input_dir, reference_dir, sink.done)
+        for replicate, rows in replicates:
+            sink.add(replicate, rows)
+        sink.close()
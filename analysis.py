@@ -0,0 +1,254 @@
+"""
+Bootstrap confidence intervals and paired comparisons of the methods.
+
+Reads the results aggregated by agg_result.py (CSV or results store) and
+writes one summary table for the figures to annotate, with
+
+- a "mean" row for every condition (INDEX_COLS) with results: the mean
+  error over the replicates and its percentile bootstrap CI;
+- a "paired" row for every condition and pair of DISCO+QR, DISCO+QR-STAR
+  and STRIDE: the mean difference (first minus second method) over the
+  replicates where both have a result, its bootstrap CI, the p-value of a
+  two-sided sign-flip permutation test, and how often the first method has
+  the lower, higher or same error. STRIDE does not sample quintets, so its
+  result in a cell is paired with those of the DISCO methods at every mult.
+
+Every condition is resampled at once: the values of all groups are padded
+into a (groups, replicates) matrix and the resamples drawn as one array of
+indices or signs, for blocks of groups taking a bounded amount of memory.
+
+    python analysis.py --input ncd.csv --output summary.csv
+"""
+
+import argparse
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from results import INDEX_COLS, read_results
+
+METHOD_ORDER = ["DISCO+QR", "DISCO+QR-STAR", "STRIDE"]
+
+# what a replicate is for the paired tests: every column of a result that
+# is not the method or its sampling
+PAIR_KEYS = [
+    "num_species",
+    "unrooted_s_tree",
+    "n_genes",
+    "dup_rate",
+    "loss_rate_indicator",
+    "hILS",
+    "g_type",
+    "run_id",
+]
+SAMPLING_KEYS = ["sampling_method", "sampling_mult"]
+
+SUMMARY_COLUMNS = [
+    "kind",
+    *INDEX_COLS,
+    "n",
+    "mean",
+    "ci_low",
+    "ci_high",
+    "p_value",
+    "wins",
+    "losses",
+    "ties",
+]
+
+
+def padded(df, keys, value):
+    """
+    The groups of df by keys (one row each, in order) and the values of
+    each group as a (groups, largest group) matrix padded with zeros, plus
+    the size of every group.
+    """
+    groups = df.groupby(keys, dropna=False, sort=True)
+    gid = groups.ngroup().to_numpy()
+    pos = groups.cumcount().to_numpy()
+    counts = np.bincount(gid, minlength=groups.ngroups)
+    matrix = np.zeros((groups.ngroups, counts.max() if len(counts) else 0))
+    matrix[gid, pos] = df[value].to_numpy(dtype=float)
+    # groups are numbered in the order of their keys
+    heads = groups.size().index.to_frame(index=False)
+    return heads, matrix, counts
+
+
+def blocks(n_groups, row_bytes, max_bytes):
+    """Slices of groups whose resamples take at most max_bytes."""
+    size = max(1, int(max_bytes // max(row_bytes, 1)))
+    for start in range(0, n_groups, size):
+        yield slice(start, start + size)
+
+
+def bootstrap_ci(matrix, counts, n_boot, alpha, rng, max_bytes=1 << 28):
+    """
+    Percentile bootstrap CI of the mean of every row of matrix (its first
+    counts values), as (low, high) arrays.
+    """
+    n_groups, width = matrix.shape
+    low, high = np.empty(n_groups), np.empty(n_groups)
+    valid = np.arange(width) < counts[:, None]
+    for sl in blocks(n_groups, 16 * n_boot * width, max_bytes):
+        n = counts[sl, None, None]
+        idx = (rng.random((len(n), n_boot, width)) * n).astype(np.int64)
+        draws = np.take_along_axis(matrix[sl, None, :], idx, axis=2)
+        means = np.where(valid[sl, None, :], draws, 0.0).sum(axis=2) / n[:, :, 0]
+        low[sl], high[sl] = np.percentile(
+            means, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=1
+        )
+    return low, high
+
+
+def sign_flip_pvalues(matrix, counts, n_perm, rng, max_bytes=1 << 28):
+    """
+    Two-sided p-values of a sign-flip permutation test of a zero mean of
+    every row of paired differences in matrix (its first counts values).
+    """
+    n_groups, width = matrix.shape
+    pvalues = np.empty(n_groups)
+    valid = np.arange(width) < counts[:, None]
+    observed = np.abs(matrix.sum(axis=1))
+    for sl in blocks(n_groups, 16 * n_perm * width, max_bytes):
+        signs = rng.integers(0, 2, (len(observed[sl]), n_perm, width)) * 2 - 1
+        flipped = np.where(valid[sl, None, :], matrix[sl, None, :] * signs, 0.0)
+        extreme = np.abs(flipped.sum(axis=2)) >= observed[sl, None] - 1e-12
+        pvalues[sl] = (extreme.sum(axis=1) + 1) / (n_perm + 1)
+    return pvalues
+
+
+def method_means(df, metric, n_boot, alpha, rng, max_bytes):
+    """The "mean" rows of the summary."""
+    keys = [col for col in INDEX_COLS if col in df.columns]
+    heads, matrix, counts = padded(df, keys, metric)
+    low, high = bootstrap_ci(matrix, counts, n_boot, alpha, rng, max_bytes)
+    heads["kind"] = "mean"
+    heads["n"] = counts
+    heads["mean"] = matrix.sum(axis=1) / counts
+    heads["ci_low"], heads["ci_high"] = low, high
+    return heads
+
+
+def paired_differences(df, metric):
+    """
+    Differences of metric between every pair of methods over matching
+    results, as rows of the pair keys, the sampling of the DISCO method(s)
+    and the comparison ("A vs B") in the method column.
+    """
+    wide = (
+        df[~df["method"].isin(["STRIDE"])]
+        .set_index(PAIR_KEYS + SAMPLING_KEYS + ["method"])[metric]
+        .unstack("method")
+        .reset_index()
+    )
+    stride = df[df["method"] == "STRIDE"]
+    if len(stride):
+        stride = stride.set_index(PAIR_KEYS)[metric].rename("STRIDE")
+        if len(wide):
+            wide = wide.join(stride, on=PAIR_KEYS)
+        else:
+            wide = stride.reset_index()
+            wide["sampling_method"], wide["sampling_mult"] = None, None
+
+    methods = [m for m in METHOD_ORDER if m in wide.columns]
+    diffs = []
+    for a, b in combinations(methods, 2):
+        pair = wide[PAIR_KEYS + SAMPLING_KEYS].copy()
+        pair["method"] = f"{a} vs {b}"
+        pair["diff"] = wide[a] - wide[b]
+        diffs.append(pair.dropna(subset=["diff"]))
+    if not diffs:
+        return pd.DataFrame(columns=PAIR_KEYS + SAMPLING_KEYS + ["method", "diff"])
+    return pd.concat(diffs, ignore_index=True)
+
+
+def paired_tests(df, metric, n_boot, alpha, rng, max_bytes):
+    """The "paired" rows of the summary, all comparisons at once."""
+    diffs = paired_differences(df, metric)
+    keys = [col for col in INDEX_COLS if col in diffs.columns]
+    if diffs.empty:
+        return pd.DataFrame(columns=keys)
+    heads, matrix, counts = padded(diffs, keys, "diff")
+    low, high = bootstrap_ci(matrix, counts, n_boot, alpha, rng, max_bytes)
+    valid = np.arange(matrix.shape[1]) < counts[:, None]
+    heads["kind"] = "paired"
+    heads["n"] = counts
+    heads["mean"] = matrix.sum(axis=1) / counts
+    heads["ci_low"], heads["ci_high"] = low, high
+    heads["p_value"] = sign_flip_pvalues(matrix, counts, n_boot, rng, max_bytes)
+    heads["wins"] = ((matrix < 0) & valid).sum(axis=1)
+    heads["losses"] = ((matrix > 0) & valid).sum(axis=1)
+    heads["ties"] = ((matrix == 0) & valid).sum(axis=1)
+    return heads
+
+
+def summarize(df, metric="ncd", n_boot=2000, alpha=0.05, seed=0, max_bytes=1 << 28):
+    """The summary table of the results in df (see the module docstring)."""
+    df = df.dropna(subset=[metric]).copy()
+    # group on plain values rather than on categories
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+    rng = np.random.default_rng(seed)
+    summary = pd.concat(
+        [
+            method_means(df, metric, n_boot, alpha, rng, max_bytes),
+            paired_tests(df, metric, n_boot, alpha, rng, max_bytes),
+        ],
+        ignore_index=True,
+    )
+    return summary.reindex(columns=SUMMARY_COLUMNS)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Bootstrap CIs and paired tests of the aggregated results."
+    )
+    parser.add_argument(
+        "--input",
+        type=str,
+        required=True,
+        help="Results of agg_result.py (CSV file or .parquet results store).",
+    )
+    parser.add_argument(
+        "--output", type=str, required=True, help="Summary table (CSV)."
+    )
+    parser.add_argument(
+        "--metric",
+        type=str,
+        default="ncd",
+        help="Error column to analyse (ncd, rf, root_distance, ...).",
+    )
+    parser.add_argument(
+        "--n-boot",
+        type=int,
+        default=2000,
+        help="Number of bootstrap resamples and of sign-flip permutations.",
+    )
+    parser.add_argument(
+        "--alpha", type=float, default=0.05, help="1 - confidence level of the CIs."
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    parser.add_argument(
+        "--chunk-mb",
+        type=int,
+        default=256,
+        help="Memory for the resamples of each block of conditions (MB).",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    columns = INDEX_COLS + ["run_id", args.metric]
+    df = read_results(args.input, columns=columns)
+    summary = summarize(
+        df, args.metric, args.n_boot, args.alpha, args.seed, args.chunk_mb << 20
+    )
+    summary.to_csv(args.output, index=False)
+    n_paired = (summary["kind"] == "paired").sum()
+    print(
+        f"{len(summary) - n_paired} conditions and {n_paired} paired comparisons "
+        f"written to {args.output}"
+    )
@@ -7,5 +7,5 @@
 #SBATCH --account=25sp-cs581a-eng
 #SBATCH --mem=8G
 
-zip -r discoqr_discoqrstar.zip output/trees/
-# unzip discoqr_discoqrstar.zip
\ No newline at end of file
+python pack.py pack output/trees/ discoqr_discoqrstar.pack --incremental
+# python pack.py unpack discoqr_discoqrstar.pack output/trees/
\ No newline at end of file
@@ -0,0 +1,147 @@
+"""
+Content-addressed cache of tool outputs.
+
+A run is keyed by the tool and its version, its arguments with file paths
+abstracted away, and the content of its input files. Outputs are stored
+once under the cache directory and hard-linked into the output layout, so
+rerunning an unchanged cell only costs hashing its inputs, and changing an
+input changes the key and reruns the tool.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+from itertools import takewhile
+from pathlib import Path
+
+_digests = {}
+
+
+def digest(path):
+    """sha256 of a file, or of the names and contents of a directory."""
+    path = Path(path)
+    st = path.stat()
+    memo_key = (str(path), st.st_mtime_ns, st.st_size)
+    if memo_key in _digests:
+        return _digests[memo_key]
+
+    h = hashlib.sha256()
+    if path.is_dir():
+        for child in sorted(path.iterdir()):
+            h.update(child.name.encode())
+            h.update(digest(child).encode())
+    else:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    _digests[memo_key] = h.hexdigest()
+    return _digests[memo_key]
+
+
+def tool_version(argv):
+    """
+    Version of the tool run by argv: the digest of its script or executable,
+    plus the commit of the checkout it lives in (DISCO, ASTRID, ...) so that
+    changes to modules it imports are picked up too. A script run through
+    wrapper scripts (quintets.py) counts the versions of all of them.
+    """
+    tools = [Path(arg) for arg in takewhile(lambda a: a.endswith(".py"), argv[1:])]
+    versions = []
+    for tool in tools or [Path(argv[0])]:
+        version = digest(tool) if tool.is_file() else tool.name
+        if len(tool.parts) > 1 and (Path(tool.parts[0]) / ".git").exists():
+            head = subprocess.run(
+                ["git", "-C", tool.parts[0], "rev-parse", "HEAD"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+            )
+            if head.returncode == 0:
+                version = f"{head.stdout.strip()}:{version}"
+        versions.append(version)
+    return "+".join(versions)
+
+
+def cache_key(argv, inputs, stage_dir):
+    """
+    Key of running argv on inputs with outputs in stage_dir. Input paths
+    and stage_dir are replaced by placeholders so the same run in another
+    cell of the grid gets the same key.
+    """
+    inputs = [str(fp) for fp in inputs]
+    stage_dir = str(stage_dir)
+
+    args = [os.path.basename(argv[0])]
+    for arg in argv[1:]:
+        for i, fp in enumerate(inputs):
+            if arg.startswith(fp):
+                arg = f"<input{i}>{arg[len(fp):]}"
+                break
+        else:
+            if arg.startswith(stage_dir):
+                arg = f"<stage>{arg[len(stage_dir):]}"
+        args.append(arg)
+
+    record = {
+        "version": tool_version(argv),
+        "args": args,
+        "inputs": [digest(fp) for fp in inputs],
+    }
+    return hashlib.sha256(json.dumps(record).encode()).hexdigest()
+
+
+def link(src, dst):
+    """Hard-link src to dst, copying instead across file systems."""
+    dst = Path(dst)
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copy2(src, dst)
+
+
+def entry_dir(cache_dir, key):
+    return Path(cache_dir) / key[:2] / key
+
+
+def fetch(cache_dir, key, stage_dir, outputs):
+    """
+    Link the cached outputs (and run.out/run.err) of key into place.
+    Returns False if key is not in the cache.
+    """
+    entry = entry_dir(cache_dir, key)
+    if not entry.is_dir():
+        return False
+
+    for fp in outputs:
+        link(entry / Path(fp).name, fp)
+    for log in ["run.out", "run.err"]:
+        if (entry / log).is_file():
+            link(entry / log, Path(stage_dir) / log)
+    return True
+
+
+def store(cache_dir, key, stage_dir, outputs):
+    """Add the outputs of a finished run to the cache under key."""
+    entry = entry_dir(cache_dir, key)
+    if entry.is_dir():
+        return
+
+    tmp = entry.with_name(f"{key}.tmp{os.getpid()}")
+    tmp.mkdir(parents=True, exist_ok=True)
+    files = [Path(fp) for fp in outputs]
+    files += [Path(stage_dir) / log for log in ["run.out", "run.err"]]
+    for fp in files:
+        if fp.is_file():
+            link(fp, tmp / fp.name)
+    try:
+        tmp.rename(entry)
+    except OSError:
+        # stored concurrently by another worker
+        shutil.rmtree(tmp, ignore_errors=True)
@@ -1,10 +1,50 @@
+"""
+List the pipeline stages whose outputs are missing under an output directory.
+
+Every replicate directory is listed once, on a pool of worker processes,
+and the files found are compared against the outputs each stage of
+pipeline.py should have produced. The missing stages are written as a
+JSON or CSV manifest, which `pipeline.py --missing` reads to schedule only
+that work.
+"""
+
 import argparse
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
 from pathlib import Path
 
+from pipeline import S_EST_METHODS, add_grid_arguments
+
+STAGES = ["disco", "s_tree", "qr", "qrstar", "stride", "score"]
+
+# columns of the manifest; stage_dir and path are relative to the input
+# directory, s_est_method and mult are empty where they do not apply
+MISSING_COLUMNS = [
+    "replicate",
+    "g_type",
+    "n_genes",
+    "stage",
+    "s_est_method",
+    "mult",
+    "stage_dir",
+    "path",
+]
+
+
+def grid_defaults():
+    """The options of the grid pipeline.py runs by default."""
+    parser = argparse.ArgumentParser(add_help=False)
+    add_grid_arguments(parser)
+    return parser.parse_args([])
+
 
 def parse_args():
+    grid = grid_defaults()
     parser = argparse.ArgumentParser(
-        description="Aggregate results from multiple runs."
+        description="List the missing stages of the pipeline."
     )
     parser.add_argument(
         "--input",
@@ -18,80 +58,165 @@ def parse_args():
         required=True,
         help="Reference directory",
     )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Manifest of the missing stages (.json or .csv).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("SLURM_CPUS_PER_TASK", os.cpu_count())),
+        help="Number of worker processes.",
+    )
+    # the cells and stages of every replicate, as pipeline.py runs them
+    parser.add_argument("--g-type", type=str, nargs="+", default=grid.g_type)
+    parser.add_argument("--n-genes", type=int, nargs="+", default=grid.n_genes)
+    parser.add_argument(
+        "--s-est-method",
+        type=str,
+        nargs="+",
+        choices=S_EST_METHODS,
+        default=grid.s_est_method,
+    )
+    parser.add_argument("--mult", type=int, nargs="+", default=grid.mult)
     return parser.parse_args()
 
 
-args = parse_args()
-inp_dir = Path(args.input)
-ref_dir = Path(args.reference)
-
-assert inp_dir.is_dir(), f"Input directory {inp_dir} does not exist."
-assert inp_dir.exists(), f"Input directory {inp_dir} does not exist."
-
-assert ref_dir.is_dir(), f"Reference directory {ref_dir} does not exist."
-assert ref_dir.exists(), f"Reference directory {ref_dir} does not exist."
-
-hILS_list = [False, True]
-dup_rate_list = ["1e-9", "1e-10", "5e-10", "1e-11", "1e-12", "1e-13"]
-loss_rate_indicator_list = [0, 1]
-num_species_list = [20, 50, 100]
-run_id_list = range(1, 11)
-n_genes_list = [50, 100, 500, 1000]
-g_type_list = ["true", 50, 100, 500]
-mult_list = [1, 5, 10, 50]  # [1, 5, 10, 50]
-
-for hILS in hILS_list:
-    for loss_rate_indicator in loss_rate_indicator_list:
-        for dup_rate in dup_rate_list:
-            for num_species in num_species_list:
-                for run_id in run_id_list:
-                    id = f"{num_species}_gdl_{dup_rate}_{loss_rate_indicator}"
-                    if hILS:
-                        id = f"{id}_hILS"
-
-                    subref_dir = Path(f"{ref_dir}/{id}/{run_id:02d}")
-                    if not subref_dir.exists():
-                        continue
-
-                    subinp_dir = Path(f"{inp_dir}/{id}/{run_id:02d}")
-                    if not subinp_dir.exists():
-                        print(f"Missing input directory: {subinp_dir}")
-                        continue
-
-                    for g_type in g_type_list:
-                        g_fp = subref_dir / f"g_{g_type}.trees"
-                        if not g_fp.is_file():
-                            continue
-
-                        for n_genes in n_genes_list:
-                            for us_est_method in ["astral", "astrid", "trues"]:
-                                stride_ncd_fp = (
-                                    subinp_dir
-                                    / f"{g_type}g"
-                                    / f"{n_genes}"
-                                    / "stride"
-                                    / us_est_method
-                                    / f"s_rooted_est.score"
-                                )
-
-                                if not stride_ncd_fp.is_file():
-                                    print(f"Missing file: {stride_ncd_fp}")
-                                    continue
-
-                                for rs_est_method in ["qr", "qrstar"]:
-                                    for mult in mult_list:
-                                        ncd_fp = (
-                                            subinp_dir
-                                            / f"{g_type}g"
-                                            / f"{n_genes}"
-                                            / "disco"
-                                            / us_est_method
-                                            / rs_est_method
-                                            / "le"
-                                            / f"{mult}"
-                                            / f"s_rooted_est.score"
-                                        )
-
-                                        if not ncd_fp.is_file():
-                                            print(f"Missing file: {ncd_fp}")
-                                            continue
+def list_files(root):
+    """Paths (relative to root) of all files below root, skipping split/."""
+    files = set()
+    stack = [""]
+    while stack:
+        rel = stack.pop()
+        try:
+            it = os.scandir(os.path.join(root, rel))
+        except FileNotFoundError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != "split":
+                        stack.append(f"{rel}{entry.name}/")
+                else:
+                    files.add(f"{rel}{entry.name}")
+    return files
+
+
+def expected_outputs(g_types, grid):
+    """
+    (g_type, n_genes, stage, s_est_method, mult, stage_dir, output) of
+    every output expected in a replicate with gene trees of g_types, in the
+    grid (n_genes, s_est_method and mult) of the options grid, with paths
+    relative to the replicate directory.
+    """
+    for g_type, n_genes in product(g_types, grid.n_genes):
+        cell = f"{g_type}g/{n_genes}"
+        yield g_type, n_genes, "disco", "", "", f"{cell}/disco", "g_single.trees"
+
+        for s_est_method in grid.s_est_method:
+            s_dir = f"{cell}/disco/{s_est_method}"
+            s_unrooted = "s_unrooted_est.tree"
+            yield g_type, n_genes, "s_tree", s_est_method, "", s_dir, s_unrooted
+
+            rooted_dirs = [("stride", "", f"{cell}/stride/{s_est_method}")]
+            for rs_est_method, mult in product(["qr", "qrstar"], grid.mult):
+                r_dir = f"{s_dir}/{rs_est_method}/le/{mult}"
+                rooted_dirs.append((rs_est_method, mult, r_dir))
+
+            for rooting, mult, r_dir in rooted_dirs:
+                outputs = [
+                    (rooting, "s_rooted_est.tree"),
+                    ("score", "s_rooted_est.score"),
+                ]
+                for stage, name in outputs:
+                    yield g_type, n_genes, stage, s_est_method, mult, r_dir, name
+
+
+def check_replicate(inp_dir, ref_dir, grid, replicate):
+    """Manifest rows of the outputs missing in one replicate."""
+    subref_dir = Path(ref_dir) / replicate
+    g_types = [
+        g_type for g_type in grid.g_type if (subref_dir / f"g_{g_type}.trees").is_file()
+    ]
+    files = list_files(Path(inp_dir) / replicate)
+
+    missing = []
+    for output in expected_outputs(g_types, grid):
+        g_type, n_genes, stage, s_est_method, mult, stage_dir, name = output
+        path = f"{stage_dir}/{name}"
+        # an output without the done marker of its stage was left by a
+        # killed or failed run (scores are written whole, without marker)
+        marked = stage == "score" or f"{stage_dir}/done" in files
+        if path not in files or not marked:
+            missing.append(
+                {
+                    "replicate": replicate,
+                    "g_type": g_type,
+                    "n_genes": n_genes,
+                    "stage": stage,
+                    "s_est_method": s_est_method,
+                    "mult": mult,
+                    "stage_dir": f"{replicate}/{stage_dir}",
+                    "path": f"{replicate}/{path}",
+                }
+            )
+    return missing
+
+
+def replicates(ref_dir):
+    """Replicates (id/run_id) of every replicate directory of the reference."""
+    for id_entry in sorted(os.scandir(ref_dir), key=lambda e: e.name):
+        if not id_entry.is_dir():
+            continue
+        for run_entry in sorted(os.scandir(id_entry.path), key=lambda e: e.name):
+            if run_entry.is_dir():
+                yield f"{id_entry.name}/{run_entry.name}"
+
+
+def write_missing(path, missing):
+    """Write the manifest as CSV for a .csv path, JSON otherwise."""
+    if Path(path).suffix == ".csv":
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=MISSING_COLUMNS)
+            writer.writeheader()
+            writer.writerows(missing)
+    else:
+        Path(path).write_text(json.dumps(missing, indent=1))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    inp_dir = Path(args.input)
+    ref_dir = Path(args.reference)
+
+    assert inp_dir.is_dir(), f"Input directory {inp_dir} does not exist."
+    assert ref_dir.is_dir(), f"Reference directory {ref_dir} does not exist."
+
+    todo = list(replicates(ref_dir))
+    missing = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for rows in pool.map(
+            check_replicate,
+            [inp_dir] * len(todo),
+            [ref_dir] * len(todo),
+            [args] * len(todo),
+            todo,
+            chunksize=max(1, len(todo) // (4 * args.workers)),
+        ):
+            missing.extend(rows)
+
+    for replicate in todo:
+        if not (inp_dir / replicate).is_dir():
+            print(f"Missing input directory: {inp_dir / replicate}")
+    counts = {stage: 0 for stage in STAGES}
+    for row in missing:
+        counts[row["stage"]] += 1
+    print(
+        f"{len(todo)} replicates, missing: "
+        + ", ".join(f"{n} {stage}" for stage, n in counts.items())
+    )
+
+    if args.output:
+        write_missing(args.output, missing)
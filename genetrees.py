@@ -0,0 +1,188 @@
+"""
+Indexed access to the gene trees of a replicate.
+
+The gene trees in data/trees/<id>/<run_id>/g_<g_type>.trees are one Newick
+tree per line. The byte offset of every line is indexed once, and the file
+is memory-mapped, so the first n trees or a single tree is a slice of the
+mapping. The cells of a replicate take their gene trees from there instead
+of each making its own copy with head and split:
+
+- g_multi.trees of a cell is the prefix of the first n_genes trees, written
+  in one piece, or hard-linked when it is the whole file;
+- the one-tree files that STRIDE reads from split/ are written once per
+  (replicate, g_type) into a shared pool and hard-linked into the split/
+  directory of every n_genes;
+- the blocks of consecutive trees that pipeline.py runs DISCO on are
+  written the same way as a prefix.
+
+    python genetrees.py prefix g_true.trees 100 g_multi.trees
+    python genetrees.py split g_true.trees 100 split/ --pool ../split/
+"""
+
+import argparse
+import mmap
+import os
+from array import array
+from pathlib import Path
+
+import cache
+
+
+def index_path(trees_path):
+    return Path(f"{trees_path}.idx")
+
+
+def build_index(trees_path, index_file):
+    """
+    Write the index of trees_path to index_file: the size and mtime of the
+    trees file it was built from, then the offset of every line and the
+    end of the file. Returns the offsets.
+    """
+    with open(trees_path, "rb") as f:
+        st = os.fstat(f.fileno())
+        offsets = array("Q", [0])
+        if st.st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                pos = m.find(b"\n")
+                while pos != -1:
+                    offsets.append(pos + 1)
+                    pos = m.find(b"\n", pos + 1)
+        if offsets[-1] != st.st_size:
+            # last line without a newline
+            offsets.append(st.st_size)
+
+    index_file = Path(index_file)
+    index_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = index_file.with_name(f"{index_file.name}.tmp{os.getpid()}")
+    with open(tmp, "wb") as f:
+        array("Q", [st.st_size, st.st_mtime_ns]).tofile(f)
+        offsets.tofile(f)
+    os.replace(tmp, index_file)
+    return offsets
+
+
+def read_index(trees_path, index_file):
+    """Offsets of the lines of trees_path, from index_file if it is current."""
+    st = os.stat(trees_path)
+    data = array("Q")
+    try:
+        with open(index_file, "rb") as f:
+            data.frombytes(f.read())
+    except OSError:
+        pass
+    if len(data) < 3 or list(data[:2]) != [st.st_size, st.st_mtime_ns]:
+        return build_index(trees_path, index_file)
+    return data[2:]
+
+
+class GeneTrees(object):
+    """
+    The gene trees of a file by index, read through a memory map. The
+    index lives at index_file (by default next to the trees) and is built
+    or rebuilt when missing or older than the trees.
+    """
+
+    def __init__(self, trees_path, index_file=None):
+        self.path = Path(trees_path)
+        self.offsets = read_index(self.path, index_file or index_path(self.path))
+        self._file = open(self.path, "rb")
+        if self.offsets[-1]:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._map = b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        """Tree i, with its newline."""
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._map[self.offsets[i] : self.offsets[i + 1]]
+
+    def block(self, start, stop):
+        """Trees start to stop (exclusive), clipped to the trees there are."""
+        start, stop = min(start, len(self)), min(stop, len(self))
+        return memoryview(self._map)[self.offsets[start] : self.offsets[stop]]
+
+    def write_prefix(self, n, dst):
+        """Write the first n trees to dst, as head -n would."""
+        if n >= len(self):
+            Path(dst).parent.mkdir(parents=True, exist_ok=True)
+            cache.link(self.path, dst)
+            return
+        self.write_block(0, n, dst)
+
+    def write_block(self, start, stop, dst):
+        """Write trees start to stop (exclusive) to dst."""
+        dst = Path(dst)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dst.with_name(f"{dst.name}.tmp{os.getpid()}")
+        with open(tmp, "wb") as f:
+            f.write(self.block(start, stop))
+        os.replace(tmp, dst)
+
+    def write_split(self, n, split_dir, pool_dir):
+        """
+        Fill split_dir with one file per tree of the first n trees, as
+        split -l 1 would, hard-linking them from pool_dir where each tree
+        is written once whatever n is.
+        """
+        split_dir = Path(split_dir)
+        pool_dir = Path(pool_dir)
+        pool_dir.mkdir(parents=True, exist_ok=True)
+        tmp_dir = split_dir.with_name(f"{split_dir.name}.tmp{os.getpid()}")
+        tmp_dir.mkdir(parents=True)
+        for i in range(min(n, len(self))):
+            name = f"g_multi_{i:05d}.tree"
+            pooled = pool_dir / name
+            if not pooled.exists():
+                tmp = pool_dir / f"{name}.tmp{os.getpid()}"
+                tmp.write_bytes(self[i])
+                os.replace(tmp, pooled)
+            cache.link(pooled, tmp_dir / name)
+        tmp_dir.rename(split_dir)
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Write the first n gene trees of a file, whole or split."
+    )
+    parser.add_argument("command", choices=["prefix", "split"])
+    parser.add_argument("trees", type=str, help="Gene trees, one per line.")
+    parser.add_argument("n_genes", type=int, help="Number of trees to take.")
+    parser.add_argument("output", type=str, help="Output file or split directory.")
+    parser.add_argument(
+        "--index",
+        type=str,
+        default=None,
+        help="Index file (defaults to the trees file with an .idx suffix).",
+    )
+    parser.add_argument(
+        "--pool",
+        type=str,
+        default=None,
+        help="Directory of the one-tree files shared by all split directories.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with GeneTrees(args.trees, args.index) as trees:
+        if args.command == "prefix":
+            trees.write_prefix(args.n_genes, args.output)
+        else:
+            pool = args.pool or Path(args.output).parent.parent / "split"
+            trees.write_split(args.n_genes, args.output, pool)
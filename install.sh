@@ -3,4 +3,6 @@ conda install bioconda::treeswift
 conda install bioconda::dendropy
 pip install table-five
 pip install ete3
-pip install legacy-cgi
\ No newline at end of file
+pip install legacy-cgi
+pip install pyarrow
+pip install zstandard
\ No newline at end of file
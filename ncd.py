@@ -3,13 +3,28 @@ This code is modified and extended from the following script for computing
 the (unrooted) RF distance written by Erin K. Molloy in NJMerge software
 https://github.com/ekmolloy/njmerge/blob/master/python/compare_trees.py
 
-Normalized clade distance (root distance) of two trees on different leaf sets
+Normalized clade distance (root distance) of two trees on different leaf sets,
+and with --metrics the other metrics of METRICS from the same bipartitions
 All rights reserved.
 License: 3-Clause BSD,
 see https://opensource.org/licenses/BSD-3-Clause
 """
 import argparse
+import csv
+import fcntl
+import math
+import os
+import re
+import sys
+
 import dendropy
+import numpy as np
+
+# columns of a metrics table, after the tree and its number of leaves
+METRICS = ['ncd', 'rf', 'correct_root', 'root_distance']
+
+# set bits of every byte, for NumPy without bitwise_count
+POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
 
 
 def clade_distance(tr1, tr2):
@@ -40,26 +55,546 @@ def clade_distance(tr1, tr2):
     return nl, cd
 
 
+NEWICK_TOKEN = re.compile(r"\s*(\[[^\]]*\]|'(?:[^']|'')*'|[(),;]|:[^(),;\[]*"
+                          r"|[^\s(),;:\[']+)")
+
+
+def parse_clades(newick, taxon_index):
+    """
+    Parse the first tree of a newick string into (leaves, clades), where
+    leaves is the bitmask of its leaf set and clades is the frozenset of
+    bitmasks of its non-trivial clades. Bit positions come from
+    taxon_index (label -> position), which grows as new labels are seen,
+    so trees parsed with the same index can be compared directly. Labels
+    are read the way dendropy reads them (unquoted underscores are spaces).
+    """
+    stack = []
+    masks = []
+    cur = None
+    for tok in NEWICK_TOKEN.findall(newick):
+        c = tok[0]
+        if c == '(':
+            stack.append(0)
+            cur = None
+        elif c == ',':
+            stack[-1] |= cur
+            cur = None
+        elif c == ')':
+            cur = stack.pop() | cur
+            masks.append(cur)
+        elif c == ';':
+            break
+        elif c == ':' or c == '[':
+            continue
+        elif cur is None:
+            if c == "'":
+                label = tok[1:-1].replace("''", "'")
+            else:
+                label = tok.replace('_', ' ')
+            if label not in taxon_index:
+                taxon_index[label] = len(taxon_index)
+            cur = 1 << taxon_index[label]
+    if stack or cur is None:
+        raise ValueError('Malformed newick string')
+
+    leaves = cur
+    clades = frozenset(m for m in masks
+                       if m != leaves and m & (m - 1))
+    return leaves, clades
+
+
+def read_clades(path, taxon_index):
+    with open(path) as f:
+        return parse_clades(f.read(), taxon_index)
+
+
+def restrict_clades(clades, leaves):
+    res = set()
+    for m in clades:
+        m &= leaves
+        if m != leaves and m & (m - 1):
+            res.add(m)
+    return frozenset(res)
+
+
+def bitset_clade_distance(cl1, cl2):
+    """
+    Same as clade_distance, but on (leaves, clades) pairs from
+    parse_clades that share one taxon index.
+    """
+    leaves1, clades1 = cl1
+    leaves2, clades2 = cl2
+
+    com = leaves1 & leaves2
+    if com != leaves1 or com != leaves2:
+        clades1 = restrict_clades(clades1, com)
+        clades2 = restrict_clades(clades2, com)
+
+    nl = bin(com).count('1')
+    cd = len(clades1 ^ clades2) / (2*nl - 4)
+
+    return nl, cd
+
+
+def popcount(m):
+    return bin(m).count('1')
+
+
+def bipartitions(leaves, clades):
+    """
+    Non-trivial bipartitions of the unrooted tree of (leaves, clades), each
+    as the bitmask of its side without the lowest leaf. The two clades at
+    a binary root give the same bipartition.
+    """
+    low = leaves & -leaves
+    res = set()
+    for m in clades:
+        if m & low:
+            m ^= leaves
+        if m & (m - 1) and (leaves ^ m) & (leaves ^ m) - 1:
+            res.add(m)
+    return frozenset(res)
+
+
+def root_split(leaves, clades):
+    """
+    The bipartition (as in bipartitions) between the two subtrees of the
+    root of (leaves, clades), or None if the root is not binary.
+    """
+    low = leaves & -leaves
+    for m in clades:
+        rest = leaves ^ m
+        if rest in clades or not rest & (rest - 1):
+            return rest if m & low else m
+    return None
+
+
+def root_distance(leaves, clades, split):
+    """
+    Number of edges between the root of (leaves, clades) and the edge of
+    bipartition split, counting the root edge as one edge: the number of
+    clades strictly above the side of split below that edge. None if the
+    tree has no such edge.
+    """
+    best = None
+    for m in (split, leaves ^ split):
+        if m in clades or not m & (m - 1):
+            d = sum(1 for c in clades if c != m and c & m == m)
+            if best is None or d < best:
+                best = d
+    return best
+
+
+def clade_summary(leaves, clades):
+    """(clades, bipartitions, root split) of (leaves, clades)."""
+    return clades, bipartitions(leaves, clades), root_split(leaves, clades)
+
+
+def compare_clades(leaves, ref, est):
+    """
+    The METRICS of an estimated tree against a reference, given as
+    clade_summary triples on the same leaves: the normalized clade
+    distance, the normalized RF distance of the unrooted trees, whether
+    the estimated root is on the edge of the reference root (1 or 0), and
+    the number of edges between them in the estimated tree (nan where the
+    estimate lacks that edge). The root metrics are nan if the reference
+    root is not binary.
+    """
+    clades1, bips1, split1 = ref
+    clades2, bips2, split2 = est
+
+    nl = popcount(leaves)
+    metrics = {
+        'ncd': len(clades1 ^ clades2) / (2*nl - 4),
+        'rf': len(bips1 ^ bips2) / (2*nl - 6) if nl > 3 else 0.0,
+        'correct_root': math.nan,
+        'root_distance': math.nan,
+    }
+    if split1 is not None:
+        metrics['correct_root'] = int(split1 == split2)
+        d = root_distance(leaves, clades2, split1)
+        if d is not None:
+            metrics['root_distance'] = d
+    return metrics
+
+
+def clade_metrics(cl1, cl2):
+    """
+    Same as bitset_clade_distance, but returns (nl, metrics) with all the
+    METRICS of cl2 against the reference cl1, from one pass over their
+    clades.
+    """
+    leaves1, clades1 = cl1
+    leaves2, clades2 = cl2
+
+    com = leaves1 & leaves2
+    if com != leaves1 or com != leaves2:
+        clades1 = restrict_clades(clades1, com)
+        clades2 = restrict_clades(clades2, com)
+
+    return popcount(com), compare_clades(com, clade_summary(com, clades1),
+                                         clade_summary(com, clades2))
+
+
+def tree_clades(tree, taxon_index):
+    """
+    (leaves, clades) of a dendropy tree as in parse_clades, computed
+    without pruning or re-encoding the tree.
+    """
+    node_mask = {}
+    for nd in tree.postorder_node_iter():
+        if nd.is_leaf():
+            label = nd.taxon.label
+            if label not in taxon_index:
+                taxon_index[label] = len(taxon_index)
+            node_mask[nd] = 1 << taxon_index[label]
+        else:
+            m = 0
+            for ch in nd.child_node_iter():
+                m |= node_mask[ch]
+            node_mask[nd] = m
+    leaves = node_mask[tree.seed_node]
+    masks = [m for nd, m in node_mask.items() if not nd.is_leaf()]
+
+    clades = frozenset(m for m in masks
+                       if m != leaves and m & (m - 1))
+    return leaves, clades
+
+
+class ReferenceClades(object):
+    """
+    Immutable clades of a reference tree that can be compared against any
+    number of estimates. The reference restricted to a common leaf set is
+    memoized by that leaf set's bitmask, so repeated comparisons on the
+    same taxa only cost a set difference.
+    """
+
+    def __init__(self, leaves, clades):
+        self.leaves = leaves
+        self.clades = clades
+        self._restricted = {leaves: clades}
+        self._summaries = {}
+
+    def restrict(self, leaves):
+        clades = self._restricted.get(leaves)
+        if clades is None:
+            clades = restrict_clades(self.clades, leaves)
+            self._restricted[leaves] = clades
+        return clades
+
+    def distance(self, other):
+        """Same as bitset_clade_distance(self, other), without mutation."""
+        leaves, clades = other
+
+        com = self.leaves & leaves
+        if com != leaves:
+            clades = restrict_clades(clades, com)
+
+        nl = bin(com).count('1')
+        cd = len(self.restrict(com) ^ clades) / (2*nl - 4)
+
+        return nl, cd
+
+    def metrics(self, other):
+        """Same as clade_metrics(self, other), without mutation."""
+        leaves, clades = other
+
+        com = self.leaves & leaves
+        if com != leaves:
+            clades = restrict_clades(clades, com)
+
+        ref = self._summaries.get(com)
+        if ref is None:
+            ref = clade_summary(com, self.restrict(com))
+            self._summaries[com] = ref
+
+        return popcount(com), compare_clades(com, ref,
+                                             clade_summary(com, clades))
+
+
+def pack_clades(clade_sets):
+    """
+    Packed bit matrix of clade_sets (bitmask sets sharing one taxon index):
+    a (len(clade_sets), words) uint64 array whose row i has bit j set iff
+    the i-th set holds clade j of the vocabulary of all clades seen.
+    """
+    vocab = {}
+    cols = []
+    for clades in clade_sets:
+        cols.append(np.array([vocab.setdefault(m, len(vocab)) for m in clades],
+                             dtype=np.int64))
+    bits = np.zeros((len(clade_sets), max(1, -(-len(vocab) // 64))),
+                    dtype=np.uint64)
+    for row, col in zip(bits, cols):
+        np.bitwise_or.at(row, col >> 6,
+                         np.left_shift(np.uint64(1), (col & 63).astype(np.uint64)))
+    return bits
+
+
+def popcount_rows(words):
+    """Number of set bits along the last axis of an array of uint64 words."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    return POPCOUNT8[words.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+def pairwise_clade_distances(trees, out=None, max_bytes=1 << 28):
+    """
+    Normalized clade distances between all pairs of trees, (leaves, clades)
+    pairs from parse_clades sharing one taxon index, as (nl, matrix). As in
+    clade_distance, every pair is compared on the leaves both trees share:
+    the trees are grouped by leaf set, and for every two groups the clades
+    of their trees, restricted to the leaves common to the two groups, are
+    rows of a packed bit matrix (pack_clades). The symmetric differences
+    are popcounts of the XOR of blocks of rows, with blocks small enough
+    that the XOR of two takes at most max_bytes. Pairs sharing fewer than 3
+    leaves have no distance (nan). nl is the smallest number of leaves a
+    pair shares. out, if given, is the (k, k) array (for instance a memory
+    map) the distances are written to.
+    """
+    k = len(trees)
+    if out is None:
+        out = np.empty((k, k))
+    groups = {}
+    for i, (leaves, _) in enumerate(trees):
+        groups.setdefault(leaves, []).append(i)
+    groups = [(leaves, np.array(idx)) for leaves, idx in groups.items()]
+
+    min_nl = None
+    for g, (leaves1, idx1) in enumerate(groups):
+        # the matrix is symmetric, so only pairs of groups on or above the
+        # diagonal, and in a group with itself, only blocks on or above it
+        for leaves2, idx2 in groups[g:]:
+            com = leaves1 & leaves2
+            nl = popcount(com)
+            min_nl = nl if min_nl is None else min(min_nl, nl)
+            same = idx2 is idx1
+            clade_sets = [
+                clades if leaves == com else restrict_clades(clades, com)
+                for leaves, clades in (trees[i] for i in
+                                       (idx1 if same else np.r_[idx1, idx2]))]
+            bits = pack_clades(clade_sets)
+            bits1, bits2 = bits[:len(idx1)], bits[0 if same else len(idx1):]
+            chunk = max(1, int((max_bytes / (8 * bits.shape[1])) ** 0.5))
+            for i in range(0, len(idx1), chunk):
+                rows = bits1[i:i + chunk]
+                for j in range(i if same else 0, len(idx2), chunk):
+                    diff = popcount_rows(rows[:, None, :]
+                                         ^ bits2[None, j:j + chunk, :])
+                    if nl > 2:
+                        block = diff / (2*nl - 4)
+                    else:
+                        block = np.full(diff.shape, np.nan)
+                    rows_idx, cols_idx = idx1[i:i + chunk], idx2[j:j + chunk]
+                    out[np.ix_(rows_idx, cols_idx)] = block
+                    out[np.ix_(cols_idx, rows_idx)] = block.T
+    return (min_nl or 0), out
+
+
+def write_pairs(path, trees, labels, max_bytes=1 << 28):
+    """
+    Write the pairwise_clade_distances of trees to path: a .npy array
+    filled in place through a memory map, or else a tab-separated matrix
+    with labels as its header and first column.
+    """
+    if path.endswith('.npy'):
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64,
+                                        shape=(len(trees), len(trees)))
+        nl, out = pairwise_clade_distances(trees, out, max_bytes)
+        out.flush()
+        return nl
+
+    nl, matrix = pairwise_clade_distances(trees, max_bytes=max_bytes)
+    with open(path, 'w') as f:
+        f.write('\t'.join([''] + labels) + '\n')
+        for label, row in zip(labels, matrix):
+            f.write('\t'.join([label] + ['%r' % x for x in row.tolist()])
+                    + '\n')
+    return nl
+
+
+def read_tree(path, taxon_namespace):
+    return dendropy.Tree.get(path=path,
+                             schema='newick',
+                             rooting='force-rooted',
+                             taxon_namespace=taxon_namespace)
+
+
+def read_manifest(path):
+    """
+    Each line holds the path of an estimated tree, optionally followed by
+    the path its score is written to (defaults to the tree path with a
+    .score suffix).
+    """
+    pairs = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            est = fields[0]
+            if len(fields) > 1:
+                out = fields[1]
+            else:
+                out = os.path.splitext(est)[0] + '.score'
+            pairs.append((est, out))
+    return pairs
+
+
+def write_metrics(path, rows):
+    """
+    Add rows (tree path, nl, metrics) to the metrics table at path, one
+    tab-separated row per tree with the tree path relative to the table,
+    replacing the earlier rows of the same trees. The table is updated
+    under a lock on path.lock and renamed into place.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    columns = ['tree', 'n_leaves'] + METRICS
+    with open('%s.lock' % path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        table = {}
+        if os.path.isfile(path):
+            with open(path, newline='') as f:
+                for row in csv.DictReader(f, delimiter='\t'):
+                    table[row['tree']] = row
+        for est_fp, nl, metrics in rows:
+            tree = os.path.relpath(os.path.abspath(est_fp), base)
+            table[tree] = dict(metrics, tree=tree, n_leaves=nl)
+
+        tmp = '%s.tmp%d' % (path, os.getpid())
+        with open(tmp, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns, delimiter='\t',
+                                    extrasaction='ignore')
+            writer.writeheader()
+            for tree in sorted(table):
+                writer.writerow(table[tree])
+        os.replace(tmp, path)
+
+
+def score_many(reference, pairs, backend='dendropy', metrics_fp=None):
+    """
+    Score every estimated tree in pairs against one reference tree, writing
+    each normalized clade distance to its score file. The reference is
+    parsed once. With the dendropy backend it is only copied when an
+    estimate has a different leaf set, since clade_distance prunes both of
+    its inputs in that case; the bitset backend keeps the reference clades
+    and their restrictions to each leaf set in a ReferenceClades. With a
+    metrics_fp, all the METRICS of every tree are computed from its clades
+    in the same pass and written to that table (see write_metrics).
+    """
+    if backend == 'bitset' or metrics_fp is not None:
+        index = {}
+        ref_clades = ReferenceClades(*read_clades(reference, index))
+    if backend != 'bitset':
+        tax = dendropy.TaxonNamespace()
+        ref = read_tree(reference, tax)
+        ref_labels = set([l.taxon.label for l in ref.leaf_nodes()])
+
+    scores = []
+    rows = []
+    for est_fp, score_fp in pairs:
+        if backend == 'bitset':
+            est_clades = read_clades(est_fp, index)
+            if metrics_fp is not None:
+                nl, metrics = ref_clades.metrics(est_clades)
+                cd = metrics['ncd']
+            else:
+                nl, cd = ref_clades.distance(est_clades)
+        else:
+            est = read_tree(est_fp, tax)
+            if metrics_fp is not None:
+                # before clade_distance prunes it
+                nl, metrics = ref_clades.metrics(tree_clades(est, index))
+            lb = set([l.taxon.label for l in est.leaf_nodes()])
+            if lb == ref_labels:
+                tr1 = ref
+            else:
+                tr1 = ref.clone(depth=1)
+            nl, cd = clade_distance(tr1, est)
+        if metrics_fp is not None:
+            rows.append((est_fp, nl, metrics))
+
+        # written aside and renamed, so a score file is never partial
+        tmp_fp = '%s.tmp%d' % (score_fp, os.getpid())
+        with open(tmp_fp, 'w') as f:
+            f.write('%s\n' % cd)
+        os.replace(tmp_fp, score_fp)
+        scores.append((est_fp, cd))
+
+    if metrics_fp is not None:
+        write_metrics(metrics_fp, rows)
+    return scores
+
+
 def main(args):
-    tax = dendropy.TaxonNamespace()
-    tr1 = dendropy.Tree.get(path=args.tree1,
-                            schema='newick',
-                            rooting='force-rooted',
-                            taxon_namespace=tax)
-    tr2 = dendropy.Tree.get(path=args.tree2,
-                            schema='newick',
-                            rooting='force-rooted',
-                            taxon_namespace=tax)
-
-    nl, cd = clade_distance(tr1, tr2)
+    if args.pairs is not None:
+        if args.manifest is None:
+            sys.exit('--pairs requires --manifest')
+        labels = [est for est, _ in read_manifest(args.manifest)]
+        index = {}
+        trees = [read_clades(fp, index) for fp in labels]
+        nl = write_pairs(args.pairs, trees, labels,
+                         max_bytes=args.chunk_mb << 20)
+        print('%d trees, pairs on at least %d common leaves'
+              % (len(trees), nl))
+        return
+
+    if args.manifest is not None:
+        reference = args.reference or args.tree1
+        if reference is None:
+            sys.exit('--manifest requires --reference')
+        for est_fp, cd in score_many(reference,
+                                     read_manifest(args.manifest),
+                                     backend=args.backend,
+                                     metrics_fp=args.metrics):
+            print('%s\t%s' % (est_fp, cd))
+        return
+
+    if args.tree1 is None or args.tree2 is None:
+        sys.exit('-t1 and -t2 are required without --manifest')
+
+    if args.metrics is not None:
+        index = {}
+        nl, metrics = clade_metrics(read_clades(args.tree1, index),
+                                    read_clades(args.tree2, index))
+        write_metrics(args.metrics, [(args.tree2, nl, metrics)])
+        cd = metrics['ncd']
+    elif args.backend == 'bitset':
+        index = {}
+        nl, cd = bitset_clade_distance(read_clades(args.tree1, index),
+                                       read_clades(args.tree2, index))
+    else:
+        tax = dendropy.TaxonNamespace()
+        tr1 = read_tree(args.tree1, tax)
+        tr2 = read_tree(args.tree2, tax)
+        nl, cd = clade_distance(tr1, tr2)
     print(cd)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Normalized Clade distance for two rooted trees")
-    parser.add_argument("-t1", "--tree1", type=str,  required=True,
+    parser.add_argument("-t1", "--tree1", type=str,
                         help="File containing newick string for tree 1")
-    parser.add_argument("-t2", "--tree2", type=str, required=True,
+    parser.add_argument("-t2", "--tree2", type=str,
                         help="File containing newick string for tree 2")
+    parser.add_argument("-r", "--reference", type=str,
+                        help="File containing newick string for the "
+                             "reference tree (batch mode)")
+    parser.add_argument("-m", "--manifest", type=str,
+                        help="File listing estimated trees to score against "
+                             "the reference, one per line (batch mode)")
+    parser.add_argument("-b", "--backend", type=str, default="dendropy",
+                        choices=["dendropy", "bitset"],
+                        help="Compare dendropy trees or clade bitmasks "
+                             "parsed straight from the newick strings")
+    parser.add_argument("-P", "--pairs", type=str,
+                        help="Write the nCD matrix of all pairs of trees in "
+                             "--manifest to this file (.npy or tab-separated)")
+    parser.add_argument("--chunk-mb", type=int, default=256,
+                        help="Memory for each block of pairs in --pairs (MB)")
+    parser.add_argument("-M", "--metrics", type=str,
+                        help="Table to add a row of all metrics (nCD, "
+                             "unrooted RF, correct root, root distance) "
+                             "of every estimated tree to")
     main(parser.parse_args())
@@ -0,0 +1,379 @@
+"""
+Deduplicated, zstd-compressed archive of output/trees.
+
+zip -r compresses every one of the many small files of output/trees on its
+own, and stores as many copies of the content they share: the unrooted
+species trees copied for trues, the g_multi.trees of every n_genes (each a
+prefix of the next) and the one-tree files of split/. An archive here is a
+directory of two files:
+
+- data: zstd frames, each a block of up to --block-mb of chunks of file
+  content. Files are cut into chunks at line ends chosen by the content of
+  the line (or every MAX_CHUNK bytes), so a file and its copies or prefixes
+  share all their chunks but the last, and every chunk is stored once.
+- index.json.zst: the offset of every block, the block and position of
+  every chunk (by its blake2b digest) and the size, mtime and chunks of
+  every file, by its path relative to the archived directory.
+
+Reading a file only decompresses the blocks holding its chunks, so a single
+replicate can be listed or unpacked without the rest. With --incremental,
+pack only reads files whose size or mtime changed since the last pack and
+appends the chunks not stored yet; data is truncated back to the size in
+the index first, so an interrupted pack leaves the archive as it was.
+The chunks of removed or modified files stay in data until the next pack
+without --incremental.
+
+    python pack.py pack output/trees/ discoqr_discoqrstar.pack --incremental
+    python pack.py unpack discoqr_discoqrstar.pack output/trees/ 50_gdl_1e-12_1_hILS/01/
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import zlib
+from pathlib import Path
+
+import zstandard
+
+INDEX_VERSION = 1
+
+# chunks end after a line with these low bits of its crc32 all zero, once
+# they hold at least MIN_CHUNK bytes, or at MAX_CHUNK bytes
+MIN_CHUNK = 1 << 12
+MAX_CHUNK = 1 << 20
+CUT_MASK = (1 << 4) - 1
+
+# mtimes closer than this to the pack may still change within the same
+# timestamp on coarse file systems, so they are not trusted next time
+RACY_NS = 2 * 10**9
+
+
+def chunk_digest(chunk):
+    return hashlib.blake2b(chunk, digest_size=16).hexdigest()
+
+
+def iter_chunks(f):
+    """Content-defined chunks of the binary file object f."""
+    chunk = bytearray()
+    while True:
+        line = f.readline(MAX_CHUNK - len(chunk))
+        if not line:
+            break
+        chunk += line
+        if len(chunk) >= MAX_CHUNK or (
+            len(chunk) >= MIN_CHUNK and not zlib.crc32(line) & CUT_MASK
+        ):
+            yield bytes(chunk)
+            chunk = bytearray()
+    if chunk:
+        yield bytes(chunk)
+
+
+def iter_files(root):
+    """
+    Paths relative to root of the files below it, leaving out the locks
+    and the temporary outputs of stages still running.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(".tmp"))
+        rel = os.path.relpath(dirpath, root)
+        for name in sorted(filenames):
+            if name.endswith(".lock") or ".tmp" in name:
+                continue
+            yield name if rel == "." else f"{rel}/{name}"
+
+
+class Archive(object):
+    """
+    An archive directory (see the module docstring), read from its index
+    if it has one. Files are added with add() and the archive written by
+    save(); files are read with read() and unpack().
+    """
+
+    def __init__(self, path, level=9, block_size=4 << 20):
+        self.path = Path(path)
+        self.data_file = self.path / "data"
+        self.index_file = self.path / "index.json.zst"
+        self.level = level
+        self.block_size = block_size
+        self.size = 0
+        self.time = None
+        self.blocks = []
+        self.chunks = {}
+        self.files = {}
+        if self.index_file.is_file():
+            index = json.loads(
+                zstandard.ZstdDecompressor().decompress(self.index_file.read_bytes())
+            )
+            assert (
+                index["version"] == INDEX_VERSION
+            ), f"{self.index_file} has index version {index['version']}"
+            self.size = index["size"]
+            self.time = index["time"]
+            self.blocks = index["blocks"]
+            self.chunks = index["chunks"]
+            self.files = index["files"]
+        self._pending = bytearray()
+        self._data = None
+        self._cached_block = (None, None)
+
+    # writing
+
+    def _open_data(self):
+        if self._data is None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._data = open(self.data_file, "ab")
+            # blocks appended by an interrupted pack are not in the index
+            self._data.truncate(self.size)
+            self._data.seek(self.size)
+        return self._data
+
+    def _flush_block(self):
+        if not self._pending:
+            return
+        frame = zstandard.ZstdCompressor(level=self.level, threads=-1).compress(
+            bytes(self._pending)
+        )
+        data = self._open_data()
+        self.blocks.append([data.tell(), len(frame)])
+        data.write(frame)
+        self._pending = bytearray()
+
+    def _store(self, chunk):
+        digest = chunk_digest(chunk)
+        if digest not in self.chunks:
+            self.chunks[digest] = [len(self.blocks), len(self._pending), len(chunk)]
+            self._pending += chunk
+            if len(self._pending) >= self.block_size:
+                self._flush_block()
+        return digest
+
+    def add(self, rel, fp, st):
+        """Add the file fp, with stat result st, as rel."""
+        size, digests = 0, []
+        with open(fp, "rb") as f:
+            for chunk in iter_chunks(f):
+                size += len(chunk)
+                digests.append(self._store(chunk))
+        # a file rewritten while it is read differs from st next time
+        self.files[rel] = [st.st_mtime_ns, size, digests]
+
+    def unchanged(self, rel, st):
+        """Whether rel is archived with the size and mtime of st."""
+        entry = self.files.get(rel)
+        return (
+            entry is not None
+            and entry[:2] == [st.st_mtime_ns, st.st_size]
+            and self.time is not None
+            and self.time - st.st_mtime_ns > RACY_NS
+        )
+
+    def save(self):
+        """Write the pending block, then the index pointing at it."""
+        self._flush_block()
+        if self._data is not None:
+            self._data.flush()
+            os.fsync(self._data.fileno())
+            self.size = self._data.tell()
+            self._data.close()
+            self._data = None
+        self.path.mkdir(parents=True, exist_ok=True)
+        index = {
+            "version": INDEX_VERSION,
+            "size": self.size,
+            "time": self.time,
+            "blocks": self.blocks,
+            "chunks": self.chunks,
+            "files": self.files,
+        }
+        tmp = self.index_file.with_name(f"{self.index_file.name}.tmp{os.getpid()}")
+        tmp.write_bytes(
+            zstandard.ZstdCompressor(level=self.level).compress(
+                json.dumps(index).encode()
+            )
+        )
+        os.replace(tmp, self.index_file)
+
+    # reading
+
+    def _block(self, i):
+        if self._cached_block[0] != i:
+            offset, length = self.blocks[i]
+            with open(self.data_file, "rb") as f:
+                f.seek(offset)
+                frame = f.read(length)
+            self._cached_block = (i, zstandard.ZstdDecompressor().decompress(frame))
+        return self._cached_block[1]
+
+    def iter_content(self, rel):
+        """The chunks of the archived file rel, checked against their digests."""
+        for digest in self.files[rel][2]:
+            block, offset, length = self.chunks[digest]
+            chunk = self._block(block)[offset : offset + length]
+            if chunk_digest(chunk) != digest:
+                raise ValueError(f"corrupt chunk {digest} of {rel}")
+            yield chunk
+
+    def read(self, rel):
+        """Content of the archived file rel."""
+        return b"".join(self.iter_content(rel))
+
+    def select(self, prefixes=()):
+        """Archived paths below any of prefixes (all without prefixes)."""
+        prefixes = [p.strip("/") for p in prefixes]
+        return [
+            rel
+            for rel in self.files
+            if not prefixes
+            or any(rel == p or rel.startswith(f"{p}/") or not p for p in prefixes)
+        ]
+
+    def unpack(self, dest, prefixes=()):
+        """
+        Write the archived files below prefixes into dest, with their
+        mtimes. Returns the number of files written.
+        """
+        dest = Path(dest)
+        rels = self.select(prefixes)
+        # in order of their first block, so each block is read about once
+        rels.sort(key=lambda rel: [self.chunks[d][0] for d in self.files[rel][2][:1]])
+        for rel in rels:
+            fp = dest / rel
+            fp.parent.mkdir(parents=True, exist_ok=True)
+            tmp = fp.with_name(f"{fp.name}.tmp{os.getpid()}")
+            with open(tmp, "wb") as f:
+                for chunk in self.iter_content(rel):
+                    f.write(chunk)
+            mtime = self.files[rel][0]
+            os.utime(tmp, ns=(mtime, mtime))
+            os.replace(tmp, fp)
+        return len(rels)
+
+
+def pack(src, archive_path, incremental=False, level=9, block_size=4 << 20):
+    """
+    Archive the files below src into archive_path: from scratch, replacing
+    the archive once it is complete, or with incremental, adding to it the
+    files that changed since it was last packed.
+    """
+    src = Path(src)
+    archive_path = Path(archive_path)
+    if incremental:
+        target = archive_path
+    else:
+        target = archive_path.with_name(f"{archive_path.name}.tmp{os.getpid()}")
+        shutil.rmtree(target, ignore_errors=True)
+    archive = Archive(target, level, block_size)
+
+    start = time.time_ns()
+    files = {}
+    n_read = 0
+    n_chunks = len(archive.chunks)
+    # hard links (split/ files, g_multi.trees of the largest n_genes) are
+    # read once
+    by_inode = {}
+    for rel in iter_files(src):
+        try:
+            st = os.stat(src / rel)
+        except FileNotFoundError:
+            continue
+        if archive.unchanged(rel, st):
+            files[rel] = archive.files[rel]
+            continue
+        inode = (st.st_dev, st.st_ino)
+        if inode in by_inode and by_inode[inode][:2] == [st.st_mtime_ns, st.st_size]:
+            files[rel] = by_inode[inode]
+            continue
+        archive.add(rel, src / rel, st)
+        files[rel] = by_inode[inode] = archive.files[rel]
+        n_read += 1
+
+    n_removed = len(set(archive.files) - set(files))
+    archive.files = files
+    archive.time = start
+    archive.save()
+    if not incremental:
+        if archive_path.exists():
+            shutil.rmtree(archive_path)
+        target.rename(archive_path)
+    print(
+        f"Read {n_read} new or modified of {len(files)} files "
+        f"({n_removed} removed), stored {len(archive.chunks) - n_chunks} new "
+        f"chunks; {archive_path} holds {len(archive.chunks)} chunks in "
+        f"{archive.size / 2**20:.1f} MB"
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Pack output/trees into a deduplicated zstd archive, or read it."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    pack_parser = commands.add_parser("pack", help="Archive a directory.")
+    pack_parser.add_argument("src", type=str, help="Directory to archive.")
+    pack_parser.add_argument("archive", type=str, help="Archive directory.")
+    pack_parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only add the files changed since the archive was last packed.",
+    )
+    pack_parser.add_argument(
+        "--level", type=int, default=9, help="zstd compression level."
+    )
+    pack_parser.add_argument(
+        "--block-mb",
+        type=int,
+        default=4,
+        help="Size of the blocks of chunks compressed together (MB).",
+    )
+
+    list_parser = commands.add_parser("list", help="List the archived files.")
+    list_parser.add_argument("archive", type=str, help="Archive directory.")
+    list_parser.add_argument(
+        "prefixes",
+        type=str,
+        nargs="*",
+        help="Only list below these directories (replicates: 50_gdl_1e-12_1/01/).",
+    )
+
+    unpack_parser = commands.add_parser("unpack", help="Extract archived files.")
+    unpack_parser.add_argument("archive", type=str, help="Archive directory.")
+    unpack_parser.add_argument("dest", type=str, help="Directory to extract to.")
+    unpack_parser.add_argument(
+        "prefixes",
+        type=str,
+        nargs="*",
+        help="Only extract below these directories (replicates: 50_gdl_1e-12_1/01/).",
+    )
+
+    cat_parser = commands.add_parser("cat", help="Write an archived file to stdout.")
+    cat_parser.add_argument("archive", type=str, help="Archive directory.")
+    cat_parser.add_argument("path", type=str, help="Archived path.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "pack":
+        assert Path(args.src).is_dir(), f"Input directory {args.src} does not exist."
+        pack(args.src, args.archive, args.incremental, args.level, args.block_mb << 20)
+        sys.exit(0)
+
+    assert Path(
+        args.archive, "index.json.zst"
+    ).is_file(), f"{args.archive} is not an archive."
+    archive = Archive(args.archive)
+    if args.command == "list":
+        for rel in sorted(archive.select(args.prefixes)):
+            print(f"{archive.files[rel][1]:>12} {rel}")
+    elif args.command == "unpack":
+        n = archive.unpack(args.dest, args.prefixes)
+        print(f"Extracted {n} files to {args.dest}")
+    else:
+        for chunk in archive.iter_content(args.path.strip("/")):
+            sys.stdout.buffer.write(chunk)
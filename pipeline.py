@@ -0,0 +1,792 @@
+"""
+Run the DISCO+QR/QR-STAR and STRIDE experiments as a dependency graph.
+
+Each replicate cell goes through
+
+    DISCO blocks -> g_single -> unrooted species tree -> QR/QR-STAR sweep
+    split -----------------------------------------------> STRIDE
+                                                          -> scores
+
+with the same output layout as run.sh and run_STRIDE.sh, the gene trees
+being taken from the indexed gene trees of the replicate (genetrees.py).
+DISCO decomposes every gene tree on its own, so it is run once per
+(replicate, g_type) on blocks of consecutive trees in <g_type>g/disco/,
+and the g_single.trees of every n_genes is the concatenation of the blocks
+of its first n_genes trees. The QR and QR-STAR rootings of a species tree
+at every mult run in one process (quintets.py), sharing the quintet counts
+of the gene trees. Independent tasks run on a process pool, tasks whose
+outputs already exist are skipped, and the grid can be split across the
+tasks of a SLURM job array.
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import shutil
+import sys
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
+from itertools import groupby, product
+from pathlib import Path
+
+import cache
+import ncd
+import quintets
+import stage
+from genetrees import GeneTrees
+
+# A node of the pipeline graph. func(*args) is run in a worker process once
+# every task in deps has finished; a partial task also runs when some of its
+# deps failed, a regular one is skipped. Tasks whose outputs are all done
+# (task_done) are not run again. stages are the stage directories a task
+# fills besides its key, for manifests of missing stages and done markers.
+Task = namedtuple(
+    "Task",
+    ["key", "deps", "outputs", "func", "args", "partial", "stages"],
+    defaults=[()],
+)
+
+S_EST_METHODS = ["trues", "astrid", "astral"]
+ROOTING_METHODS = ["qr", "qrstar", "stride"]
+
+
+def replicate_id(num_species, dup_rate, loss_rate_indicator, hILS):
+    id = f"{num_species}_gdl_{dup_rate}_{loss_rate_indicator}"
+    if hILS:
+        id = f"{id}_hILS"
+    return id
+
+
+def run_tool(
+    argv, stage_dir, outputs, inputs=(), cache_dir=None, runner=None, validate=None
+):
+    """
+    Run a tool under /usr/bin/time -v with stdout/stderr in run.out/run.err
+    of stage_dir, and mark the stage done with the checksums of its outputs
+    once they all exist and pass validate(path). The stage is run under its
+    lock and its outputs renamed into place (stage.run_atomic), so scripts
+    sharing it run it once and a killed run leaves no partial output. With a
+    cache_dir, the done marker also records the cache key of the run: the
+    stage is left alone if the key still matches, and is otherwise linked
+    from the cache or rerun. A runner(argv, out, err) runs the tool
+    instead, writing its own time report to err.
+    """
+    stage_dir = Path(stage_dir)
+
+    with stage.locked(stage_dir):
+        key = None
+        if cache_dir is not None:
+            key = cache.cache_key(argv, inputs, stage_dir)
+        # done before, or by another process while this one waited for the lock
+        if stage.is_done(stage_dir, outputs, key, validate):
+            return
+        if key is not None and cache.fetch(cache_dir, key, stage_dir, outputs):
+            stage.write_marker(stage_dir, outputs, key)
+            return
+
+        stage.run_atomic(argv, stage_dir, outputs, inputs, runner, validate)
+
+        if key is not None:
+            cache.store(cache_dir, key, stage_dir, outputs)
+        stage.write_marker(stage_dir, outputs, key)
+
+
+def gene_tree_index(input_tree_raw, output_dir):
+    # one index per replicate and g_type, next to the cells using it
+    return Path(output_dir) / f"{Path(input_tree_raw).name}.idx"
+
+
+def disco_blocks(n_genes_list, chunk):
+    """
+    (start, stop) of the blocks of gene trees DISCO is run on: at most
+    chunk trees each, with a block ending at every n_genes.
+    """
+    stops = set(n_genes_list)
+    stops.update(range(chunk, max(n_genes_list), chunk))
+    starts = [0] + sorted(stops)
+    return list(zip(starts, starts[1:]))
+
+
+def derive(src, stage_dir, outputs, write, name="done"):
+    """
+    Make outputs from the file src with write(), under the lock of
+    stage_dir, unless its marker name records them with the digest of src
+    as key: the gene tree files and true species trees taken from data/
+    are made again when their source changes, so what is computed from
+    them (and its cache key) follows.
+    """
+    stage_dir = Path(stage_dir)
+    key = cache.digest(src)
+    with stage.locked(stage_dir):
+        if stage.is_done(stage_dir, outputs, key, name=name):
+            return
+        (stage_dir / name).unlink(missing_ok=True)
+        write()
+        stage.write_marker(stage_dir, outputs, key, name)
+
+
+def write_gene_tree_block(src, dst, start, stop, index_file):
+    # the block directory is DISCO's stage, with its own done marker
+    dst = Path(dst)
+
+    def write():
+        with GeneTrees(src, index_file) as trees:
+            trees.write_block(start, stop, dst)
+
+    derive(src, dst.parent, [dst], write, f"{dst.name}.done")
+
+
+def concat_blocks(block_dirs, disco_dir):
+    """
+    Write the g_single.trees of a cell as the concatenation of those of
+    block_dirs, listing the blocks (relative to disco_dir) in disco/blocks.
+    This runs under the lock of disco_dir, which run.sh and run_STRIDE.sh
+    run DISCO into, and is skipped while the done marker records the
+    current blocks (by the digests of their trees) and g_single.
+    """
+    disco_dir = Path(disco_dir)
+    g_single = disco_dir / "g_single.trees"
+    block_trees = [Path(block_dir) / "g_single.trees" for block_dir in block_dirs]
+    key = hashlib.sha256(
+        "".join(f"{cache.digest(fp)}\n" for fp in block_trees).encode()
+    ).hexdigest()
+    with stage.locked(disco_dir):
+        if stage.is_done(disco_dir, [g_single], key):
+            return
+        tmp = disco_dir / f"g_single.trees.tmp{os.getpid()}"
+        with open(tmp, "wb") as out:
+            for fp in block_trees:
+                with open(fp, "rb") as f:
+                    shutil.copyfileobj(f, out)
+        (disco_dir / "done").unlink(missing_ok=True)
+        os.replace(tmp, g_single)
+        (disco_dir / "blocks").write_text(
+            "".join(f"{os.path.relpath(d, disco_dir)}\n" for d in block_dirs)
+        )
+        stage.write_marker(disco_dir, [g_single], key)
+
+
+def root_sweep(runs, cache_dir, sweep_dir):
+    """
+    Run the QR and QR-STAR rootings (argv, stage_dir, outputs, inputs,
+    validate) of a species tree in order in this process, as one
+    quintets.Sweep sharing their quintet counts. Every run gets its own
+    stage directory as with run_tool, which skips the runs that are done,
+    and the first failure is raised once all have run. The cost of the
+    runs made is reported in sweep_dir/run.err.
+    """
+    sweep = quintets.Sweep()
+    report_fp = Path(sweep_dir) / "run.err"
+    ran = []
+    failed = []
+    for argv, stage_dir, outputs, inputs, validate in runs:
+        runner = partial(
+            sweep.run, report_fp=os.path.relpath(report_fp, Path(stage_dir))
+        )
+        n_costs = len(sweep.costs)
+        try:
+            run_tool(argv, stage_dir, outputs, inputs, cache_dir, runner, validate)
+        except RuntimeError as e:
+            failed.append(e)
+        if len(sweep.costs) > n_costs:
+            ran.append(os.path.relpath(stage_dir, Path(sweep_dir).parent))
+            sweep.write_report(report_fp, ran)
+        # keep the counts of finished runs if the sweep is interrupted
+        sweep.save()
+    if failed:
+        raise failed[0]
+
+
+def split_gene_trees(src, split_dir, n_genes, index_file):
+    # the one-tree files are pooled in split/ of the g_type directory,
+    # emptied when src changes
+    split_dir = Path(split_dir)
+    pool_dir = split_dir.parent.parent / "split"
+    key = cache.digest(src)
+    with stage.locked(pool_dir):
+        marker = stage.read_marker(pool_dir)
+        if marker is None or marker[0] != key:
+            for entry in pool_dir.iterdir():
+                if entry.name != ".lock":
+                    entry.unlink()
+            stage.write_marker(pool_dir, [], key)
+
+        def write():
+            shutil.rmtree(split_dir, ignore_errors=True)
+            with GeneTrees(src, index_file) as trees:
+                trees.write_split(n_genes, split_dir, pool_dir)
+
+        derive(src, split_dir.parent, [split_dir], write, "split.done")
+
+
+def copy_tree(src, stage_dir, dst):
+    def copy():
+        tmp = Path(stage_dir) / f".tmp{os.getpid()}"
+        shutil.copyfile(src, tmp)
+        try:
+            stage.validate_newick(tmp)
+        except ValueError as e:
+            tmp.unlink()
+            raise RuntimeError(f"{src} is not a valid tree: {e}")
+        os.replace(tmp, dst)
+
+    derive(src, stage_dir, [dst], copy)
+
+
+def score_trees(reference, trees, metrics_file):
+    # only trees their stage has marked done, never a partial one
+    pairs = [
+        (fp, str(Path(fp).with_suffix(".score")))
+        for fp in trees
+        if stage.is_complete(fp)
+    ]
+    ncd.score_many(reference, pairs, backend="bitset", metrics_fp=str(metrics_file))
+
+
+def replicates(args):
+    """(id, run_id) of every replicate in the grid of args."""
+    for loss_rate_indicator, hILS, dup_rate, num_species, run_id in product(
+        args.loss_rate_indicator,
+        args.hILS,
+        args.dup_rate,
+        args.num_species,
+        args.run_id,
+    ):
+        yield replicate_id(num_species, dup_rate, loss_rate_indicator, hILS), run_id
+
+
+def read_missing(path):
+    """
+    Keys (relative to the output directory) of the stages listed in a
+    manifest written by check_missing.py, with missing scores also standing
+    for the scoring task of their replicate.
+    """
+    if Path(path).suffix == ".csv":
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+    else:
+        rows = json.loads(Path(path).read_text())
+
+    keys = set()
+    for row in rows:
+        keys.add(Path(row["stage_dir"]))
+        if row["stage"] == "score":
+            keys.add(Path(row["replicate"]) / "score")
+    return keys
+
+
+def prune_tasks(tasks, keys):
+    """The tasks in keys and everything they depend on, in dependency order."""
+    wanted = set(keys)
+    for key in reversed(list(tasks)):
+        if key in wanted or not wanted.isdisjoint(tasks[key].stages):
+            wanted.add(key)
+            wanted.update(tasks[key].deps)
+    return {key: task for key, task in tasks.items() if key in wanted}
+
+
+def add_task(tasks, key, deps, outputs, func, *func_args):
+    tasks[key] = Task(key, deps, [str(fp) for fp in outputs], func, func_args, False)
+    return key
+
+
+def add_tool_task(tasks, args, key, deps, inputs, argv, outputs, validate=None):
+    # with a cache, a tool task always runs to check its key
+    return add_task(
+        tasks,
+        key,
+        deps,
+        [] if args.cache else outputs,
+        run_tool,
+        argv,
+        key,
+        [str(fp) for fp in outputs],
+        [str(fp) for fp in inputs],
+        args.cache,
+        None,
+        validate,
+    )
+
+
+def newick_check(leaves_of=None, empty=False):
+    """Validator of trees with the taxa of the trees in leaves_of."""
+    if leaves_of is not None:
+        leaves_of = str(leaves_of)
+    return partial(stage.validate_newick, leaves_of=leaves_of, empty=empty)
+
+
+def task_done(task):
+    """
+    Whether the outputs of task are all there. Those in its stage
+    directories (its key and stages) must also match the checksums in
+    their done marker, the others are only ever written atomically.
+    """
+    stage_dirs = {Path(task.key), *map(Path, task.stages)}
+    return bool(task.outputs) and all(
+        stage.is_complete(fp) if Path(fp).parent in stage_dirs else Path(fp).exists()
+        for fp in task.outputs
+    )
+
+
+def add_disco_tasks(tasks, args, input_tree_raw, g_dir, index_file, n_genes_list):
+    """
+    Add the DISCO tasks of the blocks of gene trees of one (replicate,
+    g_type) covering the first max(n_genes_list) trees, and return the
+    (stop, key) of every block. The blocks follow the whole --n-genes grid,
+    so a run on part of it reuses the same blocks.
+    """
+    py = sys.executable
+    blocks = []
+    for start, stop in disco_blocks(args.n_genes, args.disco_chunk):
+        if stop > max(n_genes_list):
+            break
+        block_dir = g_dir / "disco" / f"{start}-{stop}"
+        g_multi = block_dir / "g_multi.trees"
+        g_single = block_dir / "g_single.trees"
+        # with a cache, the block checks its source like the tools their key
+        t_multi = add_task(
+            tasks,
+            g_multi,
+            [],
+            [] if args.cache else [g_multi],
+            write_gene_tree_block,
+            input_tree_raw,
+            g_multi,
+            start,
+            stop,
+            index_file,
+        )
+        argv = [
+            py, "DISCO/disco.py",
+            "-i", str(g_multi),
+            "-o", str(g_single),
+            "-d", "_",
+        ]  # fmt: skip
+        blocks.append(
+            (
+                stop,
+                add_tool_task(
+                    tasks,
+                    args,
+                    block_dir,
+                    [t_multi],
+                    [g_multi],
+                    argv,
+                    [g_single],
+                    # blocks past the last gene tree are empty
+                    newick_check(empty=True),
+                ),
+            )
+        )
+    return blocks
+
+
+def add_cell_tasks(tasks, args, input_tree_raw, s_tree, cell_dir, n_genes, blocks):
+    """
+    Add the tasks of one (replicate, g_type, n_genes) cell, whose gene trees
+    are decomposed by the DISCO blocks of add_disco_tasks, and return the
+    (task key, stage directory) of every rooted species tree.
+    """
+
+    def add(key, deps, outputs, func, *func_args):
+        return add_task(tasks, key, deps, outputs, func, *func_args)
+
+    def add_tool(key, deps, inputs, argv, outputs, validate):
+        return add_tool_task(tasks, args, key, deps, inputs, argv, outputs, validate)
+
+    py = sys.executable
+    rooted = []
+
+    index_file = gene_tree_index(input_tree_raw, cell_dir.parent.parent)
+    disco_dir = cell_dir / "disco"
+    g_single = disco_dir / "g_single.trees"
+    block_dirs = [key for stop, key in blocks if stop <= n_genes]
+    # with a cache, blocks may change under an existing g_single
+    t_disco = add(
+        disco_dir,
+        block_dirs,
+        [] if args.cache else [g_single],
+        concat_blocks,
+        block_dirs,
+        disco_dir,
+    )
+
+    if "stride" in args.rooting:
+        split_dir = cell_dir / "split"
+        t_split = add(
+            split_dir,
+            [],
+            [] if args.cache else [split_dir],
+            split_gene_trees,
+            input_tree_raw,
+            split_dir,
+            n_genes,
+            index_file,
+        )
+
+    for s_est_method in args.s_est_method:
+        s_dir = disco_dir / s_est_method
+        s_unrooted = s_dir / "s_unrooted_est.tree"
+        if s_est_method == "trues":
+            t_s = add(
+                s_dir,
+                [],
+                [] if args.cache else [s_unrooted],
+                copy_tree,
+                s_tree,
+                s_dir,
+                s_unrooted,
+            )
+        else:
+            if s_est_method == "astrid":
+                exe = "./ASTRID/bazel-bin/src/ASTRID"
+            else:
+                exe = "./ASTER/bin/astral4"
+            argv = [exe, "-i", str(g_single), "-o", str(s_unrooted)]
+            t_s = add_tool(
+                s_dir,
+                [t_disco],
+                [g_single],
+                argv,
+                [s_unrooted],
+                newick_check(g_single),
+            )
+
+        if "stride" in args.rooting:
+            r_dir = cell_dir / "stride" / s_est_method
+            r_tree = r_dir / "s_rooted_est.tree"
+            argv = [
+                py, "STRIDE/stride/stride.py",
+                "-d", f"{split_dir}/",
+                "-s", "dash",
+                "-S", str(s_unrooted),
+                "-o", str(r_dir / "s_rooted_est"),
+            ]  # fmt: skip
+            t_r = add_tool(
+                r_dir,
+                [t_split, t_s],
+                [split_dir, s_unrooted],
+                argv,
+                [r_tree],
+                newick_check(s_unrooted),
+            )
+            rooted.append((t_r, r_dir))
+
+        # QR, then QR-STAR, each from the largest mult down, in one sweep
+        runs = []
+        for rs_est_method in ["qr", "qrstar"]:
+            if rs_est_method not in args.rooting:
+                continue
+            for mult in sorted(args.mult, reverse=True):
+                r_dir = s_dir / rs_est_method / "le" / f"{mult}"
+                r_tree = r_dir / "s_rooted_est.tree"
+                argv = [
+                    py, "quintets.py", "Quintet-Rooting/quintet_rooting.py",
+                    "-t", str(s_unrooted),
+                    "-g", str(g_single),
+                    "-o", str(r_tree),
+                    "-sm", "LE",
+                ]  # fmt: skip
+                if rs_est_method == "qrstar":
+                    argv += ["-c", "STAR"]
+                argv += ["-rs", "0", "-mult", f"{mult}"]
+                inputs = [str(s_unrooted), str(g_single)]
+                validate = newick_check(s_unrooted)
+                runs.append((argv, str(r_dir), [str(r_tree)], inputs, validate))
+        if runs:
+            key = s_dir / "quintets"
+            r_dirs = [Path(run[1]) for run in runs]
+            # with a cache, every run checks its key
+            outputs = [] if args.cache else [fp for run in runs for fp in run[2]]
+            tasks[key] = Task(
+                key,
+                [t_disco, t_s],
+                outputs,
+                root_sweep,
+                (runs, args.cache, key),
+                False,
+                r_dirs,
+            )
+            rooted += [(key, r_dir) for r_dir in r_dirs]
+
+    return rooted
+
+
+def cells(args):
+    """
+    (id, run_id, g_type, n_genes) of every cell of the grid in args with
+    input gene trees, replicate by replicate.
+    """
+    for id, run_id in replicates(args):
+        input_dir = Path(args.data) / id / run_id
+        if not input_dir.is_dir():
+            continue
+        for g_type in args.g_type:
+            if not (input_dir / f"g_{g_type}.trees").is_file():
+                continue
+            for n_genes in args.n_genes:
+                yield id, run_id, g_type, n_genes
+
+
+def cell_key(id, run_id, g_type, n_genes):
+    """Key of a cell in missing-stage manifests and shard files."""
+    return (id, run_id, f"{g_type}g", f"{n_genes}")
+
+
+def read_shard(path, array_task):
+    """Keys of the cells of one shard of a shard file written by schedule.py."""
+    shards = json.loads(Path(path).read_text())
+    return {tuple(cell) for cell in shards[array_task]["cells"]}
+
+
+def build_tasks(args):
+    """
+    Tasks for every cell of the grid in args, in dependency order, plus one
+    scoring task per replicate, writing the nCD of every rooted tree and
+    all of its ncd.METRICS to metrics.tsv of the replicate. The cells of a (replicate, g_type) share
+    their DISCO blocks, so they are kept together: with more than one array
+    task, the i-th (replicate, g_type) is handled by array task
+    i % array_count, or with a shard file by the array task whose shard
+    lists its cells. With a manifest of missing stages, only the cells and
+    stages it lists (and the tasks they depend on) are kept.
+    """
+    if args.missing:
+        missing = read_missing(args.missing)
+        # (id, run_id, g_type, n_genes) cells with missing stages
+        missing_cells = {key.parts[:4] for key in missing if len(key.parts) > 4}
+    if args.shards:
+        shard_cells = read_shard(args.shards, args.array_task)
+
+    tasks = {}
+    group_idx = -1
+    for (id, run_id), replicate_cells in groupby(cells(args), key=lambda c: c[:2]):
+        input_dir = Path(args.data) / id / run_id
+        output_dir = Path(args.output) / id / run_id
+        s_tree = input_dir / "s_tree.trees"
+
+        rooted = []
+        for g_type, group in groupby(replicate_cells, key=lambda c: c[2]):
+            group_idx += 1
+            n_genes_list = [
+                n_genes
+                for _, _, _, n_genes in group
+                if not args.missing
+                or cell_key(id, run_id, g_type, n_genes) in missing_cells
+            ]
+            if args.shards:
+                n_genes_list = [
+                    n_genes
+                    for n_genes in n_genes_list
+                    if cell_key(id, run_id, g_type, n_genes) in shard_cells
+                ]
+            elif group_idx % args.array_count != args.array_task:
+                continue
+            if not n_genes_list:
+                continue
+
+            input_tree_raw = input_dir / f"g_{g_type}.trees"
+            g_dir = output_dir / f"{g_type}g"
+            index_file = gene_tree_index(input_tree_raw, output_dir)
+            blocks = add_disco_tasks(
+                tasks, args, input_tree_raw, g_dir, index_file, n_genes_list
+            )
+            for n_genes in n_genes_list:
+                rooted += add_cell_tasks(
+                    tasks,
+                    args,
+                    input_tree_raw,
+                    s_tree,
+                    g_dir / f"{n_genes}",
+                    n_genes,
+                    blocks,
+                )
+
+        if rooted:
+            key = output_dir / "score"
+            deps = list(dict.fromkeys(t_r for t_r, _ in rooted))
+            trees = [r_dir / "s_rooted_est.tree" for _, r_dir in rooted]
+            metrics_file = output_dir / "metrics.tsv"
+            scores = [str(r_dir / "s_rooted_est.score") for _, r_dir in rooted]
+            scores.append(str(metrics_file))
+            # with a cache, rooted trees may change under existing scores
+            if args.cache:
+                scores = []
+            tasks[key] = Task(
+                key, deps, scores, score_trees, (s_tree, trees, metrics_file), True
+            )
+
+    if args.missing:
+        tasks = prune_tasks(tasks, {Path(args.output) / key for key in missing})
+    return tasks
+
+
+def run_tasks(tasks, workers):
+    """
+    Run tasks on a pool of workers, starting each one as soon as its deps
+    have finished. Returns the final status of every task.
+    """
+    status = {}
+    pending = dict(tasks)
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            # tasks are in dependency order, so one pass resolves whole
+            # chains of skipped or blocked tasks
+            for key, task in list(pending.items()):
+                if any(dep not in status for dep in task.deps):
+                    continue
+                del pending[key]
+
+                if task_done(task):
+                    status[key] = "skipped"
+                    continue
+
+                failed = [
+                    dep for dep in task.deps if status[dep] in ("failed", "blocked")
+                ]
+                if failed and not task.partial:
+                    print(f"Skipping {key}: {failed[0]} did not complete")
+                    status[key] = "blocked"
+                    continue
+
+                print(f"Running {key}")
+                running[pool.submit(task.func, *task.args)] = key
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                key = running.pop(fut)
+                try:
+                    fut.result()
+                    status[key] = "done"
+                except Exception as e:
+                    print(f"Failed {key}: {e}")
+                    status[key] = "failed"
+    return status
+
+
+def add_grid_arguments(parser):
+    """Options selecting the data and the grid of cells to run."""
+    parser.add_argument(
+        "--data", type=str, default="data/trees", help="Input data directory."
+    )
+    parser.add_argument(
+        "--output", type=str, default="output/trees", help="Output directory."
+    )
+    parser.add_argument("--loss-rate-indicator", type=int, nargs="+", default=[1])
+    parser.add_argument(
+        "--hILS",
+        type=lambda s: s.lower() == "true",
+        nargs="+",
+        default=[False, True],
+        help="true and/or false",
+    )
+    parser.add_argument(
+        "--dup-rate",
+        type=str,
+        nargs="+",
+        default=["1e-9", "1e-10", "5e-10", "1e-11", "1e-12", "1e-13"],
+    )
+    parser.add_argument("--num-species", type=int, nargs="+", default=[20, 50, 100])
+    parser.add_argument(
+        "--run-id", type=str, nargs="+", default=[f"{i:02d}" for i in range(1, 11)]
+    )
+    parser.add_argument(
+        "--g-type", type=str, nargs="+", default=["true", "50", "100", "500"]
+    )
+    parser.add_argument("--n-genes", type=int, nargs="+", default=[50, 100, 500, 1000])
+    parser.add_argument(
+        "--s-est-method",
+        type=str,
+        nargs="+",
+        choices=S_EST_METHODS,
+        default=S_EST_METHODS,
+    )
+    parser.add_argument(
+        "--rooting",
+        type=str,
+        nargs="+",
+        choices=ROOTING_METHODS,
+        default=["qr", "qrstar"],
+    )
+    parser.add_argument("--mult", type=int, nargs="+", default=[1, 5, 10, 50])
+    parser.add_argument(
+        "--disco-chunk",
+        type=int,
+        default=100,
+        help="Maximum number of gene trees in a block DISCO is run on.",
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run the DISCO+QR/QR-STAR and STRIDE pipelines."
+    )
+    add_grid_arguments(parser)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("SLURM_CPUS_PER_TASK", os.cpu_count())),
+        help="Number of worker processes (defaults to the SLURM allocation).",
+    )
+    parser.add_argument(
+        "--array-task",
+        type=int,
+        default=int(os.environ.get("SLURM_ARRAY_TASK_ID", 0)),
+        help="Index of this task in a SLURM job array.",
+    )
+    parser.add_argument(
+        "--array-count",
+        type=int,
+        default=int(os.environ.get("SLURM_ARRAY_TASK_COUNT", 1)),
+        help="Number of tasks in the SLURM job array.",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=None,
+        help="Shared cache directory for tool outputs (disabled by default).",
+    )
+    parser.add_argument(
+        "--shards",
+        type=str,
+        default=None,
+        help="Run the cells of shard --array-task of a schedule.py shard file.",
+    )
+    parser.add_argument(
+        "--missing",
+        type=str,
+        default=None,
+        help="Only run the stages listed by check_missing.py (.json or .csv).",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="List the tasks that would run."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    assert Path(args.data).is_dir(), f"Input directory {args.data} does not exist."
+    assert 0 <= args.array_task < args.array_count, "Invalid array task index."
+
+    tasks = build_tasks(args)
+    print(f"{len(tasks)} tasks in array task {args.array_task}/{args.array_count}")
+
+    if args.dry_run:
+        for key, task in tasks.items():
+            print(f"{'done' if task_done(task) else 'todo'}\t{key}")
+        sys.exit(0)
+
+    status = run_tasks(tasks, args.workers)
+    counts = {}
+    for s in status.values():
+        counts[s] = counts.get(s, 0) + 1
+    print(", ".join(f"{n} {s}" for s, n in sorted(counts.items())))
+    if any(s in ("failed", "blocked") for s in status.values()):
+        sys.exit(1)
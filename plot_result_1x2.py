@@ -1,13 +1,36 @@
 import argparse
+import os
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-import pandas as pd
+
+from results import ResultIndex, map_shared, read_results, select, write_shared
+
+S_TREE_NAMES = {"trues": "True", "astrid": "ASTRID", "astral": "ASTRAL"}
+NUM_SPECIES_NAMES = {20: 21, 50: 51, 100: 101, 1000: 1001}
+DISCO_METHODS = ["DISCO+QR", "DISCO+QR-STAR"]
+# the rows of one species tree, whose QR and QR-STAR runs pipeline.py roots
+# in one sweep
+SWEEP_KEY = [
+    "num_species",
+    "unrooted_s_tree",
+    "n_genes",
+    "dup_rate",
+    "loss_rate_indicator",
+    "hILS",
+    "g_type",
+    "run_id",
+]
 
 
 def plot_comparison(
-    df,
+    source,
     filters,
     hue,
     x,
@@ -17,19 +40,13 @@ def plot_comparison(
     order=None,
     ylim=(0.0, 0.65),
 ):
-    df_filtered = df.copy()
-    for key, value in filters.items():
-        if isinstance(value, list):
-            # Handle None explicitly: keep rows where key is in value or (None in value and pd.isna)
-            mask = df_filtered[key].isin([v for v in value if v is not None])
-            if None in value:
-                mask |= df_filtered[key].isna()
-            df_filtered = df_filtered[mask]
-        else:
-            if value is None:
-                df_filtered = df_filtered[df_filtered[key].isna()]
-            else:
-                df_filtered = df_filtered[df_filtered[key] == value]
+    # source is a ResultIndex or DataFrame of the results, or the path of a
+    # results store to read only the columns and rows of this figure from
+    columns = set(filters) | {"hILS", "unrooted_s_tree", "num_species", x, hue, y}
+    df_filtered = select(source, filters, columns=columns)
+
+    df_filtered["unrooted_s_tree"] = df_filtered["unrooted_s_tree"].map(S_TREE_NAMES)
+    df_filtered["num_species"] = df_filtered["num_species"].map(NUM_SPECIES_NAMES)
 
     df_filtered["ILS Level"] = df_filtered["hILS"].map(
         {False: "Low ILS", True: "High ILS"}
@@ -65,283 +82,344 @@ def plot_comparison(
     return fig
 
 
-def parse_args():
-    parser = argparse.ArgumentParser(
-        description="Plot focused results from multiple runs."
-    )
-    parser.add_argument("--input", type=str, required=True, help="Input CSV file path.")
-    parser.add_argument(
-        "--output", type=str, required=True, help="Output directory for plots."
+def plot_scaling(
+    source,
+    filters,
+    x,
+    xlabel,
+    y="wall_time",
+    ylabel="Wall Time (s)",
+    methods=DISCO_METHODS + ["STRIDE"],
+):
+    """
+    Runtime or memory (y is wall_time or max_rss) of each method against x
+    on log-log axes, with the growth exponent of a power law fitted to the
+    means in the legend. The cost of DISCO+QR and DISCO+QR-STAR includes
+    DISCO and the unrooted species tree estimation: wall times are summed
+    and peak memory is the largest of the three. Copying the true species
+    tree (trues) costs nothing. QR and QR-STAR runs of a pipeline.py sweep,
+    which share their quintet counts, have no cost of their own: the cost
+    of the whole sweep is shown once for each method, at the largest mult
+    of the sweep, and "(sweep)" is added to the label of the method.
+    """
+    columns = set(filters) | set(SWEEP_KEY) | {"method", "sampling_mult", x, y}
+    columns |= {f"disco_{y}", f"s_tree_{y}", f"sweep_{y}"}
+    # the largest mult of a sweep is looked up among all the mults it ran
+    sweep_filters = {k: v for k, v in filters.items() if k != "sampling_mult"}
+    df = select(source, {**sweep_filters, "method": methods}, columns=columns)
+
+    in_sweep = df[y].isna() & df[f"sweep_{y}"].notna()
+    largest = (
+        df["sampling_mult"]
+        .where(in_sweep)
+        .groupby([df[col] for col in SWEEP_KEY + ["method"]], observed=True)
+        .transform("max")
     )
-    return parser.parse_args()
+    at_largest = in_sweep & (df["sampling_mult"] == largest)
+    stage_cost = df[y].mask(in_sweep, df[f"sweep_{y}"].where(at_largest))
 
+    disco = df["method"].isin(DISCO_METHODS)
+    disco_cost = df[f"disco_{y}"].where(disco, 0)
+    s_tree_cost = df[f"s_tree_{y}"].where(disco, 0)
+    s_tree_cost = s_tree_cost.where(df["unrooted_s_tree"] != "trues", 0)
+    if y == "max_rss":
+        cost = np.fmax(np.fmax(stage_cost, disco_cost), s_tree_cost) / 1024
+        cost = cost.where(stage_cost.notna())
+    else:
+        cost = stage_cost + disco_cost + s_tree_cost
+    df = df.assign(cost=cost.astype(float), in_sweep=at_largest)
+    if "sampling_mult" in filters:
+        df = select(df, {"sampling_mult": filters["sampling_mult"]})
+    if x == "num_species":
+        df["num_species"] = df["num_species"].map(NUM_SPECIES_NAMES)
+    df[x] = df[x].astype(float)
+    df = df.dropna(subset=[x, "cost"])
+    df = df[(df[x] > 0) & (df["cost"] > 0)]
 
-args = parse_args()
-input_file = Path(args.input)
-output_dir = Path(args.output)
-output_dir.mkdir(parents=True, exist_ok=True)
-
-df = pd.read_csv(input_file)
-
-df["unrooted_s_tree"] = df["unrooted_s_tree"].map(
-    {"trues": "True", "astrid": "ASTRID", "astral": "ASTRAL"}
-)
-df["num_species"] = df["num_species"].map({20: 21, 50: 51, 100: 101})
-
-# Experiment 1: Multiplicity of quintet sampling
-fig = plot_comparison(
-    df,
-    filters={
-        "num_species": 21,
-        "n_genes": 1000,
-        "g_type": "true",
-        "dup_rate": 1e-12,
-        "loss_rate_indicator": 1,
-        "unrooted_s_tree": "True",
-        "sampling_mult": [1, 5, 10, 50],
-    },
-    hue="method",
-    x="sampling_mult",
-    xlabel="Quintet Sampling Multiplicity",
-)
-fig.savefig(output_dir / "exp_multiplicity_true.pdf", bbox_inches="tight")
-plt.close(fig)
-
-fig = plot_comparison(
-    df,
-    filters={
-        "num_species": 21,
-        "n_genes": 1000,
-        "g_type": "true",
-        "dup_rate": 1e-12,
-        "loss_rate_indicator": 1,
-        "unrooted_s_tree": "ASTRAL",
-        "sampling_mult": [1, 5, 10, 50],
-    },
-    hue="method",
-    x="sampling_mult",
-    xlabel="Quintet Sampling Multiplicity",
-)
-fig.savefig(output_dir / "exp_multiplicity_astral.pdf", bbox_inches="tight")
-plt.close(fig)
-
-# Experiment 2: Method for unrooted species tree estimation
-fig = plot_comparison(
-    df,
-    filters={
-        "num_species": 21,
-        "n_genes": 1000,
-        "g_type": "true",
-        "dup_rate": 1e-12,
-        "loss_rate_indicator": 1,
-        "sampling_mult": 50,
-        "unrooted_s_tree": ["True", "ASTRID", "ASTRAL"],
-    },
-    hue="method",
-    x="unrooted_s_tree",
-    xlabel="Method for Unrooted Species Tree Estimation",
-    order=["True", "ASTRAL", "ASTRID"],
-)
-fig.savefig(output_dir / "exp_unrooted-species-tree.pdf", bbox_inches="tight")
-plt.close(fig)
-
-# With STRIDE
-fig = plot_comparison(
-    df,
-    filters={
-        "num_species": 21,
-        "n_genes": 1000,
-        "g_type": "true",
-        "dup_rate": 1e-12,
-        "loss_rate_indicator": 1,
-        "sampling_mult": [None, 50],
-        "sampling_method": [None, "le"],
-        "unrooted_s_tree": ["True", "ASTRID", "ASTRAL"],
-    },
-    hue="method",
-    x="unrooted_s_tree",
-    xlabel="Method for Unrooted Species Tree Estimation",
-    order=["True", "ASTRAL", "ASTRID"],
-)
-fig.savefig(output_dir / "exp_unrooted-species-tree_wSTRIDE.pdf", bbox_inches="tight")
-
-for unrooted_s_tree in df["unrooted_s_tree"].unique():
-    output_dir.mkdir(parents=True, exist_ok=True)
-    (output_dir / unrooted_s_tree).mkdir(parents=True, exist_ok=True)
-
-    # Experiment 3: Varying the duplication rate
-    fig = plot_comparison(
-        df,
-        filters={
-            "num_species": 21,
-            "n_genes": 1000,
-            "g_type": "true",
-            "dup_rate": [1e-9, 5e-10, 1e-10, 1e-11, 1e-12, 1e-13],
-            "loss_rate_indicator": 1,
-            "sampling_mult": 50,
-            "unrooted_s_tree": unrooted_s_tree,
-        },
-        hue="method",
-        x="dup_rate",
-        xlabel="Duplication Rate",
-    )
-    fig.savefig(
-        output_dir / unrooted_s_tree / "exp_duplication-rate.pdf", bbox_inches="tight"
-    )
-    plt.close(fig)
+    fig, axes = plt.subplots(1, 2, figsize=(10, 4), dpi=300, tight_layout=True)
+    palette = dict(zip(methods, sns.color_palette("Dark2", len(methods))))
 
-    # With STRIDE
-    fig = plot_comparison(
-        df,
-        filters={
-            "num_species": 21,
-            "n_genes": 1000,
-            "g_type": "true",
-            "dup_rate": [1e-9, 5e-10, 1e-10, 1e-11, 1e-12, 1e-13],
-            "loss_rate_indicator": 1,
-            "sampling_mult": [None, 50],
-            "sampling_method": [None, "le"],
-            "unrooted_s_tree": unrooted_s_tree,
-        },
-        hue="method",
-        x="dup_rate",
-        xlabel="Duplication Rate",
-    )
-    fig.savefig(
-        output_dir / unrooted_s_tree / "exp_duplication-rate_wSTRIDE.pdf",
-        bbox_inches="tight",
-    )
-    plt.close(fig)
+    for i, hILS in enumerate([False, True]):
+        ax = axes[i]
+        for method in methods:
+            df_method = df[(df["hILS"] == hILS) & (df["method"] == method)]
+            if df_method.empty:
+                continue
+            means = df_method.groupby(x)["cost"].mean()
+            label = f"{method} (sweep)" if df_method["in_sweep"].any() else method
+            if len(means) > 1:
+                slope = np.polyfit(np.log(means.index), np.log(means.values), 1)[0]
+                label = f"{label} (~x^{slope:.2f})"
+            ax.scatter(
+                df_method[x], df_method["cost"], s=6, alpha=0.3, color=palette[method]
+            )
+            ax.plot(
+                means.index,
+                means.values,
+                marker="o",
+                color=palette[method],
+                label=label,
+            )
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.grid(True, which="both", linestyle="--", alpha=0.5)
+        ax.set_title("High ILS" if hILS else "Low ILS")
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel if i == 0 else "")
+        if ax.get_legend_handles_labels()[0]:
+            ax.legend(fontsize="small")
+
+    return fig
 
-    # Experiment 4: Varying the GTEE
-    fig = plot_comparison(
-        df,
-        filters={
-            "num_species": 21,
-            "n_genes": 1000,
-            "g_type": ["true", "50", "100", "500"],
-            "dup_rate": 1e-12,
-            "loss_rate_indicator": 1,
-            "sampling_mult": 50,
-            "unrooted_s_tree": unrooted_s_tree,
-        },
-        hue="method",
-        x="g_type",
-        xlabel="Sequence Length (bp)",
-    )
-    fig.savefig(
-        output_dir / unrooted_s_tree / "exp_sequence-length.pdf", bbox_inches="tight"
-    )
-    plt.close(fig)
 
-    # With STRIDE
-    fig = plot_comparison(
-        df,
-        filters={
-            "num_species": 21,
-            "n_genes": 1000,
-            "g_type": ["true", "50", "100", "500"],
-            "dup_rate": 1e-12,
-            "loss_rate_indicator": 1,
-            "sampling_mult": [None, 50],
-            "sampling_method": [None, "le"],
-            "unrooted_s_tree": unrooted_s_tree,
-        },
-        hue="method",
-        x="g_type",
-        xlabel="Sequence Length (bp)",
+# A figure: the output path (relative to --output), the plot function that
+# draws it (a key of PLOTS), the rows it shows and the remaining keyword
+# arguments of the plot function
+Figure = namedtuple("Figure", ["output", "plot", "filters", "x", "xlabel", "options"])
+
+PLOTS = {"comparison": plot_comparison, "scaling": plot_scaling}
+
+DEFAULT_FILTERS = {
+    "num_species": 20,
+    "n_genes": 1000,
+    "g_type": "true",
+    "dup_rate": 1e-12,
+    "loss_rate_indicator": 1,
+}
+# QR and QR-STAR at the largest multiplicity, plus STRIDE which has none
+WITH_STRIDE = {"sampling_mult": [None, 50], "sampling_method": [None, "le"]}
+
+# Experiments 3 to 6: the output name, the varied parameter, its axis label
+# and its values
+VARIED = [
+    (
+        "duplication-rate",
+        "dup_rate",
+        "Duplication Rate",
+        [1e-9, 5e-10, 1e-10, 1e-11, 1e-12, 1e-13],
+    ),
+    ("sequence-length", "g_type", "Sequence Length (bp)", ["true", "50", "100", "500"]),
+    ("number-of-gene-trees", "n_genes", "Number of Gene Trees", [50, 100, 500, 1000]),
+    ("number-of-species", "num_species", "Number of Species", [20, 50, 100]),
+]
+
+BY_METHOD = {"hue": "method"}
+S_TREE_ORDER = {"order": ["True", "ASTRAL", "ASTRID"]}
+
+
+def figure_specs(unrooted_s_trees, performance=False):
+    """Every figure to render, given the unrooted species trees in the results."""
+    specs = []
+
+    # Experiment 1: Multiplicity of quintet sampling
+    for unrooted_s_tree, name in [("trues", "true"), ("astral", "astral")]:
+        specs.append(
+            Figure(
+                f"exp_multiplicity_{name}.pdf",
+                "comparison",
+                {
+                    **DEFAULT_FILTERS,
+                    "unrooted_s_tree": unrooted_s_tree,
+                    "sampling_mult": [1, 5, 10, 50],
+                },
+                "sampling_mult",
+                "Quintet Sampling Multiplicity",
+                BY_METHOD,
+            )
+        )
+
+    # Experiment 2: Method for unrooted species tree estimation
+    all_s_trees = {"unrooted_s_tree": ["trues", "astrid", "astral"]}
+    specs.append(
+        Figure(
+            "exp_unrooted-species-tree.pdf",
+            "comparison",
+            {**DEFAULT_FILTERS, "sampling_mult": 50, **all_s_trees},
+            "unrooted_s_tree",
+            "Method for Unrooted Species Tree Estimation",
+            {**BY_METHOD, **S_TREE_ORDER},
+        )
     )
-    fig.savefig(
-        output_dir / unrooted_s_tree / "exp_sequence-length_wSTRIDE.pdf",
-        bbox_inches="tight",
+    specs.append(
+        Figure(
+            "exp_unrooted-species-tree_wSTRIDE.pdf",
+            "comparison",
+            {**DEFAULT_FILTERS, **WITH_STRIDE, **all_s_trees},
+            "unrooted_s_tree",
+            "Method for Unrooted Species Tree Estimation",
+            {**BY_METHOD, **S_TREE_ORDER},
+        )
     )
-    plt.close(fig)
 
-    # Experiment 5: Varying the number of gene trees
-    fig = plot_comparison(
-        df,
-        filters={
-            "num_species": 21,
-            "n_genes": [50, 100, 500, 1000],
-            "g_type": "true",
-            "dup_rate": 1e-12,
-            "loss_rate_indicator": 1,
-            "sampling_mult": 50,
-            "unrooted_s_tree": unrooted_s_tree,
-        },
-        hue="method",
-        x="n_genes",
-        xlabel="Number of Gene Trees",
-    )
-    fig.savefig(
-        output_dir / unrooted_s_tree / "exp_number-of-gene-trees.pdf",
-        bbox_inches="tight",
+    # Experiments 3 to 6, for each unrooted species tree, without and with STRIDE
+    for unrooted_s_tree in unrooted_s_trees:
+        s_tree_dir = S_TREE_NAMES[unrooted_s_tree]
+        for name, x, xlabel, values in VARIED:
+            filters = {**DEFAULT_FILTERS, x: values, "unrooted_s_tree": unrooted_s_tree}
+            specs.append(
+                Figure(
+                    f"{s_tree_dir}/exp_{name}.pdf",
+                    "comparison",
+                    {**filters, "sampling_mult": 50},
+                    x,
+                    xlabel,
+                    BY_METHOD,
+                )
+            )
+            specs.append(
+                Figure(
+                    f"{s_tree_dir}/exp_{name}_wSTRIDE.pdf",
+                    "comparison",
+                    {**filters, **WITH_STRIDE},
+                    x,
+                    xlabel,
+                    BY_METHOD,
+                )
+            )
+
+    if not performance:
+        return specs
+
+    perf_filters = {**DEFAULT_FILTERS, **WITH_STRIDE, "unrooted_s_tree": "trues"}
+    for y, ylabel in [("wall_time", "Wall Time (s)"), ("max_rss", "Peak RSS (MB)")]:
+        name = y.replace("_", "-")
+        options = {"y": y, "ylabel": ylabel}
+
+        # Scaling with the number of species
+        specs.append(
+            Figure(
+                f"performance/perf_{name}_number-of-species.pdf",
+                "scaling",
+                {**perf_filters, "num_species": [20, 50, 100, 1000]},
+                "num_species",
+                "Number of Species",
+                options,
+            )
+        )
+
+        # Scaling with the number of gene trees
+        specs.append(
+            Figure(
+                f"performance/perf_{name}_number-of-gene-trees.pdf",
+                "scaling",
+                {**perf_filters, "n_genes": [50, 100, 500, 1000]},
+                "n_genes",
+                "Number of Gene Trees",
+                options,
+            )
+        )
+
+        # Scaling with the quintet sampling multiplicity
+        specs.append(
+            Figure(
+                f"performance/perf_{name}_multiplicity.pdf",
+                "scaling",
+                {
+                    **perf_filters,
+                    "sampling_mult": [1, 5, 10, 50],
+                    "sampling_method": "le",
+                },
+                "sampling_mult",
+                "Quintet Sampling Multiplicity",
+                {**options, "methods": DISCO_METHODS},
+            )
+        )
+
+    return specs
+
+
+# ResultIndex of the results each worker renders from, set by use_results
+_results = None
+
+
+def use_results(source):
+    """
+    Render from source: a DataFrame, or the path of a file written by
+    write_shared which is memory-mapped instead of copied into the worker.
+    The rows are grouped once, and each figure then looks up its groups.
+    """
+    global _results
+    if not isinstance(source, pd.DataFrame):
+        source = map_shared(source)
+    _results = ResultIndex(source)
+
+
+def render(spec, output_dir):
+    """Draw the figure of spec and save it under output_dir."""
+    output = Path(output_dir) / spec.output
+    output.parent.mkdir(parents=True, exist_ok=True)
+    fig = PLOTS[spec.plot](
+        _results,
+        filters=spec.filters,
+        x=spec.x,
+        xlabel=spec.xlabel,
+        **spec.options,
     )
+    fig.savefig(output, bbox_inches="tight")
     plt.close(fig)
+    return output
+
+
+def render_all(results, specs, output_dir, workers):
+    """
+    Render specs on a pool of workers that share the parsed results through
+    a memory-mapped columnar file in output_dir.
+    """
+    if workers <= 1:
+        use_results(results)
+        for spec in specs:
+            render(spec, output_dir)
+        return
 
-    # With STRIDE
-    fig = plot_comparison(
-        df,
-        filters={
-            "num_species": 21,
-            "n_genes": [50, 100, 500, 1000],
-            "g_type": "true",
-            "dup_rate": 1e-12,
-            "loss_rate_indicator": 1,
-            "sampling_mult": [None, 50],
-            "sampling_method": [None, "le"],
-            "unrooted_s_tree": unrooted_s_tree,
-        },
-        hue="method",
-        x="n_genes",
-        xlabel="Number of Gene Trees",
+    fd, shared = tempfile.mkstemp(suffix=".arrow", dir=output_dir)
+    os.close(fd)
+    try:
+        write_shared(results, shared)
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=use_results, initargs=(shared,)
+        ) as pool:
+            futures = [pool.submit(render, spec, output_dir) for spec in specs]
+            for fut in as_completed(futures):
+                fut.result()
+    finally:
+        os.unlink(shared)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Plot focused results from multiple runs."
     )
-    fig.savefig(
-        output_dir / unrooted_s_tree / "exp_number-of-gene-trees_wSTRIDE.pdf",
-        bbox_inches="tight",
+    parser.add_argument(
+        "--input",
+        type=str,
+        required=True,
+        help="Input CSV file or .parquet results store path.",
     )
-    plt.close(fig)
-
-    # Experiment 6: Varying the number of species
-    fig = plot_comparison(
-        df,
-        filters={
-            "num_species": [21, 51, 101],
-            "n_genes": 1000,
-            "g_type": "true",
-            "dup_rate": 1e-12,
-            "loss_rate_indicator": 1,
-            "sampling_mult": 50,
-            "unrooted_s_tree": unrooted_s_tree,
-        },
-        hue="method",
-        x="num_species",
-        xlabel="Number of Species",
+    parser.add_argument(
+        "--output", type=str, required=True, help="Output directory for plots."
     )
-    fig.savefig(
-        output_dir / unrooted_s_tree / "exp_number-of-species.pdf", bbox_inches="tight"
+    parser.add_argument(
+        "--performance",
+        action="store_true",
+        help="Also plot runtime and memory scaling figures.",
     )
-    plt.close(fig)
-
-    # With STRIDE
-    fig = plot_comparison(
-        df,
-        filters={
-            "num_species": [21, 51, 101],
-            "n_genes": 1000,
-            "g_type": "true",
-            "dup_rate": 1e-12,
-            "loss_rate_indicator": 1,
-            "sampling_mult": [None, 50],
-            "sampling_method": [None, "le"],
-            "unrooted_s_tree": unrooted_s_tree,
-        },
-        hue="method",
-        x="num_species",
-        xlabel="Number of Species",
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("SLURM_CPUS_PER_TASK", os.cpu_count())),
+        help="Number of processes rendering figures.",
     )
-    fig.savefig(
-        output_dir / unrooted_s_tree / "exp_number-of-species_wSTRIDE.pdf",
-        bbox_inches="tight",
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    output_dir = Path(args.output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # parse the results once; every figure is then a selection of these rows
+    results = read_results(args.input)
+    specs = figure_specs(
+        results["unrooted_s_tree"].dropna().unique(), performance=args.performance
     )
-    plt.close(fig)
+    render_all(results, specs, output_dir, args.workers)
@@ -3,10 +3,11 @@ from pathlib import Path
 
 import seaborn as sns
 import matplotlib.pyplot as plt
-import pandas as pd
 
+from results import ResultIndex, read_results, select
 
-def plot_experiment_2x2(df, x_axis, x_axis_name, ylim=(0.0, 0.65)):
+
+def plot_experiment_2x2(source, filters, x_axis, x_axis_name, ylim=(0.0, 0.65)):
     methods = ["DISCO+QR", "DISCO+QR-STAR"]
     hILS_values = [False, True]
     titles = [
@@ -20,7 +21,7 @@ def plot_experiment_2x2(df, x_axis, x_axis_name, ylim=(0.0, 0.65)):
 
     for i, hILS in enumerate(hILS_values):
         for j, method in enumerate(methods):
-            df_filtered = df[(df["hILS"] == hILS) & (df["method"] == method)]
+            df_filtered = select(source, {**filters, "hILS": hILS, "method": method})
             sns.boxplot(
                 x=x_axis,
                 y=y_axis,
@@ -55,7 +56,12 @@ def plot_experiment_2x2(df, x_axis, x_axis_name, ylim=(0.0, 0.65)):
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Plot results from multiple runs.")
-    parser.add_argument("--input", type=str, required=True, help="Input CSV file path.")
+    parser.add_argument(
+        "--input",
+        type=str,
+        required=True,
+        help="Input CSV file or .parquet results store path.",
+    )
     parser.add_argument(
         "--output", type=str, required=True, help="Output directory for plots."
     )
@@ -67,25 +73,28 @@ input_file = Path(args.input)
 output_dir_raw = Path(args.output)
 
 # num_species,unrooted_s_tree,n_genes,dup_rate,loss_rate_indicator,hILS,g_type,run_id,method,sampling_method,sampling_mult,ncd
-df = pd.read_csv(input_file)
+df = read_results(input_file)
+# group the rows once; each panel then looks up its groups
+source = ResultIndex(df)
 
 output_dir_raw.mkdir(parents=True, exist_ok=True)
 
-for species_tree in df["unrooted_s_tree"].unique():
+for species_tree in df["unrooted_s_tree"].dropna().unique():
     output_dir = output_dir_raw / species_tree
     output_dir.mkdir(parents=True, exist_ok=True)
 
     # Experiment 1: Varying the duplication rate
     fig = plot_experiment_2x2(
-        df[
-            (df["num_species"] == 20)
-            & (df["unrooted_s_tree"] == species_tree)
-            & (df["g_type"].isin(["true"]))
-            & (df["n_genes"] == 1000)
-            & (df["dup_rate"].isin([1e-9, 5e-10, 1e-10, 1e-11, 1e-12, 1e-13]))
-            & (df["loss_rate_indicator"] == 1)
-            & (df["sampling_mult"].isin([1, 5, 10, 50]))
-        ],
+        source,
+        {
+            "num_species": 20,
+            "unrooted_s_tree": species_tree,
+            "g_type": ["true"],
+            "n_genes": 1000,
+            "dup_rate": [1e-9, 5e-10, 1e-10, 1e-11, 1e-12, 1e-13],
+            "loss_rate_indicator": 1,
+            "sampling_mult": [1, 5, 10, 50],
+        },
         x_axis="dup_rate",
         x_axis_name="Duplication Rate",
     )
@@ -93,15 +102,16 @@ for species_tree in df["unrooted_s_tree"].unique():
 
     # Experiment 2: Varying GTEE
     fig = plot_experiment_2x2(
-        df[
-            (df["num_species"] == 20)
-            & (df["unrooted_s_tree"] == species_tree)
-            & (df["g_type"].isin(["true", "50", "100", "500"]))
-            & (df["n_genes"] == 100)
-            & (df["dup_rate"] == 1e-12)
-            & (df["loss_rate_indicator"] == 1)
-            & (df["sampling_mult"].isin([1, 5, 10, 50]))
-        ],
+        source,
+        {
+            "num_species": 20,
+            "unrooted_s_tree": species_tree,
+            "g_type": ["true", "50", "100", "500"],
+            "n_genes": 100,
+            "dup_rate": 1e-12,
+            "loss_rate_indicator": 1,
+            "sampling_mult": [1, 5, 10, 50],
+        },
         x_axis="g_type",
         x_axis_name="Sequence Length (bp)",
     )
@@ -109,15 +119,16 @@ for species_tree in df["unrooted_s_tree"].unique():
 
     # Experiment 3: Varying the number of gene trees
     fig = plot_experiment_2x2(
-        df[
-            (df["num_species"] == 20)
-            & (df["unrooted_s_tree"] == species_tree)
-            & (df["g_type"].isin(["true"]))
-            & (df["n_genes"].isin([50, 100, 500, 1000]))
-            & (df["dup_rate"] == 1e-12)
-            & (df["loss_rate_indicator"] == 1)
-            & (df["sampling_mult"].isin([1, 5, 10, 50]))
-        ],
+        source,
+        {
+            "num_species": 20,
+            "unrooted_s_tree": species_tree,
+            "g_type": ["true"],
+            "n_genes": [50, 100, 500, 1000],
+            "dup_rate": 1e-12,
+            "loss_rate_indicator": 1,
+            "sampling_mult": [1, 5, 10, 50],
+        },
         x_axis="n_genes",
         x_axis_name="Number of Gene Trees",
     )
@@ -125,15 +136,16 @@ for species_tree in df["unrooted_s_tree"].unique():
 
     # Experiment 4: Varying the number of species
     fig = plot_experiment_2x2(
-        df[
-            (df["num_species"].isin([20, 50, 100]))
-            & (df["unrooted_s_tree"] == species_tree)
-            & (df["g_type"].isin(["true"]))
-            & (df["n_genes"] == 100)
-            & (df["dup_rate"] == 1e-12)
-            & (df["loss_rate_indicator"] == 1)
-            & (df["sampling_mult"].isin([1, 5, 10, 50]))
-        ],
+        source,
+        {
+            "num_species": [20, 50, 100],
+            "unrooted_s_tree": species_tree,
+            "g_type": ["true"],
+            "n_genes": 100,
+            "dup_rate": 1e-12,
+            "loss_rate_indicator": 1,
+            "sampling_mult": [1, 5, 10, 50],
+        },
         x_axis="num_species",
         x_axis_name="Number of Species",
     )
@@ -141,15 +153,16 @@ for species_tree in df["unrooted_s_tree"].unique():
 
 # Compare between ASTRID and ASTRAL
 fig = plot_experiment_2x2(
-    df[
-        (df["num_species"] == 20)
-        & (df["unrooted_s_tree"].isin(["trues", "astrid", "astral"]))
-        & (df["g_type"].isin(["true"]))
-        & (df["n_genes"] == 1000)
-        & (df["dup_rate"] == 1e-12)
-        & (df["loss_rate_indicator"] == 1)
-        & (df["sampling_mult"].isin([1, 5, 10, 50]))
-    ],
+    source,
+    {
+        "num_species": 20,
+        "unrooted_s_tree": ["trues", "astrid", "astral"],
+        "g_type": ["true"],
+        "n_genes": 1000,
+        "dup_rate": 1e-12,
+        "loss_rate_indicator": 1,
+        "sampling_mult": [1, 5, 10, 50],
+    },
     x_axis="unrooted_s_tree",
     x_axis_name="Unrooted Species Tree Estimation Method",
     ylim=(0.0, 0.65),
@@ -0,0 +1,239 @@
+"""
+Run Quintet-Rooting with its gene-tree quintet tallies shared and kept on disk.
+
+QR and QR-STAR at the same sampling multiplicity sample the same quintets
+of the same unrooted species tree (the seed is fixed), and most of their
+time goes into counting, for every sampled quintet, the gene trees
+displaying each of its 15 unrooted topologies. quintet_rooting.py gets
+these counts from table_five.TreeSet; this wrapper runs it in-process with
+TreeSet replaced by one answering from a table of the counts already
+computed, in quintets.npz next to the species tree. pipeline.py runs all
+the QR and QR-STAR rootings of a species tree as one Sweep in one process,
+so the quintets are counted once, by the largest mult, and the other runs
+are passes over the table. The time of such a run is not what it would
+take on its own, so its report names the report of the whole sweep, in
+quintets/run.err next to the species tree, which agg_result.py and
+schedule.py use instead.
+
+    python quintets.py Quintet-Rooting/quintet_rooting.py -t s.tree -g g.trees ...
+"""
+
+import os
+import resource
+import runpy
+import sys
+import time
+import traceback
+from pathlib import Path
+
+import numpy as np
+import table_five
+
+import cache
+
+N_TOPOLOGIES = 15
+
+# the TreeSet of table_five, before run_quintet_rooting replaces it
+TreeSet = table_five.TreeSet
+
+
+class QuintetTable(object):
+    """
+    Counts of the 15 unrooted topologies of quintets of taxa across the gene
+    trees in newick_path, computed by table_five.TreeSet on first use and
+    read from / saved to table_file, which is ignored if it was built from
+    other gene trees.
+    """
+
+    def __init__(self, newick_path, table_file):
+        self.newick_path = newick_path
+        self.table_file = Path(table_file)
+        self.digest = cache.digest(newick_path)
+        self.counts = {}
+        self.added = 0
+        self._tree_set = None
+        try:
+            with np.load(self.table_file) as data:
+                if str(data["digest"]) == self.digest:
+                    self.counts = dict(
+                        zip(map(tuple, data["taxa"].tolist()), data["counts"].tolist())
+                    )
+        except (OSError, KeyError, ValueError):
+            pass
+
+    def tally_single_quintet(self, five_taxa):
+        five_taxa = tuple(five_taxa)
+        counts = self.counts.get(five_taxa)
+        if counts is None:
+            if self._tree_set is None:
+                self._tree_set = TreeSet(self.newick_path)
+            counts = self._tree_set.tally_single_quintet(five_taxa)
+            self.counts[five_taxa] = counts
+            self.added += 1
+        return list(counts)
+
+    def save(self):
+        """Write the table if new quintets were counted."""
+        if not self.added:
+            return
+        self.table_file.parent.mkdir(parents=True, exist_ok=True)
+        taxa = np.array(list(self.counts), dtype=str).reshape(-1, 5)
+        counts = np.array(list(self.counts.values()), dtype=np.int64)
+        tmp = self.table_file.with_name(f"{self.table_file.stem}.tmp{os.getpid()}.npz")
+        np.savez(
+            tmp, digest=self.digest, taxa=taxa, counts=counts.reshape(-1, N_TOPOLOGIES)
+        )
+        os.replace(tmp, self.table_file)
+        self.added = 0
+
+
+def table_path(qr_argv):
+    """quintets.npz next to the species tree of a quintet_rooting.py run."""
+    species_tree = Path(qr_argv[qr_argv.index("-t") + 1])
+    return species_tree.parent / "quintets.npz"
+
+
+# line of the report of a run in a sweep naming the report of the sweep,
+# and line of the latter listing its runs (see agg_result.sweep_report)
+SWEEP_FIELD = "Quintet sweep report"
+RUNS_FIELD = "Quintet sweep runs"
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of this process (Linux), so that the
+    peak of a run does not include those of the runs before it.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def time_report(wall, user, system, max_rss):
+    """
+    The wall, user and system time and maximum resident set size of an
+    in-process run, in the format of /usr/bin/time -v that
+    agg_result.parse_time_log reads.
+    """
+    minutes, seconds = divmod(wall, 60)
+    return (
+        f"\tElapsed (wall clock) time (h:mm:ss or m:ss): {int(minutes)}:{seconds:05.2f}\n"
+        f"\tUser time (seconds): {user:.2f}\n"
+        f"\tSystem time (seconds): {system:.2f}\n"
+        f"\tMaximum resident set size (kbytes): {max_rss}\n"
+    )
+
+
+class Sweep(object):
+    """
+    Runs of quintet_rooting.py in this process, sharing one QuintetTable
+    (and so one TreeSet) per gene tree file and table file. QR and QR-STAR
+    of every mult of a species tree run as one sweep, largest mult first,
+    and count every quintet they sample once: with the same seed, the samples
+    of the smaller mults are mostly (if nested, entirely) found in the
+    table. The cost of every run is kept in costs, as (wall, user, system,
+    max_rss), for the report of the sweep.
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.costs = []
+
+    def tree_set(self, newick_path, table_file):
+        key = (str(newick_path), str(table_file))
+        if key not in self.tables:
+            self.tables[key] = QuintetTable(newick_path, table_file)
+        return self.tables[key]
+
+    def run_script(self, script, qr_argv):
+        """Run script with qr_argv in this process. Returns the exit status."""
+        script = Path(script)
+        if str(script.parent) not in sys.path:
+            sys.path.insert(0, str(script.parent))
+        sys.argv = [str(script)] + qr_argv
+        table_five.TreeSet = lambda newick_path: self.tree_set(
+            newick_path, table_path(qr_argv)
+        )
+        try:
+            runpy.run_path(str(script), run_name="__main__")
+        except SystemExit as e:
+            if isinstance(e.code, int) or e.code is None:
+                return e.code or 0
+            print(e.code, file=sys.stderr)
+            return 1
+        finally:
+            table_five.TreeSet = TreeSet
+        return 0
+
+    def run(self, argv, out, err, report_fp=None):
+        """
+        Runner for pipeline.run_tool: run argv ([python, quintets.py,
+        quintet_rooting.py, ...]) in this process with its output in the
+        files out and err, followed by its time report, which names
+        report_fp (relative to the stage directory) as that of the sweep.
+        """
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved = os.dup(1), os.dup(2)
+        os.dup2(out.fileno(), 1)
+        os.dup2(err.fileno(), 2)
+        reset_peak_rss()
+        start, before = time.perf_counter(), resource.getrusage(resource.RUSAGE_SELF)
+        try:
+            status = self.run_script(argv[2], argv[3:])
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+        wall = time.perf_counter() - start
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        cost = (
+            wall,
+            after.ru_utime - before.ru_utime,
+            after.ru_stime - before.ru_stime,
+            after.ru_maxrss,
+        )
+        self.costs.append(cost)
+        err.write(f"\tExit status: {status}\n")
+        err.write(time_report(*cost))
+        if report_fp is not None:
+            err.write(f"\t{SWEEP_FIELD}: {report_fp}\n")
+        err.flush()
+        return status
+
+    def write_report(self, path, runs):
+        """
+        Write the time report of the sweep so far to path: its total wall,
+        user and system time, its peak memory and its runs (their stage
+        directories relative to that of path).
+        """
+        wall, user, system, max_rss = zip(*self.costs)
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.tmp{os.getpid()}")
+        tmp.write_text(
+            time_report(sum(wall), sum(user), sum(system), max(max_rss))
+            + f"\t{RUNS_FIELD}: {' '.join(runs)}\n"
+        )
+        os.replace(tmp, path)
+
+    def save(self):
+        for table in self.tables.values():
+            table.save()
+
+
+if __name__ == "__main__":
+    assert len(sys.argv) > 1, "usage: quintets.py quintet_rooting.py [options]"
+    sweep = Sweep()
+    status = sweep.run_script(sys.argv[1], sys.argv[2:])
+    if status == 0:
+        sweep.save()
+    sys.exit(status)
@@ -0,0 +1,312 @@
+"""
+Reading and writing the aggregated results table.
+
+Results are kept either as a CSV file or as a columnar store: a Parquet
+dataset partitioned by num_species and hILS, with categorical method,
+unrooted_s_tree, g_type and sampling_method columns and a numeric
+dup_rate. Reads from the store only load the requested columns and the
+row groups and partitions that can match the filters.
+"""
+
+import os
+from itertools import product
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = [
+    "num_species",
+    "unrooted_s_tree",
+    "n_genes",
+    "dup_rate",
+    "loss_rate_indicator",
+    "hILS",
+    "g_type",
+    "run_id",
+    "method",
+    "sampling_method",
+    "sampling_mult",
+    "ncd",
+]
+
+# ncd.METRICS besides ncd, from the metrics.tsv of the replicate
+METRIC_COLUMNS = ["rf", "correct_root", "root_distance"]
+
+COLUMNS += METRIC_COLUMNS
+
+# /usr/bin/time -v measurements of the stage that rooted the tree, of DISCO,
+# of the unrooted species tree estimation and of the QR/QR-STAR sweep the
+# stage was part of, if any, in seconds and kbytes
+RESOURCE_COLUMNS = [
+    f"{prefix}{column}"
+    for prefix in ["", "disco_", "s_tree_", "sweep_"]
+    for column in ["wall_time", "user_time", "sys_time", "max_rss"]
+]
+
+COLUMNS += RESOURCE_COLUMNS
+
+PARTITION_COLS = ["num_species", "hILS"]
+
+# dimensions of the experiment grid that figures select rows by
+INDEX_COLS = [
+    "num_species",
+    "unrooted_s_tree",
+    "n_genes",
+    "dup_rate",
+    "loss_rate_indicator",
+    "hILS",
+    "g_type",
+    "method",
+    "sampling_method",
+    "sampling_mult",
+]
+
+CATEGORIES = {
+    "method": ["DISCO+QR", "DISCO+QR-STAR", "STRIDE"],
+    "unrooted_s_tree": ["trues", "astrid", "astral"],
+    "g_type": ["true", "50", "100", "500"],
+    "sampling_method": ["le"],
+}
+
+
+def is_store(path):
+    return Path(path).suffix == ".parquet"
+
+
+def to_store_types(df):
+    """Column types of the results store."""
+    df = df.copy()
+    df["dup_rate"] = df["dup_rate"].astype(float)
+    # float even where no metrics or time log were found, so that every
+    # partition of the store has the same schema
+    for col in METRIC_COLUMNS + RESOURCE_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(float)
+    df["g_type"] = df["g_type"].astype(str)
+    for col, categories in CATEGORIES.items():
+        values = df[col].dropna().unique()
+        categories = categories + sorted(set(values) - set(categories))
+        df[col] = pd.Categorical(df[col], categories=categories)
+    df["sampling_mult"] = df["sampling_mult"].astype("Int64")
+    return df
+
+
+def partition_dirs(path):
+    """Partition directories of a results store by (num_species, hILS)."""
+    dirs = {}
+    for species_dir in Path(path).glob("num_species=*"):
+        for hILS_dir in species_dir.glob("hILS=*"):
+            num_species = int(species_dir.name.partition("=")[2])
+            hILS = hILS_dir.name.partition("=")[2].lower() == "true"
+            dirs[num_species, hILS] = hILS_dir
+    return dirs
+
+
+def write_results(df, path, partitions=None):
+    """
+    Write df as a CSV file, or as a results store for a .parquet path. For
+    an existing store, partitions may name the (num_species, hILS)
+    partitions that changed, and only those are rewritten.
+    """
+    if not is_store(path):
+        df.to_csv(path, index=False)
+        return
+
+    import shutil
+
+    if partitions is None or not Path(path).is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+        to_store_types(df).to_parquet(path, partition_cols=PARTITION_COLS, index=False)
+        return
+
+    # write the changed partitions aside, then swap them in one by one
+    partitions = set(partitions)
+    tmp = Path(path).with_name(f"{Path(path).name}.tmp{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    changed = [key in partitions for key in zip(df["num_species"], df["hILS"])]
+    if any(changed):
+        to_store_types(df[changed]).to_parquet(
+            tmp, partition_cols=PARTITION_COLS, index=False
+        )
+    old_dirs = partition_dirs(path)
+    new_dirs = partition_dirs(tmp)
+    for key in partitions:
+        if key in old_dirs:
+            shutil.rmtree(old_dirs[key])
+            if not any(old_dirs[key].parent.iterdir()):
+                old_dirs[key].parent.rmdir()
+        if key in new_dirs:
+            dst = Path(path) / new_dirs[key].relative_to(tmp)
+            dst.parent.mkdir(exist_ok=True)
+            new_dirs[key].rename(dst)
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+def pushdown_filters(filters):
+    """
+    Translate plot filters ({column: value or list of values}) into Parquet
+    predicates. Filters involving None are left to filter_results.
+    """
+    predicates = []
+    for key, value in filters.items():
+        if isinstance(value, list):
+            if None in value:
+                continue
+            predicates.append((key, "in", value))
+        elif value is not None:
+            predicates.append((key, "==", value))
+    return predicates or None
+
+
+def filter_results(df, filters):
+    """
+    Rows of df matching every filter: a value (None matches missing
+    values) or a list of values (which may contain None).
+    """
+    for key, value in filters.items():
+        if isinstance(value, list):
+            # Handle None explicitly: keep rows where key is in value or (None in value and pd.isna)
+            mask = df[key].isin([v for v in value if v is not None])
+            if None in value:
+                mask |= df[key].isna()
+            df = df[mask]
+        else:
+            if value is None:
+                df = df[df[key].isna()]
+            else:
+                df = df[df[key] == value]
+    return df
+
+
+def remove_unused_categories(df):
+    """Drop categories without rows, so they are not drawn as empty groups."""
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].cat.remove_unused_categories()
+    return df
+
+
+def read_results(path, columns=None, filters=None):
+    """
+    Results from a CSV file or a results store, restricted to columns and
+    to the rows matching filters (see filter_results).
+    """
+    filters = filters or {}
+    if columns is not None:
+        columns = [col for col in COLUMNS if col in set(columns) | set(filters)]
+
+    if not is_store(path):
+        df = pd.read_csv(path, usecols=columns and (lambda col: col in columns))
+    else:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        partitioning = ds.partitioning(
+            pa.schema([("num_species", pa.int64()), ("hILS", pa.bool_())]),
+            flavor="hive",
+        )
+        df = pd.read_parquet(
+            path,
+            columns=columns,
+            filters=pushdown_filters(filters),
+            partitioning=partitioning,
+        )
+        df = df[[col for col in COLUMNS if col in df.columns]]
+
+    df = filter_results(df, filters)
+    return remove_unused_categories(df).reset_index(drop=True)
+
+
+def _group_key(value):
+    # missing values are looked up as None, whether they were read as NaN,
+    # None or pd.NA
+    return None if pd.isna(value) else value
+
+
+class ResultIndex(object):
+    """
+    Rows of a results DataFrame grouped once by the experiment dimensions
+    (INDEX_COLS), so that selecting the rows of a figure looks up the
+    matching groups instead of masking the whole frame.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self.keys = [col for col in INDEX_COLS if col in df.columns]
+        groups = df.groupby(self.keys, dropna=False, observed=True, sort=False)
+        self._groups = {}
+        for key, positions in groups.indices.items():
+            if len(self.keys) == 1:
+                key = (key,)
+            self._groups[tuple(_group_key(v) for v in key)] = positions
+        # positions of the rows of each combination of values of a subset
+        # of the keys, built on first use of that subset
+        self._projections = {}
+
+    def _projection(self, keys):
+        if keys not in self._projections:
+            idx = [self.keys.index(key) for key in keys]
+            projection = {}
+            for key, positions in self._groups.items():
+                projection.setdefault(tuple(key[i] for i in idx), []).append(positions)
+            self._projections[keys] = {
+                key: np.concatenate(positions) for key, positions in projection.items()
+            }
+        return self._projections[keys]
+
+    def select(self, filters, columns=None):
+        """Rows matching filters, with the same semantics as filter_results."""
+        keys = tuple(key for key in self.keys if key in filters)
+        projection = self._projection(keys)
+
+        values = []
+        for key in keys:
+            value = filters[key]
+            value = value if isinstance(value, list) else [value]
+            values.append([_group_key(v) for v in value])
+        found = [projection[k] for k in product(*values) if k in projection]
+        positions = np.sort(np.concatenate(found)) if found else []
+
+        df = self.df.iloc[positions]
+        # filters on columns outside the index, such as run_id
+        df = filter_results(df, {k: v for k, v in filters.items() if k not in keys})
+        if columns is not None:
+            df = df[[col for col in df.columns if col in set(columns)]]
+        return remove_unused_categories(df.copy())
+
+
+def select(source, filters, columns=None):
+    """
+    Rows matching filters from a ResultIndex, a DataFrame already in memory
+    or a path to read them from.
+    """
+    if isinstance(source, ResultIndex):
+        return source.select(filters, columns=columns)
+    if isinstance(source, pd.DataFrame):
+        df = filter_results(source, filters)
+        if columns is not None:
+            df = df[[col for col in source.columns if col in set(columns)]]
+        return df.copy()
+    return read_results(source, columns=columns, filters=filters)
+
+
+def write_shared(df, path):
+    """
+    Write df as an uncompressed Arrow IPC file, which map_shared can map
+    into several processes without each parsing its own copy.
+    """
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(str(path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def map_shared(path):
+    """Read-only DataFrame backed by a memory-mapped write_shared file."""
+    import pyarrow as pa
+
+    table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+    return table.to_pandas(split_blocks=True)
@@ -32,6 +32,9 @@ do
                     output_dir=output/trees/${id}/${run_id}
                     mkdir -p $output_dir
 
+                    score_manifest=${output_dir}/score.manifest
+                    : > ${score_manifest}
+
                     for g_type in true 100 # true 50 100 500
                     do
                         input_tree_raw=${input_dir}/g_${g_type}.trees
@@ -47,7 +50,7 @@ do
 
                             if [ ! -f ${input_tree} ]; then
                                 mkdir -p ${output_dir}/${g_type}g/${n_genes}/
-                                head -n ${n_genes} ${input_tree_raw} > ${input_tree}
+                                python genetrees.py prefix ${input_tree_raw} ${n_genes} ${input_tree} --index ${output_dir}/g_${g_type}.trees.idx
                             else
                                 echo "Gene tree file with ${n_genes} genes already exists."
                             fi
@@ -59,143 +62,104 @@ do
 
                             echo "Running on ${id} ${run_id} ${g_type} ${n_genes}"
 
-                            if [ -f ${output_dir}/${g_type}g/${n_genes}/disco/done ]; then
-                                echo "DISCO already done"
-                            else
-                                echo "Running DISCO on gene trees"
-
-                                mkdir -p ${output_dir}/${g_type}g/${n_genes}/disco/
-
-                                /usr/bin/time -v python DISCO/disco.py \
+                            # run once, under the stage lock, whichever of run.sh and run_STRIDE.sh gets there first
+                            python stage.py ${output_dir}/${g_type}g/${n_genes}/disco/ g_single.trees --newick -- \
+                                python DISCO/disco.py \
                                     -i ${input_tree} \
                                     -o ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees \
-                                    -d _ \
-                                1>${output_dir}/${g_type}g/${n_genes}/disco/run.out 2>${output_dir}/${g_type}g/${n_genes}/disco/run.err
+                                    -d _
 
-                                if [ -f ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees ]; then
-                                    touch ${output_dir}/${g_type}g/${n_genes}/disco/done
-                                fi
-                            fi
-
-                            if [ ! -f ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees ]; then
+                            if [ ! -f ${output_dir}/${g_type}g/${n_genes}/disco/done ]; then
                                 echo "DISCO tree does not exist. Skipping ${id} ${run_id} ${g_type} ${n_genes}."
                                 continue
                             fi
 
                             for s_est_method in trues astrid astral # trues astrid astral
                             do
-                                if [ -f ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/done ]; then
-                                    echo "${s_est_method} already done"
-                                else
-                                    mkdir -p ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/
-
-                                    if [ $s_est_method == "astrid" ]; then
-                                        /usr/bin/time -v ./ASTRID/bazel-bin/src/ASTRID \
-                                            -i ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees \
-                                            -o ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree \
-                                        1>${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/run.out 2>${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/run.err
-                                    elif [ $s_est_method == "astral" ]; then
-                                        /usr/bin/time -v ./ASTER/bin/astral4 \
-                                            -i ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees \
-                                            -o ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree \
-                                        1>${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/run.out 2>${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/run.err
-                                    elif [ $s_est_method == "trues" ]; then
-                                        cp ${input_dir}/s_tree.trees ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree
-                                    fi
-
-                                    if [ -f ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree ]; then
-                                        touch ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/done
-                                    fi
+                                # estimated trees have the taxa of the DISCO gene trees, the true tree may have more
+                                leaves_of=(--leaves-of ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees)
+                                if [ $s_est_method == "astrid" ]; then
+                                    s_est_cmd=(./ASTRID/bazel-bin/src/ASTRID -i ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees -o ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree)
+                                elif [ $s_est_method == "astral" ]; then
+                                    s_est_cmd=(./ASTER/bin/astral4 -i ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees -o ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree)
+                                elif [ $s_est_method == "trues" ]; then
+                                    s_est_cmd=(cp ${input_dir}/s_tree.trees ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree)
+                                    leaves_of=()
                                 fi
+                                python stage.py ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/ s_unrooted_est.tree \
+                                    --newick "${leaves_of[@]}" -- "${s_est_cmd[@]}"
 
-                                if [ ! -f ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree ]; then
+                                if [ ! -f ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/done ]; then
                                     echo "${s_est_method} tree does not exist. Skipping ${id} ${run_id} ${g_type} ${n_genes}."
                                     continue
                                 fi
 
                                 for mult in 1 5 10 50 # 1 5 10 50
                                 do
-                                    if [ -f ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qr/le/${mult}/done ]; then
-                                        echo "QR already done"
-                                    else
-                                        echo "Running QR on gene trees"
-
-                                        mkdir -p ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qr/le/${mult}
-
-                                        /usr/bin/time -v python Quintet-Rooting/quintet_rooting.py \
-                                            -t ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree  \
+                                    python stage.py ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qr/le/${mult}/ s_rooted_est.tree \
+                                        --newick --leaves-of ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree -- \
+                                        python Quintet-Rooting/quintet_rooting.py \
+                                            -t ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree \
                                             -g ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees \
                                             -o ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qr/le/${mult}/s_rooted_est.tree \
                                             -sm LE \
                                             -rs 0 \
-                                            -mult ${mult} \
-                                        1>${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qr/le/${mult}/run.out 2>${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qr/le/${mult}/run.err
-
-                                        if [ -f ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qr/le/${mult}/s_rooted_est.tree ]; then
-                                            touch ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qr/le/${mult}/done
-                                        fi
-                                    fi
+                                            -mult ${mult}
 
                                     if [ -f ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qr/le/${mult}/done ]; then
-                                        echo "Computing nCD on DISCO+QR tree"
+                                        echo "Queueing nCD on DISCO+QR tree"
 
-                                        python ncd.py \
-                                            -t1 ${input_dir}/s_tree.trees \
-                                            -t2 ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qr/le/${mult}/s_rooted_est.tree \
-                                        >${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qr/le/${mult}/s_rooted_est.score
+                                        echo ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qr/le/${mult}/s_rooted_est.tree >> ${score_manifest}
                                     fi
 
-                                    if [ -f ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qrstar/le/${mult}/done ]; then
-                                        echo "QR-STAR already done"
-                                    else
-                                        echo "Running QR-STAR on gene trees"
-
-                                        mkdir -p ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qrstar/le/${mult}
-
-                                        /usr/bin/time -v python Quintet-Rooting/quintet_rooting.py \
-                                            -t ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree  \
+                                    python stage.py ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qrstar/le/${mult}/ s_rooted_est.tree \
+                                        --newick --leaves-of ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree -- \
+                                        python Quintet-Rooting/quintet_rooting.py \
+                                            -t ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree \
                                             -g ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees \
                                             -o ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qrstar/le/${mult}/s_rooted_est.tree \
                                             -sm LE \
                                             -c STAR \
                                             -rs 0 \
-                                            -mult ${mult} \
-                                        1>${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qrstar/le/${mult}/run.out 2>${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qrstar/le/${mult}/run.err
-
-                                        if [ -f ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qrstar/le/${mult}/s_rooted_est.tree ]; then
-                                            touch ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qrstar/le/${mult}/done
-                                        fi
-                                    fi
+                                            -mult ${mult}
 
                                     if [ -f ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qrstar/le/${mult}/done ]; then
-                                        echo "Computing nCD on DISCO+QR-STAR tree"
+                                        echo "Queueing nCD on DISCO+QR-STAR tree"
 
-                                        python ncd.py \
-                                            -t1 ${input_dir}/s_tree.trees \
-                                            -t2 ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qrstar/le/${mult}/s_rooted_est.tree \
-                                        >${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qrstar/le/${mult}/s_rooted_est.score
+                                        echo ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qrstar/le/${mult}/s_rooted_est.tree >> ${score_manifest}
                                     fi
 
-                                    if [ -f ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qr/le/${mult}/s_rooted_est.score ] && [ -f ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qrstar/le/${mult}/s_rooted_est.score ]; then
-                                        echo "nCD scores computed"
-                                        score_qr=$(cat ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qr/le/${mult}/s_rooted_est.score)
-                                        score_qrstar=$(cat ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/qrstar/le/${mult}/s_rooted_est.score)
-                                        echo "nCD(QR): ${score_qr}"
-                                        echo "nCD(QR-STAR): ${score_qrstar}"
-                                        if [ $(echo "$score_qr < $score_qrstar" | bc) -eq 1 ]; then
-                                            echo "QR is better than QR-STAR"
-                                            # read -p "Press enter to continue"
-                                        elif [ $(echo "$score_qr > $score_qrstar" | bc) -eq 1 ]; then
-                                            echo "QR-STAR is better than QR"
-                                            # read -p "Press enter to continue"
-                                        else
-                                            echo "QR and QR-STAR are equal"
-                                        fi
-                                    fi
                                 done
                             done
                         done
                     done
+
+                    echo "Computing nCD on all queued trees"
+
+                    python ncd.py \
+                        -r ${input_dir}/s_tree.trees \
+                        -m ${score_manifest} \
+                        -b bitset \
+                        -M ${output_dir}/metrics.tsv
+
+                    for score_qr in $(sed -n 's|/qr/le/\(.*\)\.tree$|/qr/le/\1.score|p' ${score_manifest})
+                    do
+                        score_qrstar=${score_qr/\/qr\/le\//\/qrstar\/le\/}
+                        if [ -f ${score_qr} ] && [ -f ${score_qrstar} ]; then
+                            echo "nCD scores computed for ${score_qr%/s_rooted_est.score}"
+                            ncd_qr=$(cat ${score_qr})
+                            ncd_qrstar=$(cat ${score_qrstar})
+                            echo "nCD(QR): ${ncd_qr}"
+                            echo "nCD(QR-STAR): ${ncd_qrstar}"
+                            if [ $(echo "$ncd_qr < $ncd_qrstar" | bc) -eq 1 ]; then
+                                echo "QR is better than QR-STAR"
+                            elif [ $(echo "$ncd_qr > $ncd_qrstar" | bc) -eq 1 ]; then
+                                echo "QR-STAR is better than QR"
+                            else
+                                echo "QR and QR-STAR are equal"
+                            fi
+                        fi
+                    done
                 done
             done
         done
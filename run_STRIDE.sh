@@ -32,6 +32,9 @@ do
                     output_dir=output/trees/${id}/${run_id}
                     mkdir -p $output_dir
 
+                    score_manifest=${output_dir}/stride_score.manifest
+                    : > ${score_manifest}
+
                     for g_type in true 50 100 500 # true 50 100 500
                     do
                         input_tree_raw=${input_dir}/g_${g_type}.trees
@@ -50,10 +53,9 @@ do
 
                             if [ ! -d ${input_gtrees_dir} ]; then
                                 mkdir -p ${output_dir}/${g_type}g/${n_genes}/
-                                head -n ${n_genes} ${input_tree_raw} > ${input_tree}
-                                
-                                mkdir -p ${output_dir}/${g_type}g/${n_genes}/split/
-                                split ${input_tree} -l 1 --additional-suffix=.tree ${output_dir}/${g_type}g/${n_genes}/split/g_multi_
+                                python genetrees.py prefix ${input_tree_raw} ${n_genes} ${input_tree} --index ${output_dir}/g_${g_type}.trees.idx
+
+                                python genetrees.py split ${input_tree_raw} ${n_genes} ${input_gtrees_dir} --index ${output_dir}/g_${g_type}.trees.idx --pool ${output_dir}/${g_type}g/split/
                             else
                                 echo "Gene trees with ${n_genes} genes already exists."
                             fi
@@ -65,92 +67,64 @@ do
 
                             echo "Running on ${id} ${run_id} ${g_type} ${n_genes}"
 
-                            if [ -f ${output_dir}/${g_type}g/${n_genes}/disco/done ]; then
-                                echo "DISCO already done"
-                            else
-                                echo "Running DISCO on gene trees"
-
-                                mkdir -p ${output_dir}/${g_type}g/${n_genes}/disco/
-
-                                /usr/bin/time -v python DISCO/disco.py \
+                            # run once, under the stage lock, whichever of run.sh and run_STRIDE.sh gets there first
+                            python stage.py ${output_dir}/${g_type}g/${n_genes}/disco/ g_single.trees --newick -- \
+                                python DISCO/disco.py \
                                     -i ${input_tree} \
                                     -o ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees \
-                                    -d _ \
-                                1>${output_dir}/${g_type}g/${n_genes}/disco/run.out 2>${output_dir}/${g_type}g/${n_genes}/disco/run.err
-
-                                if [ -f ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees ]; then
-                                    touch ${output_dir}/${g_type}g/${n_genes}/disco/done
-                                fi
-                            fi
+                                    -d _
 
-                            if [ ! -f ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees ]; then
+                            if [ ! -f ${output_dir}/${g_type}g/${n_genes}/disco/done ]; then
                                 echo "DISCO tree does not exist. Skipping ${id} ${run_id} ${g_type} ${n_genes}."
                                 continue
                             fi
 
                             for s_est_method in trues astrid astral # trues astrid astral
                             do
-                                if [ -f ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/done ]; then
-                                    echo "${s_est_method} already done"
-                                else
-                                    mkdir -p ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/
-
-                                    if [ $s_est_method == "astrid" ]; then
-                                        /usr/bin/time -v ./ASTRID/bazel-bin/src/ASTRID \
-                                            -i ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees \
-                                            -o ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree \
-                                        1>${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/run.out 2>${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/run.err
-                                    elif [ $s_est_method == "astral" ]; then
-                                        /usr/bin/time -v ./ASTER/bin/astral4 \
-                                            -i ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees \
-                                            -o ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree \
-                                        1>${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/run.out 2>${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/run.err
-                                    elif [ $s_est_method == "trues" ]; then
-                                        cp ${input_dir}/s_tree.trees ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree
-                                    fi
-
-                                    if [ -f ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree ]; then
-                                        touch ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/done
-                                    fi
+                                # estimated trees have the taxa of the DISCO gene trees, the true tree may have more
+                                leaves_of=(--leaves-of ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees)
+                                if [ $s_est_method == "astrid" ]; then
+                                    s_est_cmd=(./ASTRID/bazel-bin/src/ASTRID -i ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees -o ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree)
+                                elif [ $s_est_method == "astral" ]; then
+                                    s_est_cmd=(./ASTER/bin/astral4 -i ${output_dir}/${g_type}g/${n_genes}/disco/g_single.trees -o ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree)
+                                elif [ $s_est_method == "trues" ]; then
+                                    s_est_cmd=(cp ${input_dir}/s_tree.trees ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree)
+                                    leaves_of=()
                                 fi
+                                python stage.py ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/ s_unrooted_est.tree \
+                                    --newick "${leaves_of[@]}" -- "${s_est_cmd[@]}"
 
-                                if [ ! -f ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree ]; then
+                                if [ ! -f ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/done ]; then
                                     echo "${s_est_method} tree does not exist. Skipping ${id} ${run_id} ${g_type} ${n_genes}."
                                     continue
                                 fi
 
-                                if [ -f ${output_dir}/${g_type}g/${n_genes}/stride/${s_est_method}/done ]; then
-                                    echo "STRIDE already done"
-                                else
-                                    echo "Running STRIDE"
-
-                                    mkdir -p ${output_dir}/${g_type}g/${n_genes}/stride/${s_est_method}/
-
-                                    /usr/bin/time -v python STRIDE/stride/stride.py \
+                                python stage.py ${output_dir}/${g_type}g/${n_genes}/stride/${s_est_method}/ s_rooted_est.tree \
+                                    --newick --leaves-of ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree -- \
+                                    python STRIDE/stride/stride.py \
                                         -d ${output_dir}/${g_type}g/${n_genes}/split/ \
                                         -s dash \
-                                        -S ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree  \
-                                        -o ${output_dir}/${g_type}g/${n_genes}/stride/${s_est_method}/s_rooted_est \
-                                    1>${output_dir}/${g_type}g/${n_genes}/stride/${s_est_method}/run.out 2>${output_dir}/${g_type}g/${n_genes}/stride/${s_est_method}/run.err
-
-                                    if [ -f ${output_dir}/${g_type}g/${n_genes}/stride/${s_est_method}/s_rooted_est.tree ]; then
-                                        touch ${output_dir}/${g_type}g/${n_genes}/stride/${s_est_method}/done
-                                    fi
-                                fi
+                                        -S ${output_dir}/${g_type}g/${n_genes}/disco/${s_est_method}/s_unrooted_est.tree \
+                                        -o ${output_dir}/${g_type}g/${n_genes}/stride/${s_est_method}/s_rooted_est
 
                                 if [ -f ${output_dir}/${g_type}g/${n_genes}/stride/${s_est_method}/done ]; then
-                                    echo "Computing nCD on STRIDE tree"
+                                    echo "Queueing nCD on STRIDE tree"
 
-                                    python ncd.py \
-                                        -t1 ${input_dir}/s_tree.trees \
-                                        -t2 ${output_dir}/${g_type}g/${n_genes}/stride/${s_est_method}/s_rooted_est.tree \
-                                    >${output_dir}/${g_type}g/${n_genes}/stride/${s_est_method}/s_rooted_est.score
+                                    echo ${output_dir}/${g_type}g/${n_genes}/stride/${s_est_method}/s_rooted_est.tree >> ${score_manifest}
                                 fi
 
                                 echo "Done with ${id} ${run_id} ${g_type} ${n_genes} ${s_est_method}"
                             done
                         done
                     done
+
+                    echo "Computing nCD on all queued trees"
+
+                    python ncd.py \
+                        -r ${input_dir}/s_tree.trees \
+                        -m ${score_manifest} \
+                        -b bitset \
+                        -M ${output_dir}/metrics.tsv
                 done
             done
         done
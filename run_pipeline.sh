@@ -0,0 +1,25 @@
+#!/bin/bash
+#SBATCH --time=12:00:00
+#SBATCH --nodes=1
+#SBATCH --cpus-per-task=16
+#SBATCH --array=0-9
+#SBATCH --output=slurm_output/pipeline/slurm-%A_%a.out
+#SBATCH --job-name="pipeline"
+#SBATCH --partition=tallis
+#SBATCH --mem=64G
+
+# Each array task runs every (array task id)-th cell of the grid on
+# SLURM_CPUS_PER_TASK workers; rerunning skips finished tasks.
+python pipeline.py \
+    --data data/trees \
+    --output output/trees \
+    --cache output/cache \
+    --loss-rate-indicator 1 \
+    --hILS false true \
+    --dup-rate 1e-9 1e-10 5e-10 1e-11 1e-12 1e-13 \
+    --num-species 20 50 100 \
+    --g-type true 50 100 500 \
+    --n-genes 50 100 500 1000 \
+    --s-est-method trues astrid astral \
+    --rooting qr qrstar stride \
+    --mult 1 5 10 50
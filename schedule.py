@@ -0,0 +1,383 @@
+"""
+Pack the cells of the pipeline grid into SLURM array tasks of similar length.
+
+The wall time of every kind of stage is modelled as a power law of the
+number of species, the number of gene trees and (for QR and QR-STAR) the
+sampling multiplicity, fitted to the /usr/bin/time -v reports of earlier
+runs. The QR and QR-STAR runs of a pipeline.py sweep share their quintet
+counts, so the sweep as a whole is one stage, of the largest mult it ran.
+The cells of a (replicate, g_type), which share their DISCO blocks,
+are then packed into shards by predicted cost, largest first onto the least
+loaded shard, and the shards are written to a file that
+`pipeline.py --shards` reads, with an sbatch script running one array task
+per shard.
+"""
+
+import argparse
+import heapq
+import json
+import math
+from collections import namedtuple
+from itertools import groupby
+from pathlib import Path
+
+import numpy as np
+
+from agg_result import parse_time_log, sweep_report, sweep_runs
+from pipeline import add_grid_arguments, cell_key, cells, disco_blocks
+
+# run.err of every kind of stage below a (g_type, n_genes) cell directory
+RECORD_GLOBS = [
+    ("disco", "disco/run.err"),
+    ("astrid", "disco/astrid/run.err"),
+    ("astral", "disco/astral/run.err"),
+    ("qr", "disco/*/qr/le/*/run.err"),
+    ("qrstar", "disco/*/qrstar/le/*/run.err"),
+    ("stride", "stride/*/run.err"),
+    ("sweep", "disco/*/quintets/run.err"),
+]
+
+# The cells of a (replicate, g_type) with their predicted total work and
+# longest chain of dependent stages, in seconds
+GroupCost = namedtuple("GroupCost", ["cells", "total", "critical"])
+
+
+def read_history(output_dirs):
+    """
+    (num_species, n_genes, mult, wall_time) of every finished stage below
+    output_dirs, by kind of stage. mult is 1 for stages without one, and
+    the largest mult of a sweep, whose runs are not counted on their own.
+    """
+    records = {kind: [] for kind, _ in RECORD_GLOBS}
+
+    def add(kind, num_species, n_genes, mult, log):
+        wall_time = dict(parse_time_log(str(log)))["wall_time"]
+        if wall_time is not None:
+            records[kind].append((num_species, n_genes, mult, wall_time))
+
+    for output_dir in output_dirs:
+        for g_dir in Path(output_dir).glob("*/*/*g"):
+            num_species = int(g_dir.parts[-3].split("_")[0])
+            # DISCO blocks of pipeline.py, named <start>-<stop>
+            for log in g_dir.glob("disco/*-*/run.err"):
+                start, stop = map(int, log.parent.name.split("-"))
+                add("disco", num_species, stop - start, 1, log)
+            for cell_dir in g_dir.iterdir():
+                if not cell_dir.name.isdigit():
+                    continue
+                n_genes = int(cell_dir.name)
+                for kind, pattern in RECORD_GLOBS:
+                    for log in cell_dir.glob(pattern):
+                        if kind == "sweep":
+                            mults = [int(Path(run).name) for run in sweep_runs(log)]
+                            mult = max(mults, default=1)
+                        elif kind in ("qr", "qrstar"):
+                            if sweep_report(str(log)) is not None:
+                                continue
+                            mult = int(log.parent.name)
+                        else:
+                            mult = 1
+                        add(kind, num_species, n_genes, mult, log)
+    return records
+
+
+class CostModel(object):
+    """
+    Predicted wall time of a stage: log(wall_time) is fitted by least
+    squares as a linear function of log(num_species), log(n_genes) and
+    log(mult) per kind of stage. Parameters that never vary in the records
+    of a kind are left out of its fit, and kinds without records cost
+    default seconds.
+    """
+
+    def __init__(self, records, default):
+        self.default = default
+        self.fits = {}
+        for kind, rows in records.items():
+            if not rows:
+                continue
+            rows = np.array(rows, dtype=float)
+            x = np.log(rows[:, :3])
+            y = np.log(np.maximum(rows[:, 3], 0.01))
+            varying = [i for i in range(3) if np.ptp(x[:, i]) > 0]
+            design = np.column_stack([np.ones(len(rows))] + [x[:, i] for i in varying])
+            coef = np.linalg.lstsq(design, y, rcond=None)[0]
+            self.fits[kind] = (varying, coef)
+
+    def predict(self, kind, num_species, n_genes, mult=1):
+        if kind not in self.fits:
+            return self.default
+        varying, coef = self.fits[kind]
+        x = np.log([num_species, n_genes, mult])
+        return float(np.exp(coef[0] + sum(c * x[i] for c, i in zip(coef[1:], varying))))
+
+    def describe(self):
+        names = ["num_species", "n_genes", "mult"]
+        for kind, (varying, coef) in sorted(self.fits.items()):
+            terms = " * ".join(f"{names[i]}^{c:.2f}" for c, i in zip(coef[1:], varying))
+            print(
+                f"{kind}: {math.exp(coef[0]):.3g}s" + (f" * {terms}" if terms else "")
+            )
+
+
+def group_cost(model, args, g_dir, num_species, cells):
+    """
+    Predicted cost of the stages of the cells (keys and n_genes) of one
+    (replicate, g_type) that are not done yet, following the graph of
+    pipeline.add_disco_tasks and pipeline.add_cell_tasks. Cells without
+    any work left are dropped; returns None if none is left.
+    """
+    blocks = []
+    for start, stop in disco_blocks(args.n_genes, args.disco_chunk):
+        if (g_dir / "disco" / f"{start}-{stop}" / "done").is_file():
+            blocks.append((stop, 0.0))
+        else:
+            blocks.append((stop, model.predict("disco", num_species, stop - start)))
+
+    keys, total, critical, needed = [], 0.0, 0.0, 0
+    for key, n_genes in cells:
+        cell_dir = g_dir / f"{n_genes}"
+        if (cell_dir / "disco" / "done").is_file():
+            disco = 0.0
+        else:
+            # blocks run in parallel
+            disco = max(cost for stop, cost in blocks if stop <= n_genes)
+            needed = max(needed, n_genes)
+        work, path = cell_cost(model, args, cell_dir, num_species, n_genes, disco)
+        if work > 0 or disco > 0:
+            keys.append(key)
+            total += work
+            critical = max(critical, path)
+    if not keys:
+        return None
+    total += sum(cost for stop, cost in blocks if stop <= needed)
+    return GroupCost(keys, total, critical)
+
+
+def cell_cost(model, args, cell_dir, num_species, n_genes, disco):
+    """
+    Predicted total wall time of the stages of a cell after DISCO that are
+    not done yet, and its critical path starting with disco seconds of
+    DISCO blocks.
+    """
+
+    def cost(kind, stage_dir, mult=1):
+        if (stage_dir / "done").is_file():
+            return 0.0
+        return model.predict(kind, num_species, n_genes, mult)
+
+    disco_dir = cell_dir / "disco"
+    total = 0.0
+    branches = []
+    for s_est_method in args.s_est_method:
+        s_dir = disco_dir / s_est_method
+        s_tree = 0.0 if s_est_method == "trues" else cost(s_est_method, s_dir)
+        rooted = []
+        if "stride" in args.rooting:
+            rooted.append(cost("stride", cell_dir / "stride" / s_est_method))
+        # QR and QR-STAR at every mult run one after the other in one sweep,
+        # costing that of its largest mult left, or the sum of the runs
+        # where only runs of their own were recorded
+        sweep = 0.0
+        pending = []
+        for rs_est_method in ["qr", "qrstar"]:
+            if rs_est_method in args.rooting:
+                for mult in args.mult:
+                    r_dir = s_dir / rs_est_method / "le" / f"{mult}"
+                    sweep += cost(rs_est_method, r_dir, mult)
+                    if not (r_dir / "done").is_file():
+                        pending.append(mult)
+        if pending and "sweep" in model.fits:
+            sweep = model.predict("sweep", num_species, n_genes, max(pending))
+        rooted.append(sweep)
+        total += s_tree + sum(rooted)
+        branches.append(s_tree + max(rooted, default=0.0))
+    return total, disco + max(branches, default=0.0)
+
+
+def pack(costs, n_shards, workers):
+    """
+    Assign groups of cells to n_shards shards, largest first onto the
+    shard that would finish first. Returns the shards and their predicted wall times
+    on workers processes each.
+    """
+    shards = [[] for _ in range(n_shards)]
+    loads = [0.0] * n_shards
+    heap = [(0.0, i) for i in range(n_shards)]
+    for group in sorted(costs, key=lambda c: c.total, reverse=True):
+        _, i = heapq.heappop(heap)
+        shards[i].append(group)
+        loads[i] += group.total
+        heapq.heappush(heap, (loads[i], i))
+    makespans = [
+        max([load / workers] + [group.critical for group in shard])
+        for load, shard in zip(loads, shards)
+    ]
+    return shards, makespans
+
+
+def grid_options(args):
+    """pipeline.py options selecting the same grid as args, one per line."""
+    options = [
+        f"--data {args.data}",
+        f"--output {args.output}",
+        f"--disco-chunk {args.disco_chunk}",
+    ]
+    for dest in [
+        "loss_rate_indicator",
+        "hILS",
+        "dup_rate",
+        "num_species",
+        "run_id",
+        "g_type",
+        "n_genes",
+        "s_est_method",
+        "rooting",
+        "mult",
+    ]:
+        values = [
+            str(v).lower() if isinstance(v, bool) else str(v)
+            for v in getattr(args, dest)
+        ]
+        options.append(" ".join([f"--{dest.replace('_', '-')}"] + values))
+    return options
+
+
+def slurm_time(seconds):
+    minutes = max(10, math.ceil(seconds / 60))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
+
+
+def write_sbatch(path, args, n_shards, seconds):
+    options = [f"--shards {args.shards}"] + grid_options(args)
+    if args.cache:
+        options.append(f"--cache {args.cache}")
+    lines = [
+        "#!/bin/bash",
+        f"#SBATCH --time={slurm_time(seconds)}",
+        "#SBATCH --nodes=1",
+        f"#SBATCH --cpus-per-task={args.workers}",
+        f"#SBATCH --array=0-{n_shards - 1}",
+        "#SBATCH --output=slurm_output/pipeline/slurm-%A_%a.out",
+        '#SBATCH --job-name="pipeline"',
+        f"#SBATCH --partition={args.partition}",
+        f"#SBATCH --mem={args.mem}",
+        "",
+        f"# {n_shards} shards packed by schedule.py; each array task runs the",
+        "# cells of its shard on SLURM_CPUS_PER_TASK workers.",
+        "python pipeline.py \\",
+    ]
+    lines += [f"    {option} \\" for option in options[:-1]]
+    lines.append(f"    {options[-1]}")
+    Path(path).write_text("\n".join(lines) + "\n")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Pack the pipeline grid into SLURM array tasks by predicted cost."
+    )
+    add_grid_arguments(parser)
+    parser.add_argument(
+        "--history",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Output directories of earlier runs to fit the cost model to "
+        "(defaults to --output).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=16,
+        help="Number of worker processes (CPUs) of each array task.",
+    )
+    parser.add_argument(
+        "--array-count",
+        type=int,
+        default=None,
+        help="Number of shards (by default, as few as fit in --budget).",
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=12.0,
+        help="Wall time budget of an array task, in hours.",
+    )
+    parser.add_argument(
+        "--margin",
+        type=float,
+        default=1.5,
+        help="Factor applied to the predicted wall time in the sbatch script.",
+    )
+    parser.add_argument(
+        "--default-cost",
+        type=float,
+        default=600.0,
+        help="Predicted seconds of a kind of stage without any records.",
+    )
+    parser.add_argument(
+        "--shards", type=str, default="shards.json", help="Output shard file."
+    )
+    parser.add_argument(
+        "--sbatch", type=str, default="run_shards.sh", help="Output sbatch script."
+    )
+    parser.add_argument(
+        "--cache", type=str, default=None, help="Passed to pipeline.py."
+    )
+    parser.add_argument("--partition", type=str, default="tallis")
+    parser.add_argument("--mem", type=str, default="64G")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    assert Path(args.data).is_dir(), f"Input directory {args.data} does not exist."
+
+    model = CostModel(read_history(args.history or [args.output]), args.default_cost)
+    model.describe()
+
+    costs = []
+    for (id, run_id, g_type), group in groupby(cells(args), key=lambda c: c[:3]):
+        g_dir = Path(args.output) / id / run_id / f"{g_type}g"
+        num_species = int(id.split("_")[0])
+        group = [(cell_key(*cell), cell[3]) for cell in group]
+        cost = group_cost(model, args, g_dir, num_species, group)
+        if cost is not None:
+            costs.append(cost)
+    assert costs, "Every cell of the grid is done."
+
+    budget = args.budget * 3600 / args.margin
+    longest = max(max(group.critical, group.total / args.workers) for group in costs)
+    if longest > budget:
+        # a shard cannot finish before its longest group
+        print(f"Longest group of cells predicted to take {longest / 3600:.2f} hours")
+        budget = longest
+    if args.array_count:
+        n_shards = args.array_count
+    else:
+        total = sum(group.total for group in costs)
+        n_shards = max(1, math.ceil(total / (args.workers * budget)))
+    n_shards = min(n_shards, len(costs))
+    shards, makespans = pack(costs, n_shards, args.workers)
+    while not args.array_count and max(makespans) > budget and n_shards < len(costs):
+        n_shards = min(len(costs), n_shards + max(1, n_shards // 10))
+        shards, makespans = pack(costs, n_shards, args.workers)
+
+    Path(args.shards).write_text(
+        json.dumps(
+            [
+                {
+                    "cost": makespan,
+                    "cells": [key for group in shard for key in group.cells],
+                }
+                for shard, makespan in zip(shards, makespans)
+            ],
+            indent=1,
+        )
+    )
+    write_sbatch(args.sbatch, args, n_shards, max(makespans) * args.margin)
+    print(
+        f"{sum(len(group.cells) for group in costs)} cells in {len(costs)} groups "
+        f"in {n_shards} shards, predicted "
+        f"{min(makespans) / 3600:.2f}-{max(makespans) / 3600:.2f} hours each"
+    )
@@ -0,0 +1,289 @@
+"""
+Run a stage of the pipelines at most once, however many scripts need it.
+
+run.sh, run_STRIDE.sh and pipeline.py all build the DISCO and unrooted
+species tree stages of a cell, and may run at the same time on the same
+replicate. A stage is run under an exclusive lock on <stage_dir>/.lock:
+the first process to take it runs the tool, the others block on the lock
+(in the kernel, without polling) and find the stage done once they get it.
+The tool writes its outputs to a temporary directory, where they are
+checked (trees must be complete Newick with the leaves of the tree they
+were estimated from) and renamed into place before the done marker is
+written, so a stage directory never holds a partial output next to a done
+marker. The marker records the sha256 of every output, in the format of
+sha256sum, and a stage is only done while its outputs still match it.
+
+    python stage.py output/.../disco/astrid s_unrooted_est.tree \
+        --newick --leaves-of .../g_single.trees -- \
+        ./ASTRID/bazel-bin/src/ASTRID -i .../g_single.trees \
+        -o output/.../disco/astrid/s_unrooted_est.tree
+"""
+
+import argparse
+import fcntl
+import os
+import shutil
+import subprocess
+import sys
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+
+import cache
+import ncd
+
+
+@contextmanager
+def locked(stage_dir):
+    """Hold the lock of stage_dir, waiting for it if another process has it."""
+    stage_dir = Path(stage_dir)
+    stage_dir.mkdir(parents=True, exist_ok=True)
+    with open(stage_dir / ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_marker(stage_dir, name="done"):
+    """
+    (key, checksums) recorded in the done marker of stage_dir (or its
+    marker name), checksums mapping output names to their sha256, or None
+    without a marker. A marker from before checksums were recorded has none
+    (and at most a key).
+    """
+    try:
+        lines = (Path(stage_dir) / name).read_text().splitlines()
+    except OSError:
+        return None
+    key, checksums = None, {}
+    for line in lines:
+        fields = line.split(maxsplit=1)
+        if not fields:
+            continue
+        if len(fields) == 1:
+            key = fields[0]
+        elif fields[0] == "key":
+            key = fields[1]
+        else:
+            checksums[fields[1]] = fields[0]
+    return key, checksums
+
+
+def write_marker(stage_dir, outputs, key=None, name="done"):
+    """Mark stage_dir done with the checksums of outputs (and a cache key)."""
+    stage_dir = Path(stage_dir)
+    lines = [] if key is None else [f"key {key}"]
+    for fp in outputs:
+        lines.append(f"{cache.digest(fp)}  {os.path.relpath(fp, stage_dir)}")
+    tmp = stage_dir / f".{name}.tmp{os.getpid()}"
+    tmp.write_text("".join(f"{line}\n" for line in lines))
+    os.replace(tmp, stage_dir / name)
+
+
+def is_done(stage_dir, outputs, key=None, validate=None, name="done"):
+    """
+    Whether the done marker of stage_dir (or its marker name) records
+    outputs as they are (and key, if given). The outputs of a marker without
+    checksums, left by earlier versions of the scripts, are checked with
+    validate(path) and their checksums recorded if they pass; without
+    validate they are run again.
+    """
+    marker = read_marker(stage_dir, name)
+    if marker is None or (key is not None and marker[0] != key):
+        return False
+    checksums = marker[1]
+    names = [os.path.relpath(fp, stage_dir) for fp in outputs]
+    try:
+        if checksums:
+            return all(
+                name in checksums and cache.digest(fp) == checksums[name]
+                for name, fp in zip(names, outputs)
+            )
+        if validate is None:
+            return False
+        for fp in outputs:
+            validate(fp)
+    except (OSError, ValueError):
+        return False
+    write_marker(stage_dir, outputs, key, name)
+    return True
+
+
+def is_complete(path):
+    """Whether path is recorded as it is by the done marker next to it."""
+    return is_done(Path(path).parent, [path])
+
+
+def parse_leaves(newick, taxon_index):
+    """Leaf bitmask of a Newick tree (see ncd.parse_clades)."""
+    try:
+        leaves, _ = ncd.parse_clades(newick, taxon_index)
+    except (IndexError, TypeError):
+        # unbalanced parentheses or empty clades
+        raise ValueError("Malformed newick string")
+    return leaves
+
+
+def count_taxa(path):
+    """Number of distinct leaf labels across the trees of a Newick file."""
+    index = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                parse_leaves(line, index)
+    return len(index)
+
+
+def validate_newick(path, leaves_of=None, empty=False):
+    """
+    Raise ValueError unless path holds one or more (any number if empty)
+    complete Newick trees, one per line, each with as many leaves as there
+    are taxa in the trees of leaves_of (if given).
+    """
+    n_leaves = count_taxa(leaves_of) if leaves_of is not None else None
+    n_trees = 0
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if not line.endswith(";"):
+                raise ValueError(f"truncated tree on line {n_trees + 1}")
+            leaves = parse_leaves(line, {})
+            if n_leaves is not None and bin(leaves).count("1") != n_leaves:
+                raise ValueError(
+                    f"tree {n_trees + 1} has {bin(leaves).count('1')} leaves, "
+                    f"expected {n_leaves}"
+                )
+            n_trees += 1
+    if not n_trees and not empty:
+        raise ValueError("no tree")
+
+
+def redirect(argv, stage_dir, tmp_dir, inputs=()):
+    """argv with the paths below stage_dir, other than inputs, below tmp_dir."""
+    stage = os.path.normpath(stage_dir)
+    inputs = {os.path.normpath(fp) for fp in inputs}
+    redirected = []
+    for arg in argv:
+        path = os.path.normpath(arg)
+        if path not in inputs and (path == stage or path.startswith(stage + os.sep)):
+            arg = f"{tmp_dir}{path[len(stage):]}{'/' if arg.endswith('/') else ''}"
+        redirected.append(arg)
+    return redirected
+
+
+def run_atomic(argv, stage_dir, outputs, inputs=(), runner=None, validate=None):
+    """
+    Run a tool under /usr/bin/time -v (or runner(argv, out, err)) with its
+    outputs below stage_dir written to a temporary directory, check them
+    with validate(path), then rename everything it wrote, run.out and
+    run.err included, into stage_dir. Must be called holding the lock of
+    stage_dir. Raises RuntimeError if an output is missing or invalid,
+    leaving the outputs of earlier runs alone.
+    """
+    stage_dir = Path(stage_dir)
+    # the outputs are replaced, so the stage is not done until marked again
+    (stage_dir / "done").unlink(missing_ok=True)
+    # left over by runs killed while holding the lock
+    for stale in stage_dir.glob(".tmp*"):
+        shutil.rmtree(stale, ignore_errors=True)
+    tmp_dir = stage_dir / f".tmp{os.getpid()}"
+    tmp_dir.mkdir()
+
+    try:
+        tmp_argv = redirect(argv, stage_dir, tmp_dir, inputs)
+        with open(tmp_dir / "run.out", "w") as out, open(
+            tmp_dir / "run.err", "w"
+        ) as err:
+            if runner is None:
+                subprocess.run(
+                    ["/usr/bin/time", "-v"] + tmp_argv, stdout=out, stderr=err
+                )
+            else:
+                runner(tmp_argv, out, err)
+
+        tmp_outputs = [
+            Path(redirect([str(fp)], stage_dir, tmp_dir)[0]) for fp in outputs
+        ]
+        error = None
+        for fp, tmp_fp in zip(outputs, tmp_outputs):
+            if not tmp_fp.exists():
+                error = f"{argv[0]} did not produce {fp}"
+            elif validate is not None:
+                try:
+                    validate(tmp_fp)
+                except (OSError, ValueError) as e:
+                    error = f"{argv[0]} produced an invalid {fp}: {e}"
+            if error:
+                break
+        if error:
+            for log in ["run.out", "run.err"]:
+                os.replace(tmp_dir / log, stage_dir / log)
+            raise RuntimeError(error)
+
+        for entry in tmp_dir.iterdir():
+            dst = stage_dir / entry.name
+            if dst.is_dir() and not dst.is_symlink():
+                shutil.rmtree(dst)
+            os.replace(entry, dst)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Run a pipeline stage once, under its lock.",
+        usage="stage.py stage_dir output [output ...] [--inputs ...] -- command ...",
+    )
+    parser.add_argument("stage_dir", type=str, help="Stage directory.")
+    parser.add_argument(
+        "outputs", type=str, nargs="+", help="Outputs, relative to stage_dir."
+    )
+    parser.add_argument(
+        "--inputs",
+        type=str,
+        nargs="+",
+        default=[],
+        help="Inputs of the command inside stage_dir (left in place).",
+    )
+    parser.add_argument(
+        "--newick",
+        action="store_true",
+        help="Check that the outputs are complete Newick trees.",
+    )
+    parser.add_argument(
+        "--leaves-of",
+        type=str,
+        default=None,
+        help="Newick file whose taxa every output tree must have (with --newick).",
+    )
+    split = argv.index("--") if "--" in argv else len(argv)
+    args = parser.parse_args(argv[:split])
+    args.command = argv[split + 1 :]
+    if not args.command:
+        parser.error("no command given after --")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    stage_dir = Path(args.stage_dir)
+    outputs = [stage_dir / name for name in args.outputs]
+    validate = None
+    if args.newick:
+        validate = partial(validate_newick, leaves_of=args.leaves_of)
+
+    with locked(stage_dir):
+        if is_done(stage_dir, outputs, validate=validate):
+            print(f"{stage_dir} already done")
+            sys.exit(0)
+        print(f"Running {stage_dir}")
+        try:
+            run_atomic(args.command, stage_dir, outputs, args.inputs, validate=validate)
+        except RuntimeError as e:
+            print(e)
+            sys.exit(1)
+        write_marker(stage_dir, outputs)
@@ -6,4 +6,4 @@
 #SBATCH --partition=secondary
 #SBATCH --mem=32G
 
-/usr/bin/time -v python agg_result.py --input output/trees/ --output ncd.csv --reference data/trees/
\ No newline at end of file
+/usr/bin/time -v python agg_result.py --input output/trees/ --output ncd.csv --reference data/trees/ --scan
\ No newline at end of file
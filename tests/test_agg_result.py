@@ -0,0 +1,70 @@
+import pandas as pd
+
+from agg_result import ResultSink
+
+PARAMS = {"input": "/out", "reference": "/ref", "mode": "scan"}
+
+
+def rows(replicate, n):
+    """n result rows of replicate, with the columns save_sorted_results sorts by."""
+    id, run_id = replicate.split("/")
+    return [
+        {
+            "num_species": int(id.split("_")[0]),
+            "unrooted_s_tree": "trues",
+            "n_genes": n_genes,
+            "dup_rate": 1e-12,
+            "loss_rate_indicator": 1,
+            "hILS": False,
+            "g_type": "true",
+            "run_id": int(run_id),
+            "method": "STRIDE",
+            "sampling_method": None,
+            "sampling_mult": None,
+            "ncd": 0.5,
+        }
+        for n_genes in range(n)
+    ]
+
+
+def interrupted(output_file, params=PARAMS):
+    """A sink with one checkpointed replicate and one that was not."""
+    sink = ResultSink(output_file, params, batch_size=2)
+    sink.add("20_gdl_1e-12_1/01", rows("20_gdl_1e-12_1/01", 2))
+    sink.add("20_gdl_1e-12_1/02", rows("20_gdl_1e-12_1/02", 1))
+    return sink
+
+
+def test_resume_after_checkpoint(tmp_path):
+    output_file = tmp_path / "ncd.csv"
+    interrupted(output_file)
+
+    sink = ResultSink(output_file, PARAMS, batch_size=2)
+    assert sink.done == {"20_gdl_1e-12_1/01"}
+    sink.add("20_gdl_1e-12_1/02", rows("20_gdl_1e-12_1/02", 1))
+    sink.close()
+    assert len(pd.read_csv(output_file)) == 3
+    assert not sink.ckpt_file.exists() and not sink.rows_file.exists()
+
+
+def test_start_over_with_other_params(tmp_path):
+    output_file = tmp_path / "ncd.csv"
+    interrupted(output_file)
+
+    for key, value in [("input", "/other"), ("reference", None), ("mode", "grid")]:
+        sink = ResultSink(output_file, {**PARAMS, key: value}, batch_size=2)
+        assert sink.done == set()
+        assert sink.rows_file.read_text() == ""
+        interrupted(output_file)
+
+
+def test_start_over_without_rows(tmp_path):
+    output_file = tmp_path / "ncd.csv"
+    sink = interrupted(output_file)
+    sink.rows_file.unlink()
+
+    sink = ResultSink(output_file, PARAMS, batch_size=2)
+    assert sink.done == set()
+    sink.add("20_gdl_1e-12_1/01", rows("20_gdl_1e-12_1/01", 1))
+    sink.close()
+    assert len(pd.read_csv(output_file)) == 1
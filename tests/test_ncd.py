@@ -0,0 +1,236 @@
+import random
+
+import dendropy
+import numpy as np
+import pytest
+from dendropy.calculate import treecompare
+
+import ncd
+
+LABELS = [f"t{i}" for i in range(12)]
+
+
+def random_newick(rng, labels):
+    """A random rooted binary tree on labels, as a Newick string."""
+    nodes = list(labels)
+    while len(nodes) > 1:
+        a = nodes.pop(rng.randrange(len(nodes)))
+        b = nodes.pop(rng.randrange(len(nodes)))
+        nodes.append(f"({a},{b})")
+    return nodes[0] + ";"
+
+
+def random_pair(rng):
+    """Two random trees on partly overlapping leaf sets (4 or more shared)."""
+    shared = rng.sample(LABELS, rng.randint(4, len(LABELS)))
+    rest = [label for label in LABELS if label not in shared]
+    extra1 = rng.sample(rest, rng.randint(0, len(rest)))
+    extra2 = rng.sample(rest, rng.randint(0, len(rest)))
+    return random_newick(rng, shared + extra1), random_newick(rng, shared + extra2)
+
+
+def dendropy_distance(newick1, newick2):
+    tns = dendropy.TaxonNamespace()
+    trees = [
+        dendropy.Tree.get(
+            data=newick, schema="newick", rooting="force-rooted", taxon_namespace=tns
+        )
+        for newick in (newick1, newick2)
+    ]
+    return ncd.clade_distance(*trees)
+
+
+def bitset_distances(newick1, newick2):
+    """bitset_clade_distance and ReferenceClades.distance of the two trees."""
+    index = {}
+    cl1 = ncd.parse_clades(newick1, index)
+    cl2 = ncd.parse_clades(newick2, index)
+    return ncd.bitset_clade_distance(cl1, cl2), ncd.ReferenceClades(*cl1).distance(cl2)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_backends_agree_on_random_trees(seed):
+    rng = random.Random(seed)
+    newick1, newick2 = random_pair(rng)
+    nl, cd = dendropy_distance(newick1, newick2)
+    for bitset_nl, bitset_cd in bitset_distances(newick1, newick2):
+        assert bitset_nl == nl
+        assert bitset_cd == pytest.approx(cd)
+
+
+def test_reference_clades_reused_across_estimates():
+    rng = random.Random(0)
+    ref = random_newick(rng, LABELS)
+    index = {}
+    reference = ncd.ReferenceClades(*ncd.parse_clades(ref, index))
+    for _ in range(20):
+        est = random_newick(rng, rng.sample(LABELS, rng.randint(4, len(LABELS))))
+        cl2 = ncd.parse_clades(est, index)
+        assert reference.distance(cl2) == ncd.bitset_clade_distance(
+            ncd.parse_clades(ref, index), cl2
+        )
+        assert reference.distance(cl2) == pytest.approx(dendropy_distance(ref, est))
+
+
+def test_identical_trees():
+    newick = random_newick(random.Random(1), LABELS)
+    assert dendropy_distance(newick, newick) == (len(LABELS), 0.0)
+    for distance in bitset_distances(newick, newick):
+        assert distance == (len(LABELS), 0.0)
+
+
+def test_single_shared_leaf():
+    newick1, newick2 = "((A,B),(C,D));", "((A,E),(F,G));"
+    nl, cd = dendropy_distance(newick1, newick2)
+    assert (nl, cd) == (1, 0.0)
+    for distance in bitset_distances(newick1, newick2):
+        assert distance == (nl, cd)
+
+
+def test_labels_read_as_dendropy_reads_them():
+    newick1 = "(('a b',C_1),(D,E));"
+    newick2 = "((a_b,D),(C_1,E));"
+    nl, cd = dendropy_distance(newick1, newick2)
+    for distance in bitset_distances(newick1, newick2):
+        assert distance == (nl, pytest.approx(cd))
+
+
+def dendropy_rf(newick1, newick2):
+    """Normalized RF distance of the unrooted trees on their common leaves."""
+    tns = dendropy.TaxonNamespace()
+    trees = [
+        dendropy.Tree.get(
+            data=newick, schema="newick", rooting="force-unrooted", taxon_namespace=tns
+        )
+        for newick in (newick1, newick2)
+    ]
+    labels = [{leaf.taxon.label for leaf in tree.leaf_node_iter()} for tree in trees]
+    common = labels[0] & labels[1]
+    for tree in trees:
+        tree.retain_taxa_with_labels(common)
+    rf = treecompare.symmetric_difference(*trees)
+    return rf / (2 * len(common) - 6)
+
+
+def metrics(newick1, newick2):
+    index = {}
+    cl1 = ncd.parse_clades(newick1, index)
+    cl2 = ncd.parse_clades(newick2, index)
+    return ncd.clade_metrics(cl1, cl2), ncd.ReferenceClades(*cl1).metrics(cl2)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_metrics_on_random_trees(seed):
+    rng = random.Random(seed)
+    newick1, newick2 = random_pair(rng)
+    nl, cd = dendropy_distance(newick1, newick2)
+    (nl1, m1), (nl2, m2) = metrics(newick1, newick2)
+    assert nl1 == nl2 == nl
+    assert m1 == pytest.approx(m2, nan_ok=True)
+    assert m1["ncd"] == pytest.approx(cd)
+    assert m1["rf"] == pytest.approx(dendropy_rf(newick1, newick2))
+    # the roots of random binary trees are binary
+    assert m1["correct_root"] in (0, 1)
+    if m1["correct_root"]:
+        assert m1["root_distance"] == 0
+
+
+@pytest.mark.parametrize(
+    "est, correct_root, root_distance",
+    [
+        ("((A,B),(C,D));", 1, 0),
+        ("((B,A),(D,C));", 1, 0),
+        ("(A,(B,(C,D)));", 0, 1),
+        ("(D,(C,(A,B)));", 0, 1),
+        ("(((A,C),B),D);", 0, None),
+    ],
+)
+def test_root_metrics(est, correct_root, root_distance):
+    for _, m in metrics("((A,B),(C,D));", est):
+        assert m["correct_root"] == correct_root
+        if root_distance is None:
+            assert m["root_distance"] != m["root_distance"]
+        else:
+            assert m["root_distance"] == root_distance
+
+
+def test_root_distance_counts_edges_to_the_true_root():
+    ref = "(((A,B),C),((D,E),F));"
+    est = "(A,(B,(C,((D,E),F))));"
+    for _, m in metrics(ref, est):
+        assert m["correct_root"] == 0
+        # the true root edge is above ((D,E),F), under (C,...) and (B,...)
+        assert m["root_distance"] == 2
+        assert m["rf"] == pytest.approx(dendropy_rf(ref, est))
+
+
+def test_non_binary_reference_root():
+    for _, m in metrics("(A,B,(C,D));", "((A,B),(C,D));"):
+        assert m["correct_root"] != m["correct_root"]
+        assert m["root_distance"] != m["root_distance"]
+
+
+def test_pairwise_distances_match_pairs():
+    rng = random.Random(3)
+    shared = LABELS[:8]
+    newicks = [
+        random_newick(rng, shared + rng.sample(LABELS[8:], rng.randint(0, 4)))
+        for _ in range(30)
+    ]
+    # some trees on the same leaf set, compared with each other unrestricted
+    newicks += [random_newick(rng, LABELS[:10]) for _ in range(5)]
+    index = {}
+    trees = [ncd.parse_clades(newick, index) for newick in newicks]
+    # small blocks, so the matrix is filled from many of them
+    nl, matrix = ncd.pairwise_clade_distances(trees, max_bytes=256)
+    assert nl == len(shared)
+
+    # every pair on the leaves the two trees share, as clade_distance
+    for i, t1 in enumerate(trees):
+        for j, t2 in enumerate(trees):
+            assert matrix[i, j] == pytest.approx(ncd.bitset_clade_distance(t1, t2)[1])
+    assert (matrix == matrix.T).all()
+
+
+def test_pairwise_distances_of_pairs_without_common_leaves():
+    rng = random.Random(5)
+    index = {}
+    leaf_sets = [LABELS[:5], LABELS[:5], LABELS[3:8], LABELS[8:]]
+    trees = [ncd.parse_clades(random_newick(rng, ls), index) for ls in leaf_sets]
+    nl, matrix = ncd.pairwise_clade_distances(trees)
+    assert nl == 0
+    # not on the leaves of all the trees, which are none
+    assert matrix[0, 1] == pytest.approx(
+        ncd.bitset_clade_distance(trees[0], trees[1])[1]
+    )
+    # with 2 common leaves, or none, a pair has no distance
+    assert np.isnan(matrix[[0, 1, 2, 3, 3, 3], [2, 2, 0, 0, 1, 2]]).all()
+    assert not np.isnan(matrix[[0, 1, 2, 3], [0, 1, 2, 3]]).any()
+
+
+def test_write_pairs(tmp_path):
+    rng = random.Random(4)
+    index = {}
+    trees = [ncd.parse_clades(random_newick(rng, LABELS), index) for _ in range(5)]
+    labels = [f"tree{i}" for i in range(5)]
+    _, expected = ncd.pairwise_clade_distances(trees)
+
+    ncd.write_pairs(str(tmp_path / "pairs.npy"), trees, labels)
+    assert (np.load(tmp_path / "pairs.npy") == expected).all()
+
+    ncd.write_pairs(str(tmp_path / "pairs.tsv"), trees, labels)
+    lines = (tmp_path / "pairs.tsv").read_text().splitlines()
+    assert lines[0].split("\t") == [""] + labels
+    rows = [line.split("\t") for line in lines[1:]]
+    assert [row[0] for row in rows] == labels
+    assert (
+        np.array([row[1:] for row in rows], dtype=float).tolist() == expected.tolist()
+    )
+
+
+def test_popcount_rows_without_bitwise_count(monkeypatch):
+    words = np.random.default_rng(5).integers(0, 2**63, (4, 7, 3), dtype=np.uint64)
+    expected = [[sum(bin(int(w)).count("1") for w in row) for row in m] for m in words]
+    assert ncd.popcount_rows(words).tolist() == expected
+    monkeypatch.delattr(np, "bitwise_count", raising=False)
+    assert ncd.popcount_rows(words).tolist() == expected
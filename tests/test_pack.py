@@ -0,0 +1,137 @@
+import os
+import random
+import time
+
+import pytest
+
+import pack
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    # older than the racy window, so incremental packs trust the mtime
+    old = time.time_ns() - 10 * pack.RACY_NS
+    os.utime(path, ns=(old, old))
+
+
+def trees(rng, n):
+    return b"".join(f"((a,b):{rng.random()},(c,d));\n".encode() for _ in range(n))
+
+
+@pytest.fixture
+def src(tmp_path):
+    rng = random.Random(0)
+    src = tmp_path / "trees"
+    genes = trees(rng, 2000)
+    for replicate in ["20_gdl_1e-12_1/01", "20_gdl_1e-12_1_hILS/01"]:
+        write(src / replicate / "g_true.trees", genes)
+        write(
+            src / replicate / "trueg/50/g_multi.trees",
+            genes[: genes.index(b"\n", 50000) + 1],
+        )
+        write(src / replicate / "trueg/50/split/g_multi_00000.tree", genes[:40])
+        write(src / replicate / "trueg/50/disco/done", b"")
+        genes = trees(rng, 2000)
+    write(src / "20_gdl_1e-12_1/01/blob.npz", rng.randbytes(3 * pack.MAX_CHUNK))
+    # left out of the archive
+    write(src / "20_gdl_1e-12_1/01/trueg/50/disco/.lock", b"")
+    write(src / "20_gdl_1e-12_1/01/trueg/50/disco/.tmp123/g_single.trees", b"(a")
+    return src
+
+
+def contents(root):
+    return {
+        str(path.relative_to(root)): path.read_bytes()
+        for path in root.rglob("*")
+        if path.is_file()
+    }
+
+
+def archived(src):
+    return {
+        rel: data
+        for rel, data in contents(src).items()
+        if not rel.endswith(".lock") and ".tmp" not in rel
+    }
+
+
+def test_round_trip(src, tmp_path):
+    pack.pack(src, tmp_path / "a.pack", block_size=1 << 16)
+    archive = pack.Archive(tmp_path / "a.pack")
+    assert archive.unpack(tmp_path / "out") == len(archived(src))
+    assert contents(tmp_path / "out") == archived(src)
+    for rel, data in archived(src).items():
+        assert archive.read(rel) == data
+        assert (
+            os.stat(tmp_path / "out" / rel).st_mtime_ns
+            == os.stat(src / rel).st_mtime_ns
+        )
+
+
+def test_shared_content_stored_once(src, tmp_path):
+    pack.pack(src, tmp_path / "a.pack")
+    archive = pack.Archive(tmp_path / "a.pack")
+    stored = sum(length for _, _, length in archive.chunks.values())
+    unique = sum(
+        len(data)
+        for rel, data in archived(src).items()
+        if rel.endswith(("g_true.trees", ".npz"))
+    )
+    copies = sum(len(data) for data in archived(src).values()) - unique
+    assert copies > 100000
+    # the prefixes and split files only add the chunks they end in
+    assert unique <= stored < unique + 20000
+
+
+def test_unpack_one_replicate(src, tmp_path):
+    pack.pack(src, tmp_path / "a.pack")
+    archive = pack.Archive(tmp_path / "a.pack")
+    archive.unpack(tmp_path / "out", ["20_gdl_1e-12_1_hILS/01/"])
+    expected = {
+        rel: data
+        for rel, data in archived(src).items()
+        if rel.startswith("20_gdl_1e-12_1_hILS/01/")
+    }
+    assert expected and contents(tmp_path / "out") == expected
+
+
+def test_incremental(src, tmp_path, capsys):
+    pack.pack(src, tmp_path / "a.pack")
+    size = os.path.getsize(tmp_path / "a.pack" / "data")
+
+    pack.pack(src, tmp_path / "a.pack", incremental=True)
+    assert "Read 0 new or modified" in capsys.readouterr().out
+    assert os.path.getsize(tmp_path / "a.pack" / "data") == size
+
+    write(src / "20_gdl_1e-12_1/01/trueg/50/disco/done", b"abc  g_single.trees\n")
+    write(src / "20_gdl_1e-12_1/01/metrics.tsv", b"tree\tncd\n")
+    (src / "20_gdl_1e-12_1_hILS/01/trueg/50/split/g_multi_00000.tree").unlink()
+    pack.pack(src, tmp_path / "a.pack", incremental=True)
+    assert "Read 2 new or modified" in capsys.readouterr().out
+
+    pack.Archive(tmp_path / "a.pack").unpack(tmp_path / "out")
+    assert contents(tmp_path / "out") == archived(src)
+
+
+def test_interrupted_pack_is_discarded(src, tmp_path):
+    pack.pack(src, tmp_path / "a.pack")
+    # blocks appended by a pack killed before writing its index
+    with open(tmp_path / "a.pack" / "data", "ab") as f:
+        f.write(b"garbage")
+    write(src / "20_gdl_1e-12_1/01/new.tree", b"(a,b);\n")
+    pack.pack(src, tmp_path / "a.pack", incremental=True)
+    pack.Archive(tmp_path / "a.pack").unpack(tmp_path / "out")
+    assert contents(tmp_path / "out") == archived(src)
+
+
+def test_corrupt_chunk_detected(src, tmp_path):
+    pack.pack(src, tmp_path / "a.pack")
+    archive = pack.Archive(tmp_path / "a.pack")
+    rel = "20_gdl_1e-12_1/01/g_true.trees"
+    block, offset, length = archive.chunks[archive.files[rel][2][0]]
+    data = bytearray(archive._block(block))
+    data[offset] ^= 1
+    archive._cached_block = (block, bytes(data))
+    with pytest.raises(ValueError):
+        archive.read(rel)
@@ -0,0 +1,117 @@
+import matplotlib
+
+matplotlib.use("Agg")
+
+import pandas as pd
+import pytest
+
+from plot_result_1x2 import DISCO_METHODS, plot_scaling
+from results import RESOURCE_COLUMNS, ResultIndex
+
+MULTS = [1, 5, 10, 50]
+COST = {"wall_time": 2.0, "max_rss": 4096.0}
+
+
+def result_rows(sweep):
+    """
+    Rows of two trues replicates at every mult, with the costs agg_result.py
+    reads for runs of their own or, with sweep, for runs of one sweep.
+    """
+    rows = []
+    for run_id in [1, 2]:
+        base = {
+            "num_species": 20,
+            "unrooted_s_tree": "trues",
+            "n_genes": 1000,
+            "dup_rate": 1e-12,
+            "loss_rate_indicator": 1,
+            "hILS": False,
+            "g_type": "true",
+            "run_id": run_id,
+            "ncd": 0.1,
+            **dict.fromkeys(RESOURCE_COLUMNS),
+            "disco_wall_time": 1.0,
+            "disco_max_rss": 1024.0,
+        }
+        for method in DISCO_METHODS:
+            for mult in MULTS:
+                row = {
+                    **base,
+                    "method": method,
+                    "sampling_method": "le",
+                    "sampling_mult": mult,
+                }
+                for y, cost in COST.items():
+                    if sweep:
+                        row[f"sweep_{y}"] = 10 * cost
+                    else:
+                        row[y] = mult * cost
+                rows.append(row)
+        rows.append(
+            {
+                **base,
+                "method": "STRIDE",
+                "sampling_method": None,
+                "sampling_mult": None,
+                "wall_time": 3.0,
+                "max_rss": 2048.0,
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def plotted(fig):
+    """Points of the mean line of each method, by its label."""
+    ax = fig.axes[0]
+    return {
+        line.get_label(): list(zip(*line.get_data()))
+        for line in ax.get_lines()
+        if not line.get_label().startswith("_")
+    }
+
+
+@pytest.mark.parametrize("source", [pd.DataFrame, ResultIndex])
+def test_scaling_of_runs_of_their_own(source):
+    fig = plot_scaling(
+        source(result_rows(sweep=False)),
+        {"sampling_mult": MULTS, "sampling_method": "le"},
+        "sampling_mult",
+        "Multiplicity",
+        methods=DISCO_METHODS,
+    )
+    lines = plotted(fig)
+    assert sorted(lines) == ["DISCO+QR (~x^0.90)", "DISCO+QR-STAR (~x^0.90)"]
+    # the stage plus DISCO; the true species tree costs nothing
+    assert lines["DISCO+QR (~x^0.90)"] == [(m, m * 2.0 + 1.0) for m in MULTS]
+
+
+@pytest.mark.parametrize("y", ["wall_time", "max_rss"])
+@pytest.mark.parametrize("source", [pd.DataFrame, ResultIndex])
+def test_scaling_of_sweeps(source, y):
+    fig = plot_scaling(
+        source(result_rows(sweep=True)),
+        {"sampling_mult": MULTS, "sampling_method": "le"},
+        "sampling_mult",
+        "Multiplicity",
+        y=y,
+        methods=DISCO_METHODS,
+    )
+    lines = plotted(fig)
+    assert sorted(lines) == ["DISCO+QR (sweep)", "DISCO+QR-STAR (sweep)"]
+    # one point per sweep, at its largest mult, with the cost of the sweep
+    expected = 10 * 2.0 + 1.0 if y == "wall_time" else 10 * 4096.0 / 1024
+    assert lines["DISCO+QR (sweep)"] == [(50, expected)]
+
+
+def test_scaling_of_sweeps_at_one_mult():
+    # the number-of-species figures select mult 50 of DISCO beside STRIDE
+    fig = plot_scaling(
+        ResultIndex(result_rows(sweep=True)),
+        {"sampling_mult": [None, 50], "sampling_method": [None, "le"]},
+        "num_species",
+        "Number of Species",
+    )
+    lines = plotted(fig)
+    assert sorted(lines) == ["DISCO+QR (sweep)", "DISCO+QR-STAR (sweep)", "STRIDE"]
+    assert lines["DISCO+QR-STAR (sweep)"] == [(21, 21.0)]
+    assert lines["STRIDE"] == [(21, 3.0)]
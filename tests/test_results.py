@@ -0,0 +1,99 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from results import (
+    ResultIndex,
+    filter_results,
+    read_results,
+    to_store_types,
+    write_results,
+)
+
+VALUES = {
+    "num_species": [20, 50, 100],
+    "unrooted_s_tree": ["trues", "astrid", "astral"],
+    "n_genes": [50, 100, 500],
+    "dup_rate": [1e-12, 1e-10],
+    "loss_rate_indicator": [0, 1],
+    "hILS": [False, True],
+    "g_type": ["true", "50"],
+    "run_id": [1, 2, 3],
+}
+
+
+def random_results(n_rows, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(n_rows):
+        row = {col: rng.choice(values) for col, values in VALUES.items()}
+        row["method"] = rng.choice(["DISCO+QR", "DISCO+QR-STAR", "STRIDE"])
+        if row["method"] == "STRIDE":
+            row["sampling_method"], row["sampling_mult"] = None, None
+        else:
+            row["sampling_method"] = "le"
+            row["sampling_mult"] = rng.choice([1, 5, 10, 50])
+        row["ncd"] = rng.random()
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def random_filters(rng):
+    """Filters as the figures build them: values, lists and None."""
+    choices = {
+        **VALUES,
+        "method": ["DISCO+QR", "DISCO+QR-STAR", "STRIDE"],
+        "sampling_method": ["le", None],
+        "sampling_mult": [1, 5, 10, 50, None],
+    }
+    filters = {}
+    for col in rng.sample(sorted(choices), rng.randint(0, 5)):
+        if rng.random() < 0.5:
+            filters[col] = rng.choice(choices[col])
+        else:
+            filters[col] = rng.sample(choices[col], rng.randint(1, len(choices[col])))
+    return filters
+
+
+def same_rows(df1, df2):
+    def plain(df):
+        df = df.reset_index(drop=True).astype(object)
+        return df.where(df.notna(), None).values.tolist()
+
+    return list(df1.columns) == list(df2.columns) and plain(df1) == plain(df2)
+
+
+@pytest.mark.parametrize("store_types", [False, True])
+def test_index_select_matches_filter_results(store_types):
+    df = random_results(500)
+    if store_types:
+        df = to_store_types(df)
+    index = ResultIndex(df)
+    rng = random.Random(1)
+    for _ in range(200):
+        filters = random_filters(rng)
+        assert same_rows(index.select(filters), filter_results(df, filters)), filters
+
+
+def test_index_select_columns():
+    df = random_results(100)
+    filters = {"method": ["DISCO+QR", "STRIDE"], "sampling_mult": [None, 5]}
+    selected = ResultIndex(df).select(filters, columns=["run_id", "ncd"])
+    assert same_rows(selected, filter_results(df, filters)[["run_id", "ncd"]])
+
+
+def test_store_round_trip(tmp_path):
+    df = random_results(300)
+    write_results(df, tmp_path / "results.parquet")
+    rng = random.Random(2)
+    for _ in range(20):
+        filters = random_filters(rng)
+        read = read_results(tmp_path / "results.parquet", filters=filters)
+        expected = filter_results(to_store_types(df), filters)
+        key = ["num_species", "hILS", "ncd"]
+        read = read.sort_values(key)
+        expected = expected[read.columns].sort_values(key)
+        assert np.allclose(read["ncd"], expected["ncd"])
+        assert same_rows(read.drop(columns="ncd"), expected.drop(columns="ncd"))